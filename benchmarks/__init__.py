@@ -0,0 +1,12 @@
+"""
+Benchmarks for iyore.
+
+    python -m benchmarks [--depth 3] [--fanout 10] [--files 100] [--repeats 5] [--output results.json]
+
+generates a synthetic tree (see benchmarks.tree), times the scenarios in benchmarks.scenarios on it,
+and writes the results as JSON, so runs on different versions of iyore can be compared with
+`python -m benchmarks --compare old.json new.json`.
+
+benchmarks/bench_matches.py, benchmarks/startup.py and benchmarks/memory.py are standalone
+micro-benchmarks of Pattern matching, of start-up time and of the memory held by Entries.
+"""
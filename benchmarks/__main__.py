@@ -0,0 +1,63 @@
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+
+from . import tree, scenarios
+
+
+def compare(oldPath, newPath):
+    # print the change in median time of each scenario in both results files
+    with open(oldPath) as f:
+        old = json.load(f)["scenarios"]
+    with open(newPath) as f:
+        new = json.load(f)["scenarios"]
+    for name in sorted(set(old) & set(new)):
+        ratio = new[name]["median"] / old[name]["median"] if old[name]["median"] else float("inf")
+        note = "" if old[name]["found"] == new[name]["found"] else "  (found {} vs {}: not the same work!)".format(new[name]["found"], old[name]["found"])
+        print("{:>20}: {:9.2f} ms -> {:9.2f} ms  {:5.2f}x{}".format(name, 1e3 * old[name]["median"], 1e3 * new[name]["median"], ratio, note))
+
+
+def main(argv= None):
+    parser = argparse.ArgumentParser(prog= "python -m benchmarks", description= "Time iyore queries on a synthetic directory tree")
+    parser.add_argument("--depth", type= int, default= 3, help= "levels in the tree, including the files (default 3)")
+    parser.add_argument("--fanout", type= int, default= 10, help= "subdirectories per directory (default 10)")
+    parser.add_argument("--files", type= int, default= 100, help= "files per leaf directory (default 100)")
+    parser.add_argument("--jitter", type= float, default= 0, help= "vary each directory's number of entries by up to this fraction (default 0)")
+    parser.add_argument("--seed", type= int, default= 0)
+    parser.add_argument("--root", help= "where to make the tree (reused if it's already there); default: a temporary directory")
+    parser.add_argument("--scenarios", help= "comma-separated names of the scenarios to run (default: all)")
+    parser.add_argument("--repeats", type= int, default= 5)
+    parser.add_argument("--output", help= "file to write the JSON results to (default: stdout)")
+    parser.add_argument("--compare", nargs= 2, metavar= ("OLD", "NEW"), help= "compare two results files instead of running")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    levels = tree.standardLevels(args.depth, args.fanout, args.files)
+    root = args.root or tempfile.mkdtemp(prefix= "iyore-bench-")
+    try:
+        log = lambda message: print(message, file= sys.stderr)
+        log("Tree of ~{} files in {}".format(tree.countFiles(levels), root))
+        structurePath = tree.makeTree(root, levels, seed= args.seed, jitter= args.jitter)
+        results = scenarios.run(structurePath, args.scenarios.split(",") if args.scenarios else None, args.repeats, log)
+        results["tree"] = {"depth": args.depth, "fanout": args.fanout, "files": args.files, "jitter": args.jitter, "seed": args.seed}
+        output = json.dumps(results, indent= 2, sort_keys= True)
+        if args.output:
+            with open(args.output, "w") as f:
+                f.write(output + "\n")
+        else:
+            print(output)
+    finally:
+        if not args.root:
+            shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Micro-benchmark of Pattern.matches against a large allow-list.
+
+Compares testing each name with the restriction as given (Pattern.allows, which works out
+the restriction's type and scans the list for every name) against testing it with the restriction
+compiled once by Pattern.predicates, the way a walk does.
+
+    python benchmarks/bench_matches.py [n_names] [n_allowed]
+"""
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import iyore
+
+# time.perf_counter where available (Python 3.3+), like benchmarks/scenarios.py
+clock = getattr(time, "perf_counter", time.time)
+
+
+def run(n_names= 100000, n_allowed= 10000):
+    pattern = iyore.Pattern(r"(?P<site>[A-Z]{4})_(?P<num>\d+)\.txt")
+    names = ["ABCD_{}.txt".format(i) for i in range(n_names)]
+    allowed = [str(i) for i in range(0, 2 * n_allowed, 2)]
+
+    def raw(name):
+        match = pattern.regex.match(name)
+        return match is not None and iyore.Pattern.allows(allowed, match.group("num"), "num")
+
+    predicates = iyore.Pattern.predicates({"num": allowed})
+    compiled = lambda name: pattern._matches(name, predicates) is not None
+
+    # the raw version is quadratic; time it on a sample and scale up
+    sample = names[:max(1, n_names // 100)]
+    results = {}
+    for label, func, subset in [("raw", raw, sample), ("compiled", compiled, names)]:
+        start = clock()
+        count = sum(1 for name in subset if func(name))
+        elapsed = clock() - start
+        results[label] = elapsed / len(subset)
+        print("{:>9}: {:8.3f} us/name ({} of {} names matched)".format(label, 1e6 * results[label], count, len(subset)))
+
+    print("  speedup: {:.0f}x".format(results["raw"] / results["compiled"]))
+    return results
+
+
+if __name__ == "__main__":
+    run(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,58 @@
+"""
+Memory benchmark: bytes held by the Entries of a full walk, kept in a list, as a script holding a
+large Subset in memory would.
+
+Measured with tracemalloc (Python 3.4+), so it counts Python allocations only, not interpreter overhead.
+Each measurement is a fresh Python process.
+
+    python benchmarks/memory.py [fanout] [files]
+"""
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import subprocess
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+from benchmarks.tree import standardLevels, makeTree, countFiles
+
+# run in a fresh interpreter: prints {"entries": n, "held": bytes, "withPaths": bytes}
+child = """
+import sys, json, tracemalloc
+sys.path.insert(0, {root!r})
+import iyore
+ds = iyore.Dataset({structure!r})
+tracemalloc.start()
+entries = list(ds.data())
+held = tracemalloc.get_traced_memory()[0]
+for entry in entries:
+    entry.path
+withPaths = tracemalloc.get_traced_memory()[0]
+print(json.dumps({{"entries": len(entries), "held": held, "withPaths": withPaths}}))
+"""
+
+
+def measure(structure):
+    code = child.format(root= os.path.dirname(here), structure= structure)
+    return json.loads(subprocess.check_output([sys.executable, "-c", code]).decode("utf-8"))
+
+
+def run(fanout= 50, files= 20):
+    levels = standardLevels(depth= 3, fanout= fanout, files= files)
+    tmp = tempfile.mkdtemp()
+    try:
+        results = measure(makeTree(tmp, levels))
+        print("{} Entries ({} expected)".format(results["entries"], countFiles(levels)))
+        print("          held: {:8.1f} MB ({:.0f} bytes/Entry)".format(results["held"] / 1e6, results["held"] / results["entries"]))
+        print("  after .path: {:8.1f} MB ({:.0f} bytes/Entry)".format(results["withPaths"] / 1e6, results["withPaths"] / results["entries"]))
+        return results
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    run(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,174 @@
+"""
+Timed benchmark scenarios, each a typical query run against a synthetic tree (see tree.py).
+
+A scenario is a function of the Dataset, returning the number of things it found (so runs on different
+versions can be checked to have done the same work). `run` times each one and gives the results as a dict,
+ready to be written out as JSON.
+"""
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import os
+import io
+import sys
+import time
+import platform
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import iyore
+
+# time.perf_counter where available (Python 3.3+)
+clock = getattr(time, "perf_counter", time.time)
+
+# format version of the results, bumped if their layout changes
+resultsVersion = 1
+
+
+def withEngine(endpoint, engine):
+    # a copy of endpoint that walks with the given traversal engine
+    copied = iyore.Endpoint(endpoint.parts, endpoint.base, name= endpoint.name)
+    copied.engine = engine
+    return copied
+
+
+def prepare(ds, n= 3):
+    # what the scenarios need that shouldn't count towards their time:
+    # values: a few values of each of the Endpoint's directory-level fields, for filling in queries
+    # names: the file names in the tree
+    values = {}
+    for part in ds.data.parts[:-1]:
+        for field in part.fields:
+            values[field] = sorted(ds.data.values(field))[:n]
+    names = [ os.path.basename(entry.path) for entry in ds.data() ]
+    return {"values": values, "names": names}
+
+
+@contextlib.contextmanager
+def quiet():
+    # swallow what info() prints
+    stdout = sys.stdout
+    sys.stdout = io.StringIO() if sys.version_info[0] >= 3 else io.BytesIO()
+    try:
+        yield
+    finally:
+        sys.stdout = stdout
+
+
+def full_walk(ds, setup):
+    return sum(1 for entry in ds.data())
+
+def full_walk_listdir(ds, setup):
+    # the original os.listdir walk (Endpoint._match)
+    return sum(1 for entry in withEngine(ds.data, "listdir")())
+
+def parallel_walk(ds, setup):
+    return sum(1 for entry in ds.data(workers= 8, ordered= False))
+
+def literal_query(ds, setup):
+    # one value for each directory-level field: the walk goes straight to the matching directories
+    return sum(1 for entry in ds.data(**{ field: values[0] for field, values in setup["values"].items() }))
+
+def iterable_query(ds, setup):
+    # a few values for the top-level field
+    field = sorted(ds.data.parts[0].fields)[0]
+    return sum(1 for entry in ds.data(**{field: setup["values"][field]}))
+
+def leaf_filter(ds, setup):
+    # a restriction only the file names can answer, so every directory is listed
+    return sum(1 for entry in ds.data(unit= ["A", "C"]))
+
+def items_query(ds, setup):
+    # each combination of the first few values of the top two levels' fields
+    values = setup["values"]
+    items = [{}]
+    for field in sorted(values)[:2]:
+        items = [ dict(item, **{field: value}) for item in items for value in values[field] ]
+    return sum(1 for entry in ds.data(items= items))
+
+def sort_by_directories(ds, setup):
+    # streams out in order: only one directory's worth of Entries is sorted at once
+    fields = [ sorted(part.fields)[0] for part in ds.data.parts[:-1] ]
+    return sum(1 for entry in ds.data(sort= fields))
+
+def sort_by_file(ds, setup):
+    # has to gather everything up to sort it
+    return sum(1 for entry in ds.data(sort= "num"))
+
+def top_n(ds, setup):
+    return sum(1 for entry in ds.data(sort= "num", n= 10))
+
+def values_top_level(ds, setup):
+    field = sorted(ds.data.parts[0].fields)[0]
+    return len(ds.data.values(field))
+
+def values_leaf_level(ds, setup):
+    return len(ds.data.values("unit"))
+
+def count(ds, setup):
+    return ds.data.count()
+
+def info(ds, setup):
+    with quiet():
+        ds.data.info()
+    return len(ds.data.fields)
+
+def sampled_info(ds, setup):
+    with quiet():
+        ds.data.info(sample= 0.1, seed= 0)
+    return len(ds.data.fields)
+
+def pattern_matches(ds, setup):
+    # Pattern._matches on every file name in the tree, without any filesystem access
+    pattern = ds.data.parts[-1]
+    predicates = iyore.Pattern.predicates({"unit": ["A", "C"]}, converters= ds.data.converters)
+    return sum(1 for name in setup["names"] if pattern._matches(name, predicates) is not None)
+
+
+scenarios = [
+    full_walk, full_walk_listdir, parallel_walk, literal_query, iterable_query, leaf_filter, items_query,
+    sort_by_directories, sort_by_file, top_n, values_top_level, values_leaf_level, count, info, sampled_info,
+    pattern_matches,
+]
+
+
+def run(structurePath, names= None, repeats= 5, log= None):
+    """
+    Time each scenario (or just those named) `repeats` times on the Dataset at structurePath.
+
+    Returns a JSON-able dict of the environment and, for each scenario, its timings in seconds
+    and the number of things it found.
+    """
+    ds = iyore.Dataset(structurePath)
+    setup = prepare(ds)
+    chosen = scenarios if names is None else [ scenario for scenario in scenarios if scenario.__name__ in names ]
+    if names is not None:
+        unknown = set(names) - set(scenario.__name__ for scenario in chosen)
+        if unknown:
+            raise ValueError("Unknown scenarios: {}".format(", ".join(sorted(unknown))))
+
+    results = {}
+    for scenario in chosen:
+        timings = []
+        for i in range(repeats):
+            start = clock()
+            found = scenario(ds, setup)
+            timings.append(clock() - start)
+        timings.sort()
+        results[scenario.__name__] = {
+            "found": found,
+            "min": timings[0],
+            "median": timings[len(timings) // 2],
+            "max": timings[-1],
+            "repeats": repeats,
+        }
+        if log is not None:
+            log("{:>20}: {:9.2f} ms median, {:9.2f} ms min ({} found)".format(scenario.__name__, 1e3 * results[scenario.__name__]["median"], 1e3 * timings[0], found))
+
+    return {
+        "version": resultsVersion,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "engine": iyore.Endpoint.engine,
+        "scenarios": results,
+    }
@@ -0,0 +1,80 @@
+"""
+Startup benchmark: time to import iyore, and to create a Dataset from a large structure file,
+with and without the compiled structure cache.
+
+Each measurement is a fresh Python process, like a short-lived worker in a job array.
+
+    python benchmarks/startup.py [n_endpoints] [repeats]
+"""
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import subprocess
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+# run in a fresh interpreter: prints {"import": seconds, "dataset": seconds}
+child = """
+import sys, time, json
+clock = getattr(time, "perf_counter", time.time)
+start = clock()
+sys.path.insert(0, {root!r})
+import iyore
+imported = clock()
+ds = iyore.Dataset({structure!r}, structure_cache= {cache!r})
+ds.endpoint0().head(1)
+done = clock()
+print(json.dumps({{"import": imported - start, "dataset": done - imported}}))
+"""
+
+
+def makeStructure(path, n_endpoints):
+    # n_endpoints endpoints, each a few typed levels deep, as a big dataset's structure file might have
+    lines = []
+    for i in range(n_endpoints):
+        lines.append("instrument{}".format(i))
+        lines.append("    (?P<site>[A-Z]{{4}}\\d{{3}})_(?P<year:int>\\d{{4}})")
+        lines.append("        (?P<month:int>\\d\\d)-(?P<day:int>\\d\\d)")
+        lines.append("            endpoint{}: (?P<unit>\\w+)_(?P<hour>\\d\\d)(?P<minute>\\d\\d)(?:_(?P<note>[^.]*))?\\.(?P<ext>wav|csv|txt)".format(i))
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def measure(structure, cache, repeats):
+    code = child.format(root= os.path.dirname(here), structure= structure, cache= cache)
+    results = [ json.loads(subprocess.check_output([sys.executable, "-c", code]).decode("utf-8")) for i in range(repeats) ]
+    return { key: median([ result[key] for result in results ]) for key in ("import", "dataset") }
+
+
+def run(n_endpoints= 200, repeats= 10):
+    tmp = tempfile.mkdtemp()
+    try:
+        structure = os.path.join(tmp, ".structure.txt")
+        makeStructure(structure, n_endpoints)
+        results = {}
+        results["parse"] = measure(structure, False, repeats)
+        # write the cache once, then time loading it
+        measure(structure, True, 1)
+        results["cached"] = measure(structure, True, repeats)
+
+        print("{} endpoints, median of {} processes".format(n_endpoints, repeats))
+        print("   import iyore: {:8.1f} ms".format(1e3 * results["parse"]["import"]))
+        for label in ("parse", "cached"):
+            print("{:>7} Dataset: {:8.1f} ms".format(label, 1e3 * results[label]["dataset"]))
+        print("        speedup: {:.1f}x".format(results["parse"]["dataset"] / results["cached"]["dataset"]))
+        return results
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    run(*[int(arg) for arg in sys.argv[1:]])
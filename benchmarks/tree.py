@@ -0,0 +1,124 @@
+"""
+Generator for synthetic directory trees to benchmark iyore on, along with their structure files.
+
+A tree is described by a list of Levels, from the top down: each gives the pattern for the structure file,
+a template for the names it generates, and how many of them to make in each directory above it.
+The last Level is the files. Trees are reproducible: the same Levels and seed give the same tree.
+
+    >>> levels = standardLevels(depth= 3, fanout= 10, files= 100)
+    >>> makeTree("/tmp/bench", levels)
+    '/tmp/bench/.structure.txt'
+"""
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import os
+import json
+import random
+
+
+class Level(object):
+    # One level of a synthetic tree.
+    # pattern: regex for this level in the structure file, like r"site_(?P<site>\d{3})"
+    # name: format string giving the i-th name at this level, like "site_{i:03d}" (it's also given `rng`-chosen `letter`)
+    # count: number of names to make in each directory of the level above
+    def __init__(self, pattern, name, count):
+        self.pattern = pattern
+        self.name = name
+        self.count = count
+
+    def names(self, rng, jitter= 0):
+        # names for one directory; with jitter, the count varies by up to that fraction either way
+        count = self.count
+        if jitter:
+            count = max(0, int(round(count * (1 + rng.uniform(-jitter, jitter)))))
+        return [ self.name.format(i= i, letter= rng.choice("ABCDEFGH")) for i in range(count) ]
+
+    def spec(self):
+        return {"pattern": self.pattern, "name": self.name, "count": self.count}
+
+
+# directory levels in the style of the README's examples, used top-down by standardLevels
+directoryLevels = [
+    (r"site_(?P<site>[A-Z]{4}\d{3})", "site_ABCD{i:03d}"),
+    (r"(?P<year>\d{4})", "{i:04d}"),
+    (r"(?P<month>\d\d)", "{i:02d}"),
+    (r"(?P<day>\d\d)", "{i:02d}"),
+]
+fileLevel = (r"(?P<unit>[A-H])_(?P<num>\d+)\.wav", "{letter}_{i}.wav")
+
+
+def standardLevels(depth= 3, fanout= 10, files= 100):
+    """
+    Levels for a tree of `depth` levels (including the files), `fanout` directories per directory
+    and `files` files per leaf directory.
+    """
+    levels = []
+    for level in range(depth - 1):
+        if level < len(directoryLevels):
+            pattern, name = directoryLevels[level]
+        else:
+            pattern, name = r"dir{}_(?P<dir{}>\d+)".format(level, level), "dir{}_{{i}}".format(level)
+        levels.append(Level(pattern, name, fanout))
+    levels.append(Level(fileLevel[0], fileLevel[1], files))
+    return levels
+
+
+def structureFile(levels, endpoint= "data"):
+    """
+    Text of the structure file for a tree of levels, with one Endpoint.
+    """
+    lines = []
+    for depth, level in enumerate(levels):
+        prefix = "{}: ".format(endpoint) if depth == len(levels) - 1 else ""
+        lines.append("    " * depth + prefix + level.pattern)
+    return "\n".join(lines) + "\n"
+
+
+def makeTree(root, levels, endpoint= "data", seed= 0, jitter= 0):
+    """
+    Create the tree described by levels under root, with its structure file. Returns the structure file's path.
+
+    If root already holds a tree made with the same arguments, it's reused rather than made again.
+    """
+    spec = {"levels": [ level.spec() for level in levels ], "endpoint": endpoint, "seed": seed, "jitter": jitter}
+    specPath = os.path.join(root, ".benchmark-tree.json")
+    structurePath = os.path.join(root, ".structure.txt")
+    try:
+        with open(specPath) as f:
+            if json.load(f) == spec:
+                return structurePath
+    except (IOError, OSError, ValueError):
+        pass
+
+    rng = random.Random(seed)
+    if not os.path.isdir(root):
+        os.makedirs(root)
+    elif os.listdir(root):
+        raise ValueError("{} already holds something other than this tree; use an empty or new directory".format(root))
+
+    def make(path, depth):
+        level = levels[depth]
+        names = level.names(rng, jitter)
+        if depth == len(levels) - 1:
+            for name in names:
+                open(os.path.join(path, name), "a").close()
+        else:
+            for name in names:
+                child = os.path.join(path, name)
+                os.mkdir(child)
+                make(child, depth + 1)
+
+    make(root, 0)
+    with open(structurePath, "w") as f:
+        f.write(structureFile(levels, endpoint))
+    with open(specPath, "w") as f:
+        json.dump(spec, f)
+    return structurePath
+
+
+def countFiles(levels):
+    # number of files in a tree of levels, without jitter
+    total = 1
+    for level in levels:
+        total *= level.count
+    return total
@@ -1,7 +1,7 @@
 # Python 2 and 3 cross-compatibility:
 from __future__ import print_function, division, unicode_literals, absolute_import
 from builtins import (bytes, str, int, dict, object, range, map, filter, zip, round, pow, open)
-from future.utils import (iteritems, itervalues)
+from future.utils import (iteritems, itervalues, native_str)
 from past.builtins import basestring
 
 import re
@@ -15,6 +15,55 @@ import operator
 import inspect
 import traceback
 import heapq
+import errno
+import collections
+import threading
+import json
+import stat
+import time
+import array
+import datetime
+import copy
+import mmap
+import math
+import random
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+try:
+    from concurrent import futures
+except ImportError:
+    # Python 2 without the `futures` backport: parallel walking is unavailable
+    futures = None
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+
+# time.perf_counter where available (Python 3.3+), for timing QueryStats
+_timer = getattr(time, "perf_counter", time.time)
+
+
+def _sha1(data):
+    # imported here, since it's only needed when a structure cache has to be checked or written
+    import hashlib
+    return hashlib.sha1(data).hexdigest()
+
+
+def _asyncio():
+    # asyncio (which would be the slowest import by far) is imported only once it's needed, by AsyncSubset,
+    # so short-lived processes that don't use it start up faster
+    import asyncio
+    return asyncio
+
 
 ## TODO overall:
 
@@ -26,9 +75,9 @@ import heapq
 ## [x] Unit tests? (both 2 and 3)
 ## [x] Hierarchy file
 ## [ ] Block reserved terms in structure file
-## [ ] Conversion for numerics
+## [x] Conversion for numerics
 ## [ ] Smarter finding of structure file
-## [ ] Further optimize Pattern.fill() (or .match()) to detect when regex only contains escaped chars, and jump directly to path without searching
+## [x] Further optimize Pattern.fill() (or .match()) to detect when regex only contains escaped chars, and jump directly to path without searching
 
 ## Big leaps:
 
@@ -37,20 +86,52 @@ import heapq
 ## [-] Parsers
 
 structureFileName = ".structure.txt"
+indexFileName = ".structure.index.sqlite"
+structureCacheFileName = ".structure.cache.json"
+# bumped whenever the format of the structure cache (or what's derived from the structure file) changes
+structureCacheVersion = 1
 
 class Dataset(object):
-    def __init__(self, path, structure= None):
+    def __init__(self, path, structure= None, index= None, cache= None, structure_cache= None):
+        # index: True to keep a persistent index of the Dataset in its base directory (next to the structure file),
+        # or a path to the index file to use. See `Index`.
+        # cache: True to cache directory listings in memory across queries, or a `ListingCache` to use.
+        # structure_cache: True to keep the parsed structure file in a compiled form next to it, or a path to keep it at,
+        # so later Datasets from the same structure file start up without parsing it. See `_loadStructureFile`.
+        if cache is True:
+            cache = ListingCache()
+        elif cache is False:
+            cache = None
+        self.cache = cache
+
         if structure is None:
             # TODO: smarter finding structure file
             if os.path.isdir(path):
                 path = os.path.join(path, structureFileName)
 
-            self.base = Entry(os.path.dirname(path))
-            self.endpoints = self._parseStructureFile(structfilePath= path)
+            self.base = Entry(os.path.dirname(path), cache= self.cache)
+            if structure_cache:
+                self.endpoints = self._loadStructureFile(path, os.path.join(self.base.path, structureCacheFileName) if structure_cache is True else structure_cache)
+            else:
+                self.endpoints = self._parseStructureFile(structfilePath= path)
         else:
-            self.base = Entry(path)
+            self.base = Entry(path, cache= self.cache)
             self.endpoints = self._parseStructureFile(structfileString= str(structure))
 
+        self.index = None
+        if index:
+            self.index = Index(self, os.path.join(self.base.path, indexFileName) if index is True else index)
+            for endpoint in itervalues(self.endpoints):
+                endpoint.index = self.index
+
+    def refresh(self):
+        """
+        Bring the Dataset's index up to date with the filesystem, re-listing only directories modified since the last refresh.
+        """
+        if self.index is None:
+            raise ValueError("This Dataset has no index to refresh; create it with Dataset(..., index= True)")
+        self.index.refresh()
+
     def __getattr__(self, attr):
         try:
             return self.endpoints[attr]
@@ -74,6 +155,154 @@ class Dataset(object):
     def __repr__(self):
         return 'Dataset("{}")\nEndpoints:\n{}'.format(self.base.path, "\n".join("  * {} - fields: {}".format(name, ", ".join(sorted(endpoint.fields))) for name, endpoint in sorted(iteritems(self.endpoints))))
 
+    def walk(self, endpoints= None, **params):
+        """
+        Walk several Endpoints at once, listing each directory only once, even when it's shared by many Endpoints.
+
+        Gives a Subset of (endpoint name, Entry) pairs. For each Endpoint, its Entries come in the same order
+        as they would from calling it.
+
+        Parameters
+        ----------
+
+        endpoints : iterable of str, or None
+
+            Names of the Endpoints to walk. Default: all of them.
+
+        **params
+
+            Filters, as when calling an Endpoint. Each one must be a field in every Endpoint being walked.
+        """
+        if scandir is None:
+            raise ValueError("Walking multiple Endpoints at once requires os.scandir (Python 3.5+) or the scandir package")
+        names = sorted(self.endpoints) if endpoints is None else list(endpoints)
+        for name in names:
+            if name not in self.endpoints:
+                raise KeyError("Dataset instance has no endpoint '{}'".format(name))
+            fields = self.endpoints[name].fields
+            for param in params:
+                if param not in fields:
+                    raise TypeError('"{}" is not a field in the Endpoint "{}"'.format(param, name))
+
+        literal_fill_fields = { field: value for field, value in iteritems(params) if Pattern.isLiteral(value) }
+
+        # merge the Endpoints' patterns into a trie, so shared directory levels are walked once
+        trie = _TrieNode(None)
+        for name in names:
+            node = trie
+            for part in self.endpoints[name].parts:
+                if literal_fill_fields:
+                    part = part.fill(literal_fill_fields, raise_on_nonexistant_fields= False)
+                node = node.child(part)
+            node.endpoints.append(name)
+
+        converters = {}
+        for name in names:
+            converters.update(self.endpoints[name].converters)
+        return Subset(self._withDatetimes(self._walkTrie(self.base, trie, Pattern.predicates(params, converters= converters))))
+
+    def _withDatetimes(self, pairs):
+        # sets each Endpoint's datetime field (if it has one) on its Entries, as calling the Endpoint would
+        for name, entry in pairs:
+            endpoint = self.endpoints[name]
+            if endpoint.datetime is not None:
+                entry._extend({endpoint.datetime[0]: endpoint._datetimeOf(entry)})
+            yield name, entry
+
+    def _walkTrie(self, baseEntry, node, predicates):
+        if all(child.pattern.isLiteral for child in node.children):
+            # no need to list the directory: join the literal names directly, like Endpoint._scanLevel
+            for child in node.children:
+                here = baseEntry._join(child.pattern.value, child.pattern.literals)
+                if child.endpoints:
+                    if not here._exists():
+                        continue
+                    for name in child.endpoints:
+                        yield name, here
+                if child.children:
+                    for pair in self._walkTrie(here, child, predicates):
+                        yield pair
+            return
+
+        try:
+            dirents = baseEntry._scandir()
+        except OSError as e:
+            if e.errno in (errno.ENOENT, errno.ENOTDIR):
+                return
+            raise
+
+        try:
+            for dirent in dirents:
+                for child in node.children:
+                    fieldVals = child.pattern._matches(dirent.name, predicates)
+                    if fieldVals is None:
+                        continue
+                    here = baseEntry._join(dirent.name, fieldVals, dirent.is_dir())
+                    for name in child.endpoints:
+                        yield name, here
+                    if child.children and here._isDir:
+                        for pair in self._walkTrie(here, child, predicates):
+                            yield pair
+        finally:
+            if hasattr(dirents, "close"):
+                dirents.close()
+
+    def _loadStructureFile(self, structfilePath, cachePath):
+        # Endpoints from the structure file, using the compiled form at cachePath if it's up to date, otherwise parsing
+        # the structure file and saving it there. The cache is up to date if it's the current version and the structure file's
+        # mtime and size are the same as when it was written, or failing that, its contents hash the same.
+        # Its Patterns compile their regexes only once they're used.
+        with open(structfilePath, "rb") as f:
+            st = os.fstat(f.fileno())
+            contents = None
+            try:
+                with open(cachePath, encoding= "utf-8") as cacheFile:
+                    cached = json.load(cacheFile)
+                if cached["version"] != structureCacheVersion or cached["python"] != sys.version_info[0]:
+                    raise ValueError("Stale cache")
+                if (cached["mtime"], cached["size"]) != (st.st_mtime, st.st_size):
+                    contents = f.read()
+                    if _sha1(contents) != cached["sha1"]:
+                        raise ValueError("Stale cache")
+                return self._endpointsFromCache(cached["endpoints"])
+            except (IOError, OSError, ValueError, KeyError, TypeError):
+                # missing, stale or unreadable: parse the structure file, and (re)write the cache
+                pass
+            if contents is None:
+                contents = f.read()
+
+        endpoints = self._parseStructureFile(structfilePath= structfilePath)
+        cached = {
+            "version": structureCacheVersion,
+            "python": sys.version_info[0],
+            "mtime": st.st_mtime,
+            "size": st.st_size,
+            "sha1": _sha1(contents),
+            "endpoints": { name: { "parts": [ part._state() for part in endpoint.parts ], "datetime": endpoint.datetime }
+                           for name, endpoint in iteritems(endpoints) }
+        }
+        # write to a temporary file and move it into place, so concurrent readers never see half a cache
+        tempPath = "{}.{}.tmp".format(cachePath, os.getpid())
+        try:
+            with open(tempPath, "w", encoding= "utf-8") as cacheFile:
+                cacheFile.write(str(json.dumps(cached)))
+            getattr(os, "replace", os.rename)(tempPath, cachePath)
+        except (IOError, OSError):
+            # i.e. a read-only dataset: just go without the cache
+            if os.path.exists(tempPath):
+                os.remove(tempPath)
+        return endpoints
+
+    def _endpointsFromCache(self, cachedEndpoints):
+        endpoints = {}
+        for name, cachedEndpoint in iteritems(cachedEndpoints):
+            endpoint = Endpoint([ Pattern._fromState(state) for state in cachedEndpoint["parts"] ], self.base, name= name)
+            if cachedEndpoint["datetime"] is not None:
+                datetimeName, fields = cachedEndpoint["datetime"]
+                endpoint.datetime = (datetimeName, tuple(fields))
+            endpoints[name] = endpoint
+        return endpoints
+
     def _parseStructureFile(self, structfilePath= None, structfileString= None):
         if structfilePath is None and structfileString is None:
             raise ValueError("No structure file path or string given")
@@ -91,6 +320,8 @@ class Dataset(object):
         linePattern = re.compile(r"(\s*)(.*)")      # groups: indent, content
         importLinePattern = re.compile(r"^(?:from\s+.+\s+)?(?:import\s+.+\s*)(?:as\s+.+\s*)?$")
         contentPattern = re.compile(r"(?:([A-z]\w*):\s?)?(.+)")     # groups: endpointName, endpointPattern
+        datetimePattern = re.compile(r"@datetime\s+([A-z]\w*)\s*\(([\w\s,]+)\)\s*$")   # groups: name, comma-separated fields
+        datetimes = []  # (name, fields, line, linenum)
         with open(structfilePath, encoding= "utf-8") if structfilePath else io.StringIO(structfileString) as f:
             # TODO: more descriptive errors?
             # TODO: show neighboring lines and highlight error
@@ -112,6 +343,14 @@ class Dataset(object):
                     # allow comments on their own line
                     # TODO: allow inline comments
                     continue
+
+                if content.startswith("@datetime"):
+                    # declare a datetime field made of other fields: `@datetime name(year, month, day, ...)`
+                    match = datetimePattern.match(content)
+                    if match is None:
+                        error("Unparseable datetime declaration, expected something like: @datetime timestamp(year, month, day, hour)", line, linenum)
+                    datetimes.append((match.group(1), [ field.strip() for field in match.group(2).split(",") ], line, linenum))
+                    continue
                     
                 # split (possible) endpoint name, pattern
                 try:
@@ -167,131 +406,1269 @@ class Dataset(object):
                     if name in endpoints:
                         error("The endpoint '{}' already exists, try a different name".format(name), line, linenum)
                     else:
-                        endpoints[name] = Endpoint(list(patternsStack), self.base)
+                        endpoints[name] = Endpoint(list(patternsStack), self.base, name= name)
+
+        # datetime fields go to every Endpoint with all their component fields
+        for name, fields, line, linenum in datetimes:
+            having = [ endpoint for endpoint in itervalues(endpoints) if all(field in endpoint.fields for field in fields) ]
+            if not having:
+                error("No endpoint has all the fields {}".format(", ".join(fields)), line, linenum)
+            for endpoint in having:
+                try:
+                    endpoint.addDatetime(name, fields)
+                except ValueError as e:
+                    error(e.args[0], line, linenum)
 
         return endpoints
 
 
+class _TrieNode(object):
+    # A level in the merged pattern hierarchy of several Endpoints (see Dataset.walk)
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.children = []
+        self._childrenByValue = {}
+        # names of the Endpoints whose last pattern is this one
+        self.endpoints = []
+
+    def child(self, pattern):
+        key = (pattern.value, tuple(sorted(iteritems(pattern.types))))
+        try:
+            return self._childrenByValue[key]
+        except KeyError:
+            node = _TrieNode(pattern)
+            self.children.append(node)
+            self._childrenByValue[key] = node
+            return node
+
+
+class ListingCache(object):
+    """
+    In-memory cache of directory listings and existence checks, shared by all queries against a Dataset.
+
+    Entries expire `ttl` seconds after they're cached (None to never expire), and once more than `maxsize` are held,
+    the least recently used are evicted. If you know something has changed on disk, call `invalidate(path)`.
+    Hit and miss counts are kept in `hits` and `misses`.
+    """
+
+    def __init__(self, ttl= 60, maxsize= 10000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        # ("list", path) -> (time cached, listing, set of names or None)
+        # ("exists", path) -> (time cached, bool, None)
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __repr__(self):
+        return "ListingCache(ttl= {}, maxsize= {}), {} items, {} hits, {} misses".format(self.ttl, self.maxsize, len(self), self.hits, self.misses)
+
+    def _get(self, key):
+        # returns the cached item, or None; caller must hold the lock
+        item = self._items.pop(key, None)
+        if item is not None:
+            if self.ttl is not None and _clock() - item[0] > self.ttl:
+                return None
+            # re-insert to mark as most recently used
+            self._items[key] = item
+        return item
+
+    def _put(self, key, value, names= None):
+        # caller must hold the lock
+        self._items.pop(key, None)
+        self._items[key] = (_clock(), value, names)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last= False)
+
+    def scandir(self, path):
+        """
+        List of os.DirEntry objects in the directory at path (or of names, if scandir isn't available).
+        """
+        key = ("list", os.path.normpath(path))
+        with self._lock:
+            item = self._get(key)
+            if item is not None:
+                self.hits += 1
+                return item[1]
+            self.misses += 1
+        # list outside the lock, so other threads aren't held up by a slow filesystem
+        listing = list(scandir(path)) if scandir is not None else os.listdir(path)
+        with self._lock:
+            self._put(key, listing)
+        return listing
+
+    def listdir(self, path):
+        """
+        List of names in the directory at path.
+        """
+        listing = self.scandir(path)
+        return [dirent.name for dirent in listing] if scandir is not None else list(listing)
+
+    def exists(self, path):
+        """
+        Whether path exists, answered from its parent directory's listing if that's cached.
+        """
+        path = os.path.normpath(path)
+        parent, name = os.path.split(path)
+        with self._lock:
+            listed = self._get(("list", parent or os.curdir))
+            if listed is not None:
+                self.hits += 1
+                names = listed[2]
+                if names is None:
+                    names = frozenset(dirent.name for dirent in listed[1]) if scandir is not None else frozenset(listed[1])
+                    self._items[("list", parent or os.curdir)] = (listed[0], listed[1], names)
+                return name in names
+
+            item = self._get(("exists", path))
+            if item is not None:
+                self.hits += 1
+                return item[1]
+            self.misses += 1
+
+        exists = os.path.exists(path)
+        with self._lock:
+            self._put(("exists", path), exists)
+        return exists
+
+    def invalidate(self, path= None):
+        """
+        Forget the cached listing and existence of path, and of everything beneath it, along with the listing
+        of its parent directory (which exists() would answer from). With no path, clear the whole cache.
+        """
+        with self._lock:
+            if path is None:
+                self._items.clear()
+            else:
+                path = os.path.normpath(path)
+                beneath = path.rstrip(os.sep) + os.sep
+                for key in [key for key in self._items if key[1] == path or key[1].startswith(beneath)]:
+                    del self._items[key]
+                self._items.pop(("list", os.path.dirname(path) or os.curdir), None)
+
+
+# time.monotonic where available (Python 3.3+), for ListingCache expiry
+_clock = getattr(time, "monotonic", time.time)
+# sys.intern, where it can intern the (unicode) strings field values are
+_intern = getattr(sys, "intern", None)
+
+
+def _parseDate(value):
+    # ISO 8601 dates, with or without dashes
+    for format in ("%Y-%m-%d", "%Y%m%d"):
+        try:
+            return datetime.datetime.strptime(value, format).date()
+        except ValueError:
+            pass
+    raise ValueError("'{}' is not a date in the form YYYY-MM-DD or YYYYMMDD".format(value))
+
+# Types fields can be declared as in a pattern, like `(?P<year:int>\d{4})`: type name -> function converting the matched string.
+# Add your own (any function of a string that raises ValueError for strings it can't convert) before creating a Dataset.
+converters = {
+    "str": str,
+    "int": int,
+    "float": float,
+    "date": _parseDate
+}
+
+
+class Index(object):
+    """
+    A persistent record (in a SQLite file) of the Entries in each Endpoint of a Dataset, and their field values,
+    so queries can be answered without walking the filesystem.
+
+    Filters given as strings, iterables of strings, or exclusion dicts are evaluated by SQLite;
+    any other filters are applied to the results in Python.
+
+    The index also stores the listing of every directory it walked, along with that directory's modification time.
+    `refresh()` re-lists only those directories whose modification time has changed since they were last listed,
+    and re-matches Entries only within them.
+    """
+
+    version = 1
+
+    # don't trust modification times this close to the time of the scan: the directory could still change within the same tick
+    mtime_margin = 2.0
+
+    def __init__(self, dataset, path):
+        self.dataset = dataset
+        self.path = path
+
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+                signature = json.dumps({
+                    "version": Index.version,
+                    "endpoints": { name: [part.value for part in endpoint.parts] for name, endpoint in iteritems(dataset.endpoints) }
+                }, sort_keys= True)
+                row = conn.execute("SELECT value FROM meta WHERE key = 'signature'").fetchone()
+                if row is None or row[0] != signature:
+                    # new index, or the structure has changed: start over
+                    for (table,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name != 'meta'").fetchall():
+                        conn.execute("DROP TABLE {}".format(Index._quote(table)))
+                    conn.execute("DELETE FROM meta")
+                    conn.execute("INSERT INTO meta VALUES ('signature', ?)", (signature,))
+                    conn.execute("CREATE TABLE dirs (path TEXT PRIMARY KEY, mtime INTEGER)")
+                    conn.execute("CREATE TABLE listings (dir TEXT, name TEXT, isdir INTEGER, PRIMARY KEY (dir, name))")
+                    for name, endpoint in iteritems(dataset.endpoints):
+                        table = Index._table(name)
+                        columns = "".join(", {} TEXT".format(Index._quote(field)) for field in sorted(endpoint.fields))
+                        conn.execute("CREATE TABLE {} (path TEXT PRIMARY KEY, dir TEXT{})".format(table, columns))
+                        conn.execute("CREATE INDEX {} ON {} (dir)".format(Index._quote("dir_" + name), table))
+                scanned = conn.execute("SELECT value FROM meta WHERE key = 'scanned'").fetchone()
+        finally:
+            conn.close()
+
+        if scanned is None:
+            self.refresh()
+
+    def _connect(self):
+        # a connection per operation, since queries may be consumed from other threads (i.e. Endpoint.aiter)
+        import sqlite3
+        return sqlite3.connect(self.path)
+
+    @staticmethod
+    def _quote(identifier):
+        return '"{}"'.format(identifier.replace('"', '""'))
+
+    @staticmethod
+    def _table(endpointName):
+        return Index._quote("entries_" + endpointName)
+
+    def refresh(self):
+        """
+        Walk every Endpoint, re-listing directories whose modification time has changed since they were last listed.
+        """
+        scanTime = time.time()
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("CREATE TEMP TABLE visited (dir TEXT PRIMARY KEY)")
+                listings = {}
+                for name, endpoint in sorted(iteritems(self.dataset.endpoints)):
+                    self._refreshEndpoint(conn, name, endpoint, listings, scanTime)
+
+                # forget directories that weren't reached this time: they were deleted, or no longer match any Endpoint
+                conn.execute("DELETE FROM dirs WHERE path NOT IN (SELECT dir FROM visited)")
+                conn.execute("DELETE FROM listings WHERE dir NOT IN (SELECT dir FROM visited)")
+                for name in self.dataset.endpoints:
+                    conn.execute("DELETE FROM {} WHERE dir NOT IN (SELECT dir FROM visited)".format(Index._table(name)))
+                conn.execute("INSERT OR REPLACE INTO meta VALUES ('scanned', ?)", (repr(scanTime),))
+                conn.execute("DROP TABLE visited")
+        finally:
+            conn.close()
+
+    def _list(self, conn, relDir, listings, scanTime):
+        # returns ([(name, isdir), ...] or None if relDir isn't a directory, whether the listing changed since the last refresh)
+        # each directory is only stat'ed once per refresh, even when several Endpoints pass through it
+        try:
+            return listings[relDir]
+        except KeyError:
+            pass
+
+        path = os.path.join(self.dataset.base.path, relDir)
+        try:
+            st = os.stat(path)
+        except OSError:
+            st = None
+
+        if st is None or not stat.S_ISDIR(st.st_mode):
+            result = (None, True)
+        else:
+            conn.execute("INSERT OR IGNORE INTO visited VALUES (?)", (relDir,))
+            mtime = getattr(st, "st_mtime_ns", None)
+            if mtime is None:
+                mtime = int(st.st_mtime * 1e9)
+            row = conn.execute("SELECT mtime FROM dirs WHERE path = ?", (relDir,)).fetchone()
+            if row is not None and row[0] == mtime:
+                listing = conn.execute("SELECT name, isdir FROM listings WHERE dir = ?", (relDir,)).fetchall()
+                result = ([(name, bool(isdir)) for name, isdir in listing], False)
+            else:
+                if scandir is not None:
+                    listing = [(dirent.name, dirent.is_dir()) for dirent in scandir(path)]
+                else:
+                    listing = [(name, os.path.isdir(os.path.join(path, name))) for name in os.listdir(path)]
+                conn.execute("DELETE FROM listings WHERE dir = ?", (relDir,))
+                conn.executemany("INSERT INTO listings VALUES (?, ?, ?)", [(relDir, name, int(isdir)) for name, isdir in listing])
+                if st.st_mtime >= scanTime - Index.mtime_margin:
+                    mtime = -1  # forces a re-listing next time
+                conn.execute("INSERT OR REPLACE INTO dirs VALUES (?, ?)", (relDir, mtime))
+                result = (listing, True)
+
+        listings[relDir] = result
+        return result
+
+    def _refreshEndpoint(self, conn, name, endpoint, listings, scanTime):
+        table = Index._table(name)
+        fields = sorted(endpoint.fields)
+        insert = "INSERT OR REPLACE INTO {} VALUES (?, ?{})".format(table, ", ?" * len(fields))
+        lastLevel = len(endpoint.parts) - 1
+
+        def walk(relDir, level, fieldVals):
+            listing, changed = self._list(conn, relDir, listings, scanTime)
+            if listing is None:
+                return
+            pattern = endpoint.parts[level]
+            if level == lastLevel:
+                # the Entries in a directory only change when its listing does
+                if changed:
+                    conn.execute("DELETE FROM {} WHERE dir = ?".format(table), (relDir,))
+                    rows = []
+                    for childName, isdir in listing:
+                        childVals = self._match(pattern, childName)
+                        if childVals is not None:
+                            entryVals = dict(fieldVals)
+                            entryVals.update(childVals)
+                            rows.append([os.path.join(relDir, childName), relDir] + [entryVals.get(field) for field in fields])
+                    conn.executemany(insert, rows)
+            else:
+                for childName, isdir in listing:
+                    if isdir:
+                        childVals = self._match(pattern, childName)
+                        if childVals is not None:
+                            entryVals = dict(fieldVals)
+                            entryVals.update(childVals)
+                            walk(os.path.join(relDir, childName), level + 1, entryVals)
+
+        walk("", 0, {})
+
+    @staticmethod
+    def _match(pattern, name):
+        # fields matched in name, as the strings they were in the name: typed fields are stored unconverted,
+        # but names whose values can't be converted are left out, as in a walk
+        groups = pattern._matches(name, {}, convert= False)
+        if groups is not None and pattern._groupConverters and not pattern._convertGroups(dict(groups)):
+            return None
+        return groups
+
+    def _converted(self, endpoint, fieldVals):
+        # convert stored (string) values of typed fields
+        for field, converter in iteritems(endpoint.converters):
+            value = fieldVals.get(field)
+            if value is not None:
+                fieldVals[field] = converter(value)
+        return fieldVals
+
+    def query(self, endpoint, params):
+        """
+        Generator of Entries in the Endpoint matching the filters in params, ordered by path.
+        """
+        where = []
+        args = []
+        residual = {}
+        for field, restriction in iteritems(params):
+            column = Index._quote(field)
+            if restriction is None:
+                continue
+            elif field in endpoint.converters:
+                # typed fields are stored as strings, so compare them after converting
+                residual[field] = restriction
+            elif isinstance(restriction, basestring):
+                where.append("{} = ?".format(column))
+                args.append(restriction)
+            elif isinstance(restriction, dict) and 0 < len(restriction) <= 500 and not any(itervalues(restriction)) and all(isinstance(value, basestring) for value in restriction):
+                where.append("({0} IS NULL OR {0} NOT IN ({1}))".format(column, ", ".join("?" * len(restriction))))
+                args.extend(restriction)
+            elif isinstance(restriction, (list, tuple, set, frozenset)) and len(restriction) <= 500 and all(isinstance(value, basestring) for value in restriction):
+                if len(restriction) == 0:
+                    return
+                where.append("{} IN ({})".format(column, ", ".join("?" * len(restriction))))
+                args.extend(restriction)
+            else:
+                # numbers, callables, and anything else SQLite can't evaluate
+                residual[field] = restriction
+        residual = Pattern.predicates(residual, converters= endpoint.converters)
+
+        sql = "SELECT * FROM {}".format(Index._table(endpoint.name))
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY path"
+
+        conn = self._connect()
+        try:
+            cursor = conn.execute(sql, args)
+            fields = [column[0] for column in cursor.description][2:]
+            while True:
+                rows = cursor.fetchmany(1000)
+                if not rows:
+                    break
+                for row in rows:
+                    fieldVals = dict(zip(fields, row[2:]))
+                    if endpoint.converters:
+                        self._converted(endpoint, fieldVals)
+                    if all(predicate(fieldVals[field]) for field, predicate in iteritems(residual)):
+                        yield Entry(os.path.join(self.dataset.base.path, row[0]), fieldVals)
+        finally:
+            conn.close()
+
+    def select(self, endpoint, items, params):
+        """
+        Generator of Entries matching any of the parameter dicts in items (each extended with params), without duplicates.
+        """
+        seen = set()
+        for item_dict in items:
+            try:
+                item_params = dict(item_dict)
+            except (TypeError, ValueError):
+                raise TypeError("'items' must be an iterable of dict-like objects, instead got iterable containing a non-dict-like type {}".format(type(item_dict)))
+            item_params.update(params)
+            for entry in self.query(endpoint, item_params):
+                if entry.path not in seen:
+                    seen.add(entry.path)
+                    yield entry
+
+    def values(self, endpoint, field):
+        """
+        Set of all values the field takes on in the Endpoint.
+        """
+        if field not in endpoint.fields:
+            raise KeyError("Endpoint has no field '{}'".format(field))
+        conn = self._connect()
+        try:
+            values = { row[0] for row in conn.execute("SELECT DISTINCT {} FROM {}".format(Index._quote(field), Index._table(endpoint.name))) }
+        finally:
+            conn.close()
+        converter = endpoint.converters.get(field)
+        if converter is not None:
+            values = { converter(value) if value is not None else None for value in values }
+        return values
+
+
 class Endpoint(object):
-    def __init__(self, parts, base):
+    # Traversal engine used to walk the directory tree:
+    # "scandir" reuses the file type information returned with each directory listing (no extra stat calls),
+    # "listdir" is the original plain os.listdir + os.path.exists walk.
+    # Can be overridden per-instance, i.e. to benchmark the two against each other.
+    engine = "scandir" if scandir is not None else "listdir"
+
+    # When a filter narrows a pattern down to a few exact names, check for those names directly (one stat each)
+    # if there are at most this many, rather than listing the directory: beyond this, the directory likely has fewer entries than that.
+    probe_limit = 32
+
+    # Function to call with the QueryStats of every query once it's done (i.e. to forward them to a metrics system).
+    # Setting it instruments every query, as if it were given `stats= True`. Can be set per-instance, or for all Endpoints.
+    stats_hook = None
+
+    def __init__(self, parts, base, name= None):
         # TODO: hold dataset instead of base?
         self.base = base if isinstance(base, Entry) else Entry(base)
         self.parts = parts if all(isinstance(part, Pattern) for part in parts) else list(map(Pattern, parts))
         self.fields = set.union( *(set(part.fields) for part in self.parts) )
+        # field -> function converting its values, for fields declared with a type (see Pattern)
+        self.converters = {}
+        for part in self.parts:
+            self.converters.update(part.converters)
+        self.name = name
+        # (name, component fields) of the Endpoint's datetime field, if any. see addDatetime
+        self.datetime = None
+        # Index to answer queries from instead of walking the filesystem; set by the Dataset
+        self.index = None
+
+    def __call__(self, items= None, sort= None, n= None, workers= None, ordered= True, time_range= None, stats= None, **params):
+        # stats: True to count the work the query does, level by level, in the resulting Subset's `stats` (a QueryStats),
+        # or a function to call with that QueryStats once the query is done (instead of the Endpoint's stats_hook)
+        hook = stats if callable(stats) else self.stats_hook
+        queryStats = QueryStats(self.name, self.parts) if stats or hook is not None else None
+        if queryStats is not None:
+            start = _timer()
+
+        window = self._timeWindow(time_range) if time_range is not None else None
+
+        def prepare(parts):
+            # parts, counting their work (if stats are wanted) and skipping directories outside the time window (if any)
+            if queryStats is not None:
+                parts = queryStats._instrument(parts)
+            if window is not None and (self.index is None or workers is not None):
+                parts = self._pruningParts(parts, window)
+            return parts
+        parts = prepare(self._filledParts(params))
+
+        if self.index is not None and workers is None:
+            # answer from the Dataset's index instead of walking
+            if items is not None:
+                matches = self.index.select(self, items, params)
+            else:
+                matches = self.index.query(self, params)
+
+        else:
+            if items is not None:
+                if len(params) > 0:
+
+                    def items_plus_params():
+                        try:
+                            for item_dict in items:
+                                try:
+                                    extended = item_dict.copy()
+                                    extended.update(params)
+                                except TypeError:
+                                    raise TypeError("'items' must be an iterable of dict-like objects, instead got iterable containing a non-dict-like type {}".format(type(item_dict)))
+                                yield extended
+                        except TypeError:
+                            raise TypeError("'items' must be an iterable of dict-like objects, instead got non-iterable type {}".format(type(items)))
 
-    def __call__(self, items= None, sort= None, n= None, **params):
+
+                    matches = self._select(items_plus_params(), workers, ordered, prepare, queryStats)
+                else:
+                    matches = self._select(items, workers, ordered, prepare, queryStats)
+
+            else:
+                sortLevels = self._sortLevels(parts, sort) if sort is not None and workers is None else None
+                if sortLevels is not None:
+                    # the sort fields come from the directory levels: sort while walking, so Entries stream out in order
+                    predicates = Pattern.predicates(params, converters= self.converters)
+                    if queryStats is not None:
+                        predicates = queryStats._timedPredicates(predicates)
+                    matches = self._sortedScan(self.base, parts, 0, predicates, sortLevels, _sortKey(sort))
+                    sort = None
+                else:
+                    matches = self._walk(self.base, parts, params, workers, ordered, queryStats)
+
+        if self.datetime is not None:
+            matches = self._withDatetimes(matches, window)
+
+        if sort is not None:
+            sortFunc = _sortKey(sort)
+            if n is not None:
+                # only the first n in sort order are wanted: keep just those while walking, rather than sorting everything
+                matches = heapq.nsmallest(n, matches, key= sortFunc)
+            else:
+                # when the walk can't sort as it goes (see _sortLevels), everything has to be gathered up and sorted at the end
+                matches = sorted(matches, key= sortFunc)
+
+        elif n is not None:
+            matches = _take(matches, n)
+
+        if queryStats is None:
+            return Subset(matches)
+        # (sorting may have done the whole walk already)
+        queryStats.seconds += _timer() - start
+        subset = Subset(queryStats._timed(matches, hook))
+        subset.stats = queryStats
+        return subset
+
+    def _filledParts(self, params):
+        # self.parts, with the restrictions in params that can be filled in (literals and Filters) filled in
         literal_fill_fields = {}
         for param, value in iteritems(params):
             if param not in self.fields:
                 raise TypeError('"{}" is not a field in this Endpoint'.format(param))
             else:
-                if Pattern.isLiteral(value):
+                if Pattern.isLiteral(value) or Pattern.isLiteralIterable(value) or isinstance(value, Filter):
                     literal_fill_fields[param] = value
 
         if len(literal_fill_fields) > 0:
             # for fields where a literal (singleton string) restriction is given, optimize search process by replacing the regex with the literal value
-            parts = [ part.fill(literal_fill_fields, raise_on_nonexistant_fields= False) for part in self.parts ]
-            # parts = [ part.fill({field: val for field, val in iteritems(literal_fill_fields) if field in part.fields}) for part in self.parts ]
+            # (and where a few literals are given, by checking for the names they could make directly, rather than listing the directory)
+            return [ part.fill(literal_fill_fields, raise_on_nonexistant_fields= False) for part in self.parts ]
         else:
-            parts = self.parts
+            return self.parts
+
+    def _depth(self, fields):
+        # number of directory levels that have to be walked to know the values of all of fields
+        fields = set(fields)
+        if self.datetime is not None and self.datetime[0] in fields:
+            fields.remove(self.datetime[0])
+            fields.update(self.datetime[1])
+        depth = 0
+        for level, part in enumerate(self.parts):
+            if fields.intersection(part.fields):
+                depth = level + 1
+        return max(depth, 1)
+
+    def _walkTo(self, depth, params):
+        # Entries for the directories (or files) at `depth` levels down matching params, stopping the walk there
+        parts = self._filledParts(params)[:depth]
+        matches = self._walk(self.base, parts, params)
+        if depth < len(self.parts):
+            # only directories can have anything beneath them (a check answered from the listing, when scanning)
+            matches = ( entry for entry in matches if entry._isdir() )
+        if self.datetime is not None and all(field in set().union(*(part.fields for part in parts)) for field in self.datetime[1]):
+            matches = self._withDatetimes(matches, None)
+        return matches
+
+    def count(self, **params):
+        """
+        Number of Entries matching params, without creating them.
 
-        if items is not None:
-            if len(params) > 0:
+        Equivalent to `len(list(endpoint(**params)))`, but only the directories above the last level become Entries:
+        names at the last level are just checked against its pattern.
+        """
+        if self.index is not None:
+            return sum(1 for entry in self(**params))
+        predicates = Pattern.predicates(params, converters= self.converters)
+        parts = self._filledParts(params)
+        if len(parts) > 1:
+            dirs = ( entry for entry in self._walk(self.base, parts[:-1], params) if entry._isdir() )
+        else:
+            dirs = [self.base]
+        return sum(self._countLevel(entry, parts[-1], predicates) for entry in dirs)
 
-                def items_plus_params():
-                    try:
-                        for item_dict in items:
-                            try:
-                                extended = item_dict.copy()
-                                extended.update(params)
-                            except TypeError:
-                                raise TypeError("'items' must be an iterable of dict-like objects, instead got iterable containing a non-dict-like type {}".format(type(item_dict)))
-                            yield extended
-                    except TypeError:
-                        raise TypeError("'items' must be an iterable of dict-like objects, instead got non-iterable type {}".format(type(items)))
+    def _countLevel(self, baseEntry, pattern, predicates):
+        # number of children of baseEntry matching pattern
+        if pattern.isLiteral:
+            return 1 if baseEntry._join(pattern.value, pattern.literals)._exists() else 0
+        elif pattern.candidates is not None and len(pattern.candidates) <= self.probe_limit:
+            return sum(1 for name, fieldVals in pattern.candidates if baseEntry._join(name, fieldVals)._exists())
+        else:
+            try:
+                names = baseEntry._listdir()
+            except OSError as e:
+                if e.errno in (errno.ENOENT, errno.ENOTDIR):
+                    return 0
+                raise
+            isMatch = pattern._isMatch(predicates)
+            return sum(1 for name in names if isMatch(name))
+
+    def estimate_count(self, sample= 0.01, max_listdirs= 1000, seed= None, **params):
+        """
+        Estimate the number of Entries matching params by walking a random sample of the directory tree.
 
+        Parameters
+        ----------
 
-                matches = self._select(items_plus_params())
-            else:
-                matches = self._select(items)
+        sample : float, default 0.01
+
+            Fraction of the matching subdirectories to descend into from each directory listed (at least 2 of them,
+            when there are that many, so the variance can be estimated).
+
+        max_listdirs : int or None, default 1000
+
+            Most directory listings to do. The budget is shared out between the levels, and sampled directories
+            beyond a level's share are left out at random (which widens the confidence interval, but doesn't bias the estimate).
+
+        seed : optional
+
+            Seed for the random choice of directories, to get the same sample again.
+
+        Returns
+        -------
 
+        Estimate of (value, low, high): the estimated count and its approximate 95% confidence interval.
+        If nothing had to be sampled, all three are the exact count.
+        """
+        return self._sample(sample, max_listdirs, seed, params)[0]
+
+    def _sample(self, fraction, maxListdirs, seed, params):
+        # Multistage random sample of the tree, breadth-first: at each level, list the directories sampled so far
+        # (in random order, while the listing budget lasts), then choose a simple random sample of each one's matching subdirectories.
+        # Returns (Estimate of the number of Entries, { field: Estimate of its number of distinct values }, { field: set of values seen }, number of listings)
+        if scandir is None:
+            raise ValueError("Sampling requires os.scandir (Python 3.5+) or the scandir package")
+        if not 0 < fraction <= 1:
+            raise ValueError("sample must be a fraction between 0 and 1, not {}".format(fraction))
+        rng = random.Random(seed)
+        predicates = Pattern.predicates(params, converters= self.converters)
+        parts = self._filledParts(params)
+        lastLevel = len(parts) - 1
+
+        root = _SampleNode(self.base)
+        frontier = [root]
+        levels = []
+        listdirs = 0
+        # field -> { value: number of matching names it was seen in }, over every listing done
+        observed = collections.defaultdict(collections.Counter)
+        # field -> values seen at a level that was enumerated completely, if any
+        exact = {}
+        complete = True
+        # whether each level needs its directories listed (rather than probing for a few names)
+        listed = [ not (pattern.isLiteral or (pattern.candidates is not None and len(pattern.candidates) <= self.probe_limit)) for pattern in parts ]
+        for level, pattern in enumerate(parts):
+            leaf = level == lastLevel
+            levels.append(frontier)
+            rng.shuffle(frontier)
+            if listed[level] and maxListdirs is not None:
+                # split what's left of the budget evenly between this and the deeper levels that need listing,
+                # so the sample reaches the bottom; leftovers carry down
+                allowance = max(1, (maxListdirs - listdirs) // sum(listed[level:]))
+                allowance = min(allowance, maxListdirs - listdirs)
+            else:
+                allowance = None
+            seen = collections.defaultdict(set)
+            nextFrontier = []
+            for node in frontier:
+                if listed[level]:
+                    if allowance is not None and allowance <= 0:
+                        complete = False
+                        continue
+                    listdirs += 1
+                    if allowance is not None:
+                        allowance -= 1
+                children = list(self._scanLevel(node.entry, pattern, predicates, leaf))
+                node.n = len(children)
+                for child in children:
+                    for field, value in iteritems(child._own):
+                        observed[field][value] += 1
+                        seen[field].add(value)
+                if not leaf:
+                    k = node.n if fraction == 1 else min(node.n, max(2, int(math.ceil(fraction * node.n))))
+                    node.children = [ _SampleNode(child) for child in (rng.sample(children, k) if k < node.n else children) ]
+                    nextFrontier.extend(node.children)
+            if complete:
+                for field, values in iteritems(seen):
+                    exact.setdefault(field, values)
+            if any(node.children is not None and len(node.children) < node.n for node in frontier):
+                complete = False
+            frontier = nextFrontier
+
+        if root.n is None:
+            raise ValueError("max_listdirs is too small to list even the top-level directory")
+        # estimate from the bottom up
+        for level in reversed(range(len(levels))):
+            cv2 = []
+            deferred = [ node for node in levels[level] if not node.estimate(level == lastLevel, cv2) ]
+            for node in deferred:
+                node.estimate(level == lastLevel, cv2, pooled= cv2)
+        if root.result is None:
+            raise ValueError("max_listdirs is too small to sample any Entries")
+        value, variance = root.result
+        if variance == 0:
+            count = Estimate(value, value, value)
         else:
-            matches = self._match(self.base, parts, params)
-            
-        if n is not None:
-            matches = itertools.islice(matches, n)
+            spread = 1.96 * math.sqrt(variance)
+            count = Estimate(value, max(value - spread, 0), value + spread)
 
-        if sort is not None:
-            # singleton string (entry attr to sort on)
-            if isinstance(sort, basestring):
-                sortFunc = operator.attrgetter(sort)
-            # function (entry -> orderable type)
-            elif hasattr(sort, "__call__"):
-                sortFunc = sort
-            # iterable of strings
+        distinct = {}
+        for field in self.fields:
+            if field in exact:
+                distinct[field] = Estimate(len(exact[field]), len(exact[field]), len(exact[field]))
             else:
-                try:
-                    iter(sort)
-                except TypeError:
-                    raise TypeError("Sort key must be a singleton string, iterable of strings, or function; instead got non-iterable type {}".format(type(sort)))
-                if all(isinstance(key, basestring) for key in sort):
-                    sortFunc = lambda e: tuple(getattr(e, key) for key in sort)
-                else:
-                    raise TypeError("When an iterable of sort keys are given, all must be strings")
-            
-            # sorting is not at all intelligent or particularly efficeint. TODO: any way to sort while traversing without knowing contents of subdirs?
-            matches = sorted(matches, key= sortFunc)
+                distinct[field] = _chao1(itervalues(observed[field]))
+        values = { field: set(observed[field]) for field in self.fields }
+        return count, distinct, values, listdirs
 
-        return Subset(matches)
+    def addDatetime(self, name, fields):
+        """
+        Declares a datetime field, `name`, made up of other fields, which can come from different directory levels
+        (like `YYYY/MM/DD/HH_mm_ss.wav`).
+
+        `fields` are the names of the fields holding the year, month, day, hour, minute and second, in that order
+        (any after the year can be left off). Entries get the combined datetime as the attribute `name`
+        (None if their fields don't make a valid datetime), and queries can be limited to a time window with
+        `time_range= (start, end)`, skipping every directory that falls outside it.
+        """
+        fields = tuple(fields)
+        if not 1 <= len(fields) <= 6:
+            raise ValueError("A datetime field is made of 1 to 6 fields (year, month, day, hour, minute, second), not {}".format(len(fields)))
+        for field in fields:
+            if field not in self.fields:
+                raise ValueError('"{}" is not a field in this Endpoint'.format(field))
+        if name in self.fields:
+            raise ValueError('"{}" is already a field in this Endpoint'.format(name))
+        if self.datetime is not None:
+            raise ValueError('This Endpoint already has the datetime field "{}"'.format(self.datetime[0]))
+        self.datetime = (name, fields)
+
+    def _timeWindow(self, time_range):
+        # time_range -> (start, end) datetimes, either of which may be None
+        if self.datetime is None:
+            raise TypeError("time_range can only be used on an Endpoint with a datetime field (see Endpoint.addDatetime)")
+        try:
+            start, end = time_range
+        except (TypeError, ValueError):
+            raise TypeError("time_range must be a (start, end) pair of datetimes, instead got {}".format(time_range))
+        def toDatetime(value):
+            if value is None or isinstance(value, datetime.datetime):
+                return value
+            elif isinstance(value, datetime.date):
+                return datetime.datetime(value.year, value.month, value.day)
+            raise TypeError("time_range must be a (start, end) pair of datetimes (or dates, or None), instead got {}".format(type(value)))
+        return toDatetime(start), toDatetime(end)
+
+    def _pruningParts(self, partsPatterns, window):
+        # copies of partsPatterns where each level that completes more of the datetime's fields (i.e. the year, or the year and month)
+        # prunes the Entries it matches whose span of time doesn't overlap the window
+        start, end = window
+        fields = self.datetime[1]
+        pruned = []
+        known = 0
+        for level, pattern in enumerate(partsPatterns):
+            seen = set().union(*(part.fields for part in partsPatterns[:level + 1]))
+            k = 0
+            while k < len(fields) and fields[k] in seen:
+                k += 1
+            if k > known:
+                pattern = copy.copy(pattern)
+                pattern.prunes = functools.partial(_outsideWindow, fields[:k], start, end)
+                known = k
+            pruned.append(pattern)
+        return pruned
+
+    def _withDatetimes(self, matches, window):
+        # sets the datetime field on each Entry, leaving out those outside the window, if any
+        name = self.datetime[0]
+        start, end = window if window is not None else (None, None)
+        for entry in matches:
+            value = self._datetimeOf(entry)
+            if window is not None:
+                if value is None or (start is not None and value < start) or (end is not None and value >= end):
+                    continue
+            entry._extend({name: value})
+            yield entry
+
+    def _datetimeOf(self, entry):
+        # value of the datetime field for an Entry, or None if its fields don't make a valid datetime
+        try:
+            return datetime.datetime(*[ int(entry[field]) for field in self.datetime[1] ] + [1, 1][len(self.datetime[1]) - 1:])
+        except (KeyError, ValueError, TypeError):
+            return None
 
-    def _match(self, baseEntry, partsPatterns, params):
+    def aiter(self, items= None, sort= None, n= None, workers= None, ordered= True, buffer= 64, **params):
+        """
+        Asynchronous counterpart to calling the Endpoint, for use with asyncio: `async for entry in endpoint.aiter(**params)`.
+
+        Takes the same arguments as calling the Endpoint, but the whole query (including sorting) runs in a background
+        thread, so the event loop is never blocked by the filesystem. Entries are handed to the loop as soon as they're found.
+        Give `workers` to list directories concurrently (see `Endpoint.__call__`).
+
+        Parameters
+        ----------
+
+        buffer : int, default 64
+
+            Maximum number of Entries found ahead of the consumer. Once the buffer is full, the walk pauses until
+            the consumer catches up.
+        """
+        return AsyncSubset(lambda: self(items= items, sort= sort, n= n, workers= workers, ordered= ordered, **params), buffer= buffer)
+
+    def _walk(self, baseEntry, partsPatterns, params, workers= None, ordered= True, stats= None):
+        # work out how to test each restriction once for the whole walk, not once per name
+        predicates = Pattern.predicates(params, converters= self.converters)
+        if stats is not None:
+            predicates = stats._timedPredicates(predicates)
+        if workers is not None:
+            return self._parallel(baseEntry, partsPatterns, predicates, workers, ordered)
+        elif self.engine == "scandir":
+            if scandir is None:
+                raise ValueError("The scandir engine requires os.scandir (Python 3.5+) or the scandir package")
+            return self._scan(baseEntry, partsPatterns, predicates)
+        elif self.engine == "listdir":
+            return self._match(baseEntry, partsPatterns, predicates)
+        else:
+            raise ValueError('Unknown traversal engine "{}", expected "scandir" or "listdir"'.format(self.engine))
+
+    def _match(self, baseEntry, partsPatterns, predicates):
         # TODO: what about multiple leaf patterns?
         # TODO: error handling
         # TODO eventually: before anything else, check baseEntry for a definition file and potentially load a new partsPatterns from it
         pattern, rest = partsPatterns[0], partsPatterns[1:]
+        prunes = pattern.prunes
+        stats = pattern.stats
 
         if pattern.isLiteral:
-            here = baseEntry._join(pattern.value, {})
-            if here._exists():
+            here = baseEntry._join(pattern.value, pattern.literals)
+            if Endpoint._keep(here, True, prunes, stats):
                 if rest == []:
                     yield here
                 else:
-                    for entry in self._match(here, rest, params):
+                    for entry in self._match(here, rest, predicates):
                         yield entry
 
+        elif pattern.candidates is not None and len(pattern.candidates) <= self.probe_limit:
+            for name, fieldVals in pattern.candidates:
+                here = baseEntry._join(name, fieldVals)
+                if Endpoint._keep(here, True, prunes, stats):
+                    if rest == []:
+                        yield here
+                    else:
+                        for entry in self._match(here, rest, predicates):
+                            yield entry
+
         else:
-            for name in baseEntry._listdir():
-                fieldVals = pattern.matches(name, **params)
+            if stats is not None:
+                start = _timer()
+                names = baseEntry._listdir()
+                stats._listed(start)
+            else:
+                names = baseEntry._listdir()
+            for name in names:
+                fieldVals = pattern._matches(name, predicates)
                 if fieldVals is not None:
                     here = baseEntry._join(name, fieldVals)
+                    if prunes is not None and prunes(here):
+                        if stats is not None:
+                            stats.pruned += 1
+                        continue
                     if rest == []:
                         yield here
                     else:
-                        for entry in self._match(here, rest, params):
+                        for entry in self._match(here, rest, predicates):
                             yield entry
 
-    def _select(self, items):
+    @staticmethod
+    def _keep(here, check, prunes, stats):
+        # whether to keep an Entry joined from a literal name or candidate: it exists (if `check`), and isn't pruned
+        if stats is not None:
+            stats.joins += 1
+            if check:
+                stats.probes += 1
+        if check and not here._exists():
+            if stats is not None:
+                stats.missing += 1
+            return False
+        if prunes is not None and prunes(here):
+            if stats is not None:
+                stats.pruned += 1
+            return False
+        return True
+
+    @staticmethod
+    def _unpruned(here, level, plans, stats):
+        # the plans (see _plan) whose pattern at level doesn't prune here (i.e. for being outside a time_range)
+        kept = [ plan for plan in plans if plan[0][level].prunes is None or not plan[0][level].prunes(here) ]
+        if stats is not None and not kept:
+            stats.pruned += 1
+        return kept
+
+    def _scan(self, baseEntry, partsPatterns, predicates):
+        # Same traversal as _match, but built on scandir: whether each name is a directory is carried into its Entry,
+        # so non-directories are skipped at intermediate levels using the type info from the listing,
+        # and nothing already seen in a listing is stat'ed again.
+        pattern, rest = partsPatterns[0], partsPatterns[1:]
+        leaf = rest == []
+        for here in self._scanLevel(baseEntry, pattern, predicates, leaf):
+            if leaf:
+                yield here
+            else:
+                for entry in self._scan(here, rest, predicates):
+                    yield entry
+
+    def _scanLevel(self, baseEntry, pattern, predicates, leaf):
+        # yields the children of baseEntry matching pattern (one level of _scan)
+        prunes = pattern.prunes
+        stats = pattern.stats
+        if pattern.isLiteral:
+            here = baseEntry._join(pattern.value, pattern.literals)
+            # an intermediate literal level doesn't need an existence check:
+            # scanning into it next will find out whether it exists, for one syscall instead of two
+            if Endpoint._keep(here, leaf, prunes, stats):
+                yield here
+
+        elif pattern.candidates is not None and len(pattern.candidates) <= self.probe_limit:
+            # probe for each name the pattern could match, rather than listing the directory
+            for name, fieldVals in pattern.candidates:
+                here = baseEntry._join(name, fieldVals)
+                if Endpoint._keep(here, leaf, prunes, stats):
+                    yield here
+
+        else:
+            try:
+                if stats is not None:
+                    start = _timer()
+                    dirents = baseEntry._scandir()
+                    stats._listed(start)
+                else:
+                    dirents = baseEntry._scandir()
+            except OSError as e:
+                # baseEntry was an unchecked literal level that doesn't exist (or isn't a directory)
+                if e.errno in (errno.ENOENT, errno.ENOTDIR):
+                    return
+                raise
+
+            try:
+                for dirent in dirents:
+                    if not leaf and not dirent.is_dir():
+                        continue
+                    fieldVals = pattern._matches(dirent.name, predicates)
+                    if fieldVals is not None:
+                        here = baseEntry._join(dirent.name, fieldVals, dirent.is_dir() if leaf else True)
+                        if prunes is None or not prunes(here):
+                            yield here
+                        elif stats is not None:
+                            stats.pruned += 1
+            finally:
+                # release the directory handle even if the consumer stops early
+                if hasattr(dirents, "close"):
+                    dirents.close()
+
+    def _sortLevels(self, partsPatterns, sort):
+        # For sorting by field names while walking: (sort fields, number of leading sort fields whose values are known
+        # at each level), or None if the walk can't help. A field's value is known once the walk is past the deepest level it appears in.
+        if isinstance(sort, basestring):
+            sortFields = (sort,)
+        elif isinstance(sort, (list, tuple)) and all(isinstance(field, basestring) for field in sort):
+            sortFields = tuple(sort)
+        else:
+            return None
+        if self.engine != "scandir" or scandir is None or len(partsPatterns) < 2:
+            return None
+        # the datetime field is only added once the walk is done, so the files can't be sorted by it as they're listed
+        if self.datetime is not None and self.datetime[0] in sortFields:
+            return None
+
+        lastLevel = {}
+        for level, pattern in enumerate(partsPatterns):
+            for field in pattern.fields:
+                lastLevel[field] = level
+
+        known = []
+        for level in range(len(partsPatterns)):
+            k = 0
+            while k < len(sortFields) and lastLevel.get(sortFields[k], len(partsPatterns)) <= level:
+                k += 1
+            known.append(k)
+
+        # if not even the first sort field is known above the files, it's cheaper to just sort everything at the end
+        if known[-2] == 0:
+            return None
+        return sortFields, known
+
+    def _sortedScan(self, baseEntry, partsPatterns, level, predicates, sortLevels, sortFunc):
+        # Like _scan, but yields Entries ordered by sortFunc (stably, i.e. exactly like sorted() on the walk's output).
+        # Each directory's matches are sorted by the sort fields already known at that level, and walked in that order.
+        # Subdirectories that tie on those fields have their (sorted) contents merged, so only they are held in memory at once.
+        sortFields, known = sortLevels
+        leaf = level == len(partsPatterns) - 1
+        children = list(self._scanLevel(baseEntry, partsPatterns[level], predicates, leaf))
+
+        if leaf:
+            children.sort(key= sortFunc)
+            for entry in children:
+                yield entry
+            return
+
+        k = known[level]
+        if k > 0:
+            prefix = lambda entry: tuple(getattr(entry, field) for field in sortFields[:k])
+            children.sort(key= prefix)
+            groups = (list(group) for key, group in itertools.groupby(children, prefix))
+        else:
+            groups = [children]
+
+        for group in groups:
+            if k == len(sortFields) or len(group) == 1:
+                # every Entry below this group has the same sort key: walk order is sorted order
+                for child in group:
+                    for entry in self._sortedScan(child, partsPatterns, level + 1, predicates, sortLevels, sortFunc):
+                        yield entry
+            else:
+                subtrees = [ self._sortedScan(child, partsPatterns, level + 1, predicates, sortLevels, sortFunc) for child in group ]
+                for entry in _merge(subtrees, sortFunc):
+                    yield entry
+
+    def _parallel(self, baseEntry, partsPatterns, predicates, workers, ordered):
+        # Like _scan, but directory listings are done concurrently by a pool of `workers` threads.
+        # If ordered, Entries are yielded in the same depth-first order as _scan, listing a window of upcoming sibling
+        # directories ahead of time. Otherwise, Entries are yielded as soon as their directory has been listed.
+        # Closing the generator (i.e. the consumer stops early) cancels all listings that haven't started yet.
+        if futures is None:
+            raise ValueError("Parallel walking requires the concurrent.futures module (on Python 2, install the `futures` package)")
+        if scandir is None:
+            raise ValueError("Parallel walking requires os.scandir (Python 3.5+) or the scandir package")
+        if workers < 1:
+            raise ValueError("workers must be at least 1, not {}".format(workers))
+
+        executor = futures.ThreadPoolExecutor(max_workers= workers)
+        pending = set()
+        lastLevel = len(partsPatterns) - 1
+
+        def listLevel(entry, level):
+            return list(self._scanLevel(entry, partsPatterns[level], predicates, level == lastLevel))
+
+        def submit(entry, level):
+            future = executor.submit(listLevel, entry, level)
+            pending.add(future)
+            return future
+
+        def walkOrdered(future, level):
+            children = future.result()
+            pending.discard(future)
+            if level == lastLevel:
+                for entry in children:
+                    yield entry
+            else:
+                lookahead = collections.deque()
+                upcoming = iter(children)
+                for child in itertools.islice(upcoming, workers):
+                    lookahead.append(submit(child, level + 1))
+                while lookahead:
+                    childFuture = lookahead.popleft()
+                    for child in itertools.islice(upcoming, 1):
+                        lookahead.append(submit(child, level + 1))
+                    for entry in walkOrdered(childFuture, level + 1):
+                        yield entry
+
+        def walkUnordered():
+            # depth-first-ish: directories waiting to be listed are kept in a stack, so deep results come early
+            # and the number of queued directories stays small
+            levels = { submit(baseEntry, 0): 0 }
+            waiting = []
+            while pending:
+                done, _ = futures.wait(pending, return_when= futures.FIRST_COMPLETED)
+                for future in done:
+                    pending.discard(future)
+                    level = levels.pop(future)
+                    children = future.result()
+                    if level == lastLevel:
+                        for entry in children:
+                            yield entry
+                    else:
+                        waiting.extend((child, level + 1) for child in reversed(children))
+                while waiting and len(pending) < 2 * workers:
+                    child, level = waiting.pop()
+                    levels[submit(child, level)] = level
+
+        try:
+            if ordered:
+                for entry in walkOrdered(submit(baseEntry, 0), 0):
+                    yield entry
+            else:
+                for entry in walkUnordered():
+                    yield entry
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait= False)
+
+    def _select(self, items, workers= None, ordered= True, prepare= None, stats= None):
         # items: list of parameter dictionaries
         # i.e. list of dicts, where each dict is equivalent to kwards you'd give to __call__
         # effectively, parameters inside each dict are ANDed together, then all those parameter sets are ORed
+        # prepare: function applied to each item's filled parts before walking them (see __call__)
+        # stats: QueryStats to count the work in
         try:
             iter(items)
         except TypeError:
             raise TypeError("'items' must be an iterable of dict-like objects, instead got non-iterable type {}".format(type(items)))
 
+        if workers is None and self.engine == "scandir":
+            return self._plan(items, prepare, stats)
+        else:
+            return self._selectEach(items, workers, ordered, prepare, stats)
+
+    @staticmethod
+    def _literalFillFields(item_dict):
+        try:
+            return { field: value for field, value in iteritems(item_dict) if Pattern.isLiteral(value) }
+        except (TypeError, AttributeError):
+            raise TypeError("'items' must be an iterable of dict-like objects, instead got iterable containing a non-dict-like type {}".format(type(item_dict)))
+
+    def _selectEach(self, items, workers, ordered, prepare= None, stats= None):
+        # one full walk per item dict; an Entry matched by more than one item is only yielded the first time, like _plan
+        seen = set()
         for item_dict in items:
-            try:
-                # TODO: attempt to fast-path the case of all dicts in iterable giving literal values for the same set of fields
-                # by skipping the isLiteral check and using the previous dict's literal_fill_fields keys
-                literal_fill_fields = { field: value for field, value in iteritems(item_dict) if Pattern.isLiteral(value) }
-            except TypeError:
-                raise TypeError("'items' must be an iterable of dict-like objects, instead got iterable containing a non-dict-like type {}".format(type(item_dict)))
-            
+            literal_fill_fields = Endpoint._literalFillFields(item_dict)
             parts = [ part.fill(literal_fill_fields, raise_on_nonexistant_fields= False) for part in self.parts ]
-            for entry in self._match(self.base, parts, item_dict):
+            if prepare is not None:
+                parts = prepare(parts)
+            for entry in self._walk(self.base, parts, item_dict, workers, ordered, stats):
+                if entry.path not in seen:
+                    seen.add(entry.path)
+                    yield entry
+
+    def _plan(self, items, prepare= None, stats= None):
+        # Query plan for many item dicts at once: each item's patterns (filled with its literal values) are walked together,
+        # so every distinct directory is listed (or checked) once, no matter how many items lead to it.
+        # Since each distinct path is visited once, Entries matched by more than one item are only yielded once.
+        plans = []
+        filledParts = {}
+        # items often share the same restriction objects (e.g. one list of allowed values), so compile each only once
+        compiled = {}
+        for item_dict in items:
+            literal_fill_fields = Endpoint._literalFillFields(item_dict)
+            # items often repeat the same literal values, so only fill each combination once
+            key = tuple(sorted(iteritems(literal_fill_fields)))
+            try:
+                parts = filledParts[key]
+            except KeyError:
+                parts = [ part.fill(literal_fill_fields, raise_on_nonexistant_fields= False) for part in self.parts ]
+                parts = filledParts[key] = prepare(parts) if prepare is not None else parts
+            predicates = Pattern.predicates(item_dict, compiled, self.converters)
+            if stats is not None:
+                predicates = stats._timedPredicates(predicates)
+            plans.append((parts, predicates))
+
+        if plans:
+            for entry in self._planLevel(self.base, 0, plans):
                 yield entry
 
-    def info(self, nExamples= 2):
+    def _planLevel(self, baseEntry, level, plans):
+        # plans: list of (filled parts, predicates) for the items whose walk reaches baseEntry
+        leaf = level == len(self.parts) - 1
+        for here, herePlans in self._planChildren(baseEntry, level, plans, leaf):
+            if leaf:
+                yield here
+            else:
+                for entry in self._planLevel(here, level + 1, herePlans):
+                    yield entry
+
+    def _planChildren(self, baseEntry, level, plans, leaf):
+        # yields (child Entry, plans reaching it) for each child of baseEntry matched by at least one plan
+
+        # group the plans by their pattern at this level
+        literals = collections.OrderedDict()   # literal name -> plans
+        regexes = collections.OrderedDict()    # pattern value -> (pattern, plans)
+        for plan in plans:
+            pattern = plan[0][level]
+            if pattern.isLiteral:
+                literals.setdefault(pattern.value, []).append(plan)
+            else:
+                regexes.setdefault(pattern.value, (pattern, []))[1].append(plan)
+
+        # (every plan's parts at a level count into the same LevelStats, if the query is instrumented)
+        stats = plans[0][0][level].stats
+        if not regexes:
+            # only literal names: join them directly, like _scanLevel
+            for name, namePlans in iteritems(literals):
+                here = baseEntry._join(name, namePlans[0][0][level].literals)
+                if Endpoint._keep(here, leaf, None, stats):
+                    namePlans = Endpoint._unpruned(here, level, namePlans, stats)
+                    if namePlans:
+                        yield here, namePlans
+        else:
+            try:
+                if stats is not None:
+                    start = _timer()
+                    dirents = baseEntry._scandir()
+                    stats._listed(start)
+                else:
+                    dirents = baseEntry._scandir()
+            except OSError as e:
+                if e.errno in (errno.ENOENT, errno.ENOTDIR):
+                    return
+                raise
+
+            try:
+                for dirent in dirents:
+                    if not leaf and not dirent.is_dir():
+                        continue
+                    name = dirent.name
+                    if stats is not None:
+                        stats.names += 1
+                    fieldVals = None
+                    namePlans = []
+                    if name in literals:
+                        namePlans.extend(literals[name])
+                        fieldVals = namePlans[0][0][level].literals
+                    for pattern, patternPlans in itervalues(regexes):
+                        # converts typed fields, so plans' predicates compare like-typed values
+                        # (through the class, so an instrumented pattern doesn't count the name once for each pattern tried)
+                        groups = Pattern._matches(pattern, name, {})
+                        if groups is None:
+                            continue
+                        for plan in patternPlans:
+                            if all(predicate(groups[field]) for field, predicate in iteritems(plan[1]) if field in groups):
+                                namePlans.append(plan)
+                                if fieldVals is None:
+                                    fieldVals = groups
+                    if namePlans:
+                        here = baseEntry._join(name, fieldVals, dirent.is_dir() if leaf else True)
+                        if stats is not None:
+                            stats.joins += 1
+                        namePlans = Endpoint._unpruned(here, level, namePlans, stats)
+                        if namePlans:
+                            yield here, namePlans
+                    elif stats is not None:
+                        stats.rejected += 1
+            finally:
+                if hasattr(dirents, "close"):
+                    dirents.close()
+
+    def info(self, nExamples= 2, fields= None, sample= None, max_listdirs= 1000, seed= None):
         """
         Prints the number of distinct values for each field, some examples of those values,
         and the total number of Entries in the Endpoint.
@@ -302,18 +1679,47 @@ class Endpoint(object):
         nExamples : int or None, default 2
 
             Number of example values to show for each field. Use 0 or None to not print examples.
+
+        fields : iterable of str, optional
+
+            Only summarize these fields. The walk stops at the deepest directory level holding one of them,
+            so the count printed is of the directories at that level, rather than of Entries.
+
+        sample : float, optional
+
+            Instead of walking the whole Endpoint, walk a random sample of this fraction of the subdirectories
+            at each level (see `estimate_count`), and print estimated counts with approximate 95% confidence intervals.
+            Counts of distinct values are exact for fields in levels that were listed completely, and otherwise
+            estimated from how often each value was seen (Chao1).
+
+        max_listdirs : int or None, default 1000
+
+            When sampling, the most directory listings to do.
+
+        seed : optional
+
+            When sampling, seed for the random choice of directories.
         """
-        # TODO: tests
+        if sample is not None:
+            return self._sampleInfo(nExamples, fields, sample, max_listdirs, seed)
 
-        field_vals = {}
+        if fields is None:
+            fields = self.fields
+            depth = len(self.parts)
+        else:
+            fields = set(fields)
+            for field in fields:
+                if field not in self.fields:
+                    raise KeyError("Endpoint has no field '{}'".format(field))
+            depth = self._depth(fields)
+
+        field_vals = { field: set() for field in fields }
         entry_count = 0
-        for entry in self():
+        for entry in (self() if depth == len(self.parts) else self._walkTo(depth, {})):
             entry_count += 1
             for field, val in iteritems(entry):
-                try:
+                if field in field_vals:
                     field_vals[field].add(val)
-                except KeyError:
-                    field_vals[field] = {val}
         
         field_counts = { field: len(vals) for field, vals in iteritems(field_vals) }
         if nExamples:
@@ -328,21 +1734,54 @@ class Endpoint(object):
                 examples[field] = exs
             
         print("Fields:")
-        for field in sorted(self.fields):
+        for field in sorted(fields):
             if nExamples:
-                exs = ", ".join([ '"'+ex+'"' for ex in examples[field] ])
+                exs = ", ".join([ '"{}"'.format(ex) for ex in examples[field] ])
                 print('    {}: {} value{}, ex. {}'.format(field, field_counts[field], "s" if field_counts[field] > 1 else "", exs))
             else:
                 print('    {}: {} value{}'.format(field, field_counts[field], "s" if field_counts[field] > 1 else ""))
 
         print("")
-        print("{} Entries".format(entry_count))
+        if depth == len(self.parts):
+            print("{} Entries".format(entry_count))
+        else:
+            print("{} directories at level {}".format(entry_count, depth))
+
+    def _sampleInfo(self, nExamples, fields, sample, max_listdirs, seed):
+        count, distinct, values, listdirs = self._sample(sample, max_listdirs, seed, {})
+
+        def describe(estimate):
+            if estimate.low == estimate.high:
+                return "{:.0f}".format(estimate.value)
+            return "~{:.0f} (95% CI {:.0f}-{:.0f})".format(estimate.value, estimate.low, estimate.high)
+
+        print("Fields:")
+        for field in sorted(fields if fields is not None else self.fields):
+            if field not in self.fields:
+                raise KeyError("Endpoint has no field '{}'".format(field))
+            line = '    {}: {} values'.format(field, describe(distinct[field]))
+            if nExamples:
+                line += ", ex. " + ", ".join([ '"{}"'.format(ex) for ex in itertools.islice(values[field], nExamples) ])
+            print(line)
+
+        print("")
+        print("{} Entries, from {} directory listing{}".format(describe(count), listdirs, "s" if listdirs != 1 else ""))
 
-    def values(self, field):
+    def values(self, field, **params):
         """
-        Return a set of all values the given field takes on in this Endpoint.
+        Return a set of all values the given field takes on in this Endpoint (among Entries matching params, if given).
+
+        Only the directory levels down to the deepest one holding the field (or a field in params) are walked,
+        so the values of a field in the top-level directory names come from just listing that directory.
+        Values are therefore those of the directories that exist, whether or not they contain any Entries.
         """
-        return { entry[field] for entry in self() }
+        if self.index is not None and not params:
+            return self.index.values(self, field)
+        if field not in self.fields and (self.datetime is None or field != self.datetime[0]):
+            raise KeyError("Endpoint has no field '{}'".format(field))
+        if self.index is not None:
+            return { entry[field] for entry in self(**params) }
+        return { entry[field] for entry in self._walkTo(self._depth([field] + list(params)), params) }
 
     def __repr__(self):
         return "Endpoint('{}'), fields: {}".format([part.value for part in self.parts],
@@ -354,20 +1793,71 @@ class Subset(object):
 
     # head()
     # tail()
+    # cached() -> replayable, with len()
     # slice()
     # filter()
     # map() -> combine()
+    # nsmallest() / nlargest()
+    # to_columns() / to_numpy() / to_pandas()
     # attrs for each field in endpoint give subsets that iterate through just that field, not whole Entry
     # all of which return a new subset with a modified parser chain
     # + to union
     # TODO: print / repr
 
-    def __init__(self, iterable):
+    # QueryStats of the query this Subset came from, if it was instrumented
+    stats = None
+
+    def __init__(self, iterable, cache= False):
         self._iter = iter(iterable)
+        # if caching: everything taken from _iter so far, so the Subset can be iterated again without redoing the walk
+        self._cache = [] if cache else None
+        self._exhausted = False
 
     def chain(self, func):
         # TODO: private? or classmethod?
-        return Subset( func(self._iter) )
+        subset = Subset( func(iter(self)) )
+        subset.stats = self.stats
+        return subset
+
+    def cached(self):
+        """
+        A Subset of the rest of this one which remembers its items as they're produced, so it can be iterated
+        any number of times (and its `len()` taken) while only walking the filesystem once.
+        """
+        subset = Subset(iter(self), cache= True)
+        subset.stats = self.stats
+        return subset
+
+    def _replay(self):
+        # iterate through the cache, extending it from _iter as needed, so several iterations can be interleaved
+        i = 0
+        cache = self._cache
+        while True:
+            if i < len(cache):
+                yield cache[i]
+                i += 1
+            elif self._exhausted:
+                return
+            else:
+                try:
+                    item = next(self._iter)
+                except StopIteration:
+                    self._exhausted = True
+                    return
+                cache.append(item)
+
+    def __len__(self):
+        if self._cache is None:
+            raise TypeError("len() would use up this Subset; use Subset.cached() to get one that can be counted and iterated again")
+        if not self._exhausted:
+            self._cache.extend(self._iter)
+            self._exhausted = True
+        return len(self._cache)
+
+    def __bool__(self):
+        # always true, as before Subsets had a length: truth tests mustn't use up the iterable
+        return True
+    __nonzero__ = __bool__
 
     def __getattr__(self, attr):
         try:
@@ -376,22 +1866,26 @@ class Subset(object):
             return self.chain( functools.partial(map, operator.attrgetter(attr)) )
 
     def __iter__(self):
+        if self._cache is not None:
+            return self._replay()
         return self._iter
         # return functools.reduce(lambda chain, func: func(chain), self._operations, self._entries)
 
     def __add__(self, subset):
         if not isinstance(subset, Subset):
             raise TypeError("Expected another Subset, instead got '{}'".format(type(subset).__name__))
-        return Subset( itertools.chain(self._iter, subset._iter) )
+        return Subset( itertools.chain(iter(self), iter(subset)) )
 
     def head(self, n= 5):
         def do_head(iterable):
-            return itertools.islice(iterable, n)
+            return _take(iterable, n)
         return self.chain(do_head)
 
     def tail(self, n= 5):
         def do_tail(iterable):
-            return itertools.islice(iterable, -n, -1)
+            # only the last n items are held at once
+            for item in collections.deque(iterable, maxlen= n):
+                yield item
         return self.chain(do_tail)
 
     def slice(self, *args):
@@ -409,11 +1903,921 @@ class Subset(object):
     def filter(self, predicate):
         return self.chain( functools.partial(filter, predicate) )
 
-    def map(self, func):
-        return self.chain( functools.partial(map, func) )
+    def map(self, func, workers= None, executor= "thread", ordered= True, chunksize= 1):
+        """
+        Apply func to each item, lazily.
+
+        Parameters
+        ----------
+        func : function
+            Called with each item (usually an Entry). With executor="process", func must be picklable
+            (i.e. defined at the top level of a module).
+        workers : int, optional
+            If given, call func concurrently in a pool of this many workers. By default, func is called
+            serially in the consuming thread, like the built-in `map`.
+        executor : "thread" or "process"
+            Whether the workers are threads (good when func mostly does I/O or releases the GIL,
+            like numpy or decoding libraries) or processes (for pure-Python, CPU-bound work).
+        ordered : bool
+            If True, results come out in the same order as the items. Otherwise, each result is yielded
+            as soon as it's ready, so one slow item doesn't hold up the rest.
+        chunksize : int
+            Number of items sent to a worker at once. Larger chunks cut the per-item overhead of a
+            process pool, at the cost of coarser load-balancing.
+
+        At most ``2 * workers`` chunks are in flight at once, so items are only pulled from the walk as
+        results are consumed. If func raises, the exception is re-raised here with the offending item
+        attached as its ``entry`` attribute (and noted in its message, on Python 3.11+); all work that
+        hasn't started yet is cancelled. The same happens if the consumer stops early.
+        """
+        if workers is None:
+            return self.chain( functools.partial(map, func) )
+        return self.chain( lambda iterable: _parallelMap(func, iterable, workers, executor, ordered, chunksize) )
+
+    def read(self, prefetch= 4, max_bytes= None, offset= 0, length= None):
+        """
+        Iterate through (Entry, bytes) pairs of each Entry and its contents, reading upcoming files
+        in the background while the current one is being worked on.
+
+        Parameters
+        ----------
+        prefetch : int
+            Maximum number of files being read ahead of the consumer at once (also the number of reading threads).
+        max_bytes : int, optional
+            Maximum total size of the data read ahead but not yet consumed. Each file's size is found by the
+            thread reading it, once it's open. A single file larger than this is still read, but then nothing
+            else is read ahead until it's been consumed.
+        offset, length : int, optional
+            Read only `length` bytes (or to the end of the file, if None) starting at `offset`,
+            i.e. just the headers of each file.
+
+        Only the buffers not yet handed to the consumer are held on to: each one is released as soon as it's
+        yielded (and the consumer drops it). Stopping early cancels any reads that haven't started.
+        """
+        return self.chain( lambda iterable: _prefetchReads(iterable, prefetch, max_bytes, offset, length) )
+
+    def mmap(self, offset= 0, length= None):
+        """
+        Iterate through (Entry, memoryview) pairs of each Entry and a read-only memory map of its contents
+        (or the `length` bytes starting at `offset`), like `Entry.mmap`.
+
+        Each map is released as soon as the next Entry is requested (or the iteration stops), so only one
+        file is mapped at a time, unless the consumer keeps something made from the view
+        (i.e. an array from `numpy.frombuffer`), in which case that map stays open as long as it does.
+        """
+        def do_mmap(iterable):
+            for entry in iterable:
+                view = entry.mmap(offset, length)
+                try:
+                    yield entry, view
+                finally:
+                    try:
+                        view.release()
+                    except (BufferError, AttributeError):
+                        # still exported to the consumer (or Python 2): let garbage collection close it
+                        pass
+        return self.chain(do_mmap)
 
     def combine(self, func):
-        return func(self._iter)
+        return func(iter(self))
+
+    def nsmallest(self, n, key= None):
+        # The first n Entries in order of key (a field name, iterable of field names, or function, like `sort`),
+        # keeping only n Entries in memory at once
+        sortFunc = _sortKey(key) if key is not None else None
+        return self.chain( lambda iterable: iter(heapq.nsmallest(n, iterable, key= sortFunc)) )
+
+    def nlargest(self, n, key= None):
+        # The last n Entries in order of key, largest first
+        sortFunc = _sortKey(key) if key is not None else None
+        return self.chain( lambda iterable: iter(heapq.nlargest(n, iterable, key= sortFunc)) )
+
+    def to_columns(self, fields= None, path= True):
+        """
+        Collects the Entries into columns, in one pass.
+
+        Returns an OrderedDict of {"path": list of paths, field: EncodedColumn, ...}. Each field is dictionary-encoded:
+        its distinct values are stored once, in `categories`, and each Entry's value as an integer code into them,
+        so a column costs a few bytes per Entry, no matter how long its values are.
+
+        Parameters
+        ----------
+
+        fields : iterable of str, optional
+
+            Fields to collect. By default, those of the first Entry.
+
+        path : bool, default True
+
+            Whether to collect a column of paths.
+        """
+        columns = collections.OrderedDict()
+        paths = [] if path else None
+        encoders = None
+        for entry in self:
+            if encoders is None:
+                if fields is None:
+                    fields = sorted(entry.fields.keys())
+                # field -> (value -> code, codes, categories)
+                encoders = [ (field, {}, array.array(native_str("l")), []) for field in fields ]
+            if paths is not None:
+                paths.append(entry.path)
+            for field, lookup, codes, categories in encoders:
+                try:
+                    value = entry[field]
+                except KeyError:
+                    value = None
+                if value is None:
+                    codes.append(-1)
+                else:
+                    code = lookup.get(value)
+                    if code is None:
+                        code = lookup[value] = len(categories)
+                        categories.append(value)
+                    codes.append(code)
+
+        if paths is not None:
+            columns["path"] = paths
+        if encoders is None:
+            encoders = [ (field, None, array.array(native_str("l")), []) for field in (fields or []) ]
+        for field, lookup, codes, categories in encoders:
+            columns[field] = EncodedColumn(codes, categories)
+        return columns
+
+    def to_numpy(self, fields= None, path= True):
+        """
+        Collects the Entries into a NumPy structured array. Requires NumPy. Takes the same arguments as `to_columns`.
+
+        String fields become fixed-width unicode columns (empty where a field has no value). Typed fields keep their type
+        where NumPy has one (ints with missing values become floats, with NaN), otherwise they're object columns.
+        """
+        import numpy as np
+        columns = self.to_columns(fields, path)
+        length = 0
+        arrays = []
+        for name, column in iteritems(columns):
+            if isinstance(column, EncodedColumn):
+                codes = np.asarray(column.codes)
+                missing = bool((codes == -1).any())
+                categories = np.array(column.categories) if column.categories else np.array([], dtype= "U1")
+                # the value for code -1 (no value) goes at the end of categories
+                if categories.dtype.kind == "U":
+                    categories = np.append(categories, np.array([""], dtype= categories.dtype))
+                elif categories.dtype.kind in "iufb":
+                    if missing:
+                        categories = categories.astype(float)
+                    categories = np.append(categories, np.array([np.nan if missing else 0], dtype= categories.dtype))
+                else:
+                    objects = np.empty(len(column.categories) + 1, dtype= object)
+                    objects[:-1] = column.categories
+                    categories = objects
+                values = categories[codes]
+            else:
+                values = np.array(column) if column else np.array([], dtype= "U1")
+            length = len(values)
+            arrays.append((native_str(name), values))
+
+        result = np.empty(length, dtype= [ (name, values.dtype) for name, values in arrays ])
+        for name, values in arrays:
+            result[name] = values
+        return result
+
+    def to_pandas(self, fields= None, path= True, categorical= True):
+        """
+        Collects the Entries into a pandas DataFrame, with each field as a Categorical column (or, if not `categorical`,
+        a column of strings). Requires pandas. Takes the same arguments as `to_columns`.
+        """
+        import numpy as np
+        import pandas as pd
+        columns = self.to_columns(fields, path)
+        data = collections.OrderedDict()
+        for name, column in iteritems(columns):
+            if isinstance(column, EncodedColumn):
+                if categorical:
+                    data[name] = pd.Categorical.from_codes(np.asarray(column.codes), categories= column.categories)
+                else:
+                    data[name] = column.values()
+            else:
+                data[name] = column
+        return pd.DataFrame(data, columns= list(columns.keys()))
+
+
+class EncodedColumn(collections.namedtuple("EncodedColumn", ["codes", "categories"])):
+    # A dictionary-encoded column, from Subset.to_columns: the value in row i is categories[codes[i]], or None if codes[i] is -1
+    __slots__ = ()
+
+    def values(self):
+        # the decoded column, as a list
+        categories = self.categories
+        return [ categories[code] if code >= 0 else None for code in self.codes ]
+
+
+class Estimate(collections.namedtuple("Estimate", ["value", "low", "high"])):
+    # An estimated quantity with (approximate 95%) confidence bounds, from Endpoint.estimate_count
+    __slots__ = ()
+
+
+class LevelStats(object):
+    # Counts of the work done at one level (Pattern) of an instrumented walk. see QueryStats
+    __slots__ = ("pattern", "listdirs", "listSeconds", "names", "rejected", "matchSeconds", "probes", "missing", "joins", "pruned")
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        # directories listed, and time spent listing them
+        self.listdirs = 0
+        self.listSeconds = 0.0
+        # names tested against the pattern, how many didn't match it (or its filters), and time spent testing them
+        self.names = 0
+        self.rejected = 0
+        self.matchSeconds = 0.0
+        # existence checks (stats) of literal names or candidates, and how many of those didn't exist
+        self.probes = 0
+        self.missing = 0
+        # Entries created, and how many of them were pruned (i.e. outside a time_range)
+        self.joins = 0
+        self.pruned = 0
+
+    @property
+    def entries(self):
+        # Entries that made it through this level
+        return self.joins - self.missing - self.pruned
+
+    def _listed(self, start):
+        self.listdirs += 1
+        self.listSeconds += _timer() - start
+
+    def _counting(self, matches):
+        # wraps a Pattern's _matches to count the names tested
+        def counted(string, predicates, convert= True):
+            start = _timer()
+            fieldVals = matches(string, predicates, convert)
+            self.matchSeconds += _timer() - start
+            self.names += 1
+            if fieldVals is None:
+                self.rejected += 1
+            else:
+                self.joins += 1
+            return fieldVals
+        return counted
+
+    def as_dict(self):
+        counts = { attr: getattr(self, attr) for attr in LevelStats.__slots__ }
+        counts["entries"] = self.entries
+        return counts
+
+
+class FilterStats(object):
+    # Calls to one field's filter (predicate) in an instrumented query, how many rejected the value, and time spent in it
+    __slots__ = ("calls", "rejected", "seconds")
+
+    def __init__(self):
+        self.calls = 0
+        self.rejected = 0
+        self.seconds = 0.0
+
+    def as_dict(self):
+        return { attr: getattr(self, attr) for attr in FilterStats.__slots__ }
+
+
+class QueryStats(object):
+    """
+    What an instrumented query (`endpoint(..., stats= True)`) did, as the `stats` of the resulting Subset.
+
+    Attributes
+    ----------
+
+    levels : list of LevelStats
+
+        For each level of the Endpoint's pattern: directories listed (`listdirs`, `listSeconds`), names tested
+        against the pattern (`names`, `rejected`, `matchSeconds`), existence checks (`probes`, `missing`),
+        and Entries created (`joins`), pruned, and passed on to the next level (`entries`).
+
+    filters : dict of {field: FilterStats}
+
+        For each filtered field, how many values its filter was called on, how many it rejected, and the time spent in it.
+
+    entries : int
+
+        Number of Entries yielded so far.
+
+    seconds : float
+
+        Time spent in the query so far: in the walk, not in the code consuming its results.
+
+    done : bool
+
+        Whether the query has finished (run to the end, or been stopped early).
+
+    Counts fill in as the Subset is iterated. Queries answered from an index, and the levels of queries with `items`,
+    only count Entries and time. With `workers`, counts may be slightly low, since threads update them concurrently.
+    `print(stats)` shows a report; `as_dict()` gives everything as plain (JSON-able) values.
+    """
+
+    def __init__(self, endpoint, parts):
+        self.endpoint = endpoint
+        self.levels = [ LevelStats(part.value) for part in parts ]
+        self.filters = {}
+        self.entries = 0
+        self.seconds = 0.0
+        self.done = False
+
+    def _instrument(self, parts):
+        # copies of parts that count their work in self.levels
+        instrumented = []
+        for part, level in zip(parts, self.levels):
+            part = copy.copy(part)
+            part.stats = level
+            part._matches = level._counting(part._matches)
+            instrumented.append(part)
+        return instrumented
+
+    def _timedPredicates(self, predicates):
+        # predicates, wrapped to count their calls and time in self.filters
+        def timed(predicate, stats):
+            def timedPredicate(value):
+                start = _timer()
+                result = predicate(value)
+                stats.seconds += _timer() - start
+                stats.calls += 1
+                if not result:
+                    stats.rejected += 1
+                return result
+            return timedPredicate
+        return { field: timed(predicate, self.filters.setdefault(field, FilterStats())) for field, predicate in iteritems(predicates) }
+
+    def _timed(self, matches, hook):
+        # matches, timing each step of the walk, counting Entries, and calling hook once it's done
+        iterator = iter(matches)
+        try:
+            while True:
+                start = _timer()
+                try:
+                    entry = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    self.seconds += _timer() - start
+                self.entries += 1
+                yield entry
+        finally:
+            if hasattr(iterator, "close"):
+                iterator.close()
+            self.done = True
+            if hook is not None:
+                hook(self)
+
+    def as_dict(self):
+        return {
+            "endpoint": self.endpoint,
+            "entries": self.entries,
+            "seconds": self.seconds,
+            "done": self.done,
+            "levels": [ level.as_dict() for level in self.levels ],
+            "filters": { field: stats.as_dict() for field, stats in iteritems(self.filters) }
+        }
+
+    def __repr__(self):
+        lines = ["Query of {}: {} Entries in {:.3f} s{}".format(self.endpoint or "Endpoint", self.entries, self.seconds, "" if self.done else " (so far)")]
+        lines.append("{:>5} {:>8} {:>10} {:>9} {:>9} {:>10} {:>7} {:>9}  {}".format("level", "listdirs", "list ms", "names", "rejected", "match ms", "probes", "entries", "pattern"))
+        for i, level in enumerate(self.levels):
+            lines.append("{:>5} {:>8} {:>10.1f} {:>9} {:>9} {:>10.1f} {:>7} {:>9}  {}".format(
+                i, level.listdirs, 1e3 * level.listSeconds, level.names, level.rejected, 1e3 * level.matchSeconds, level.probes, level.entries, level.pattern))
+        for field, stats in sorted(iteritems(self.filters)):
+            lines.append("filter {}: {} calls, {} rejected, {:.1f} ms".format(field, stats.calls, stats.rejected, 1e3 * stats.seconds))
+        return "\n".join(lines)
+
+
+class _SampleNode(object):
+    # A directory listed while sampling (see Endpoint._sample), with the subdirectories chosen from it
+    __slots__ = ("entry", "n", "children", "result")
+
+    def __init__(self, entry):
+        self.entry = entry
+        # number of matching names in its listing (None if it wasn't listed)
+        self.n = None
+        # _SampleNodes for the sampled subset of those names (None at the last level)
+        self.children = None
+        # (estimated number of Entries beneath it, estimated variance of that), or None if that can't be estimated
+        self.result = None
+
+    def estimate(self, leaf, cv2, pooled= None):
+        # Sets self.result, once all the children's are set. The standard multistage estimator: with k of n subtrees
+        # sampled at random, total = n/k * the sum of their estimates, with variance n^2 (1 - k/n) s^2/k between subtrees,
+        # plus n/k * the sum of their own variances. Appends s^2/mean^2 for this directory to cv2.
+        # With just one subtree, the variation between subtrees can't be seen: then this needs `pooled`, the cv2 of
+        # the other directories at this level, and returns False without it.
+        if self.n is None:
+            return True
+        if leaf or self.n == 0:
+            self.result = (float(self.n), 0.0)
+            return True
+        estimates = [ child.result for child in self.children if child.result is not None ]
+        k = len(estimates)
+        if k == 0:
+            return True
+        n = self.n
+        values = [ value for value, variance in estimates ]
+        mean = sum(values) / k
+        if k == n:
+            between = 0.0
+        elif k > 1:
+            s2 = sum((value - mean) ** 2 for value in values) / (k - 1)
+            between = n * n * (1 - k / n) * s2 / k
+            if mean > 0:
+                cv2.append(s2 / mean ** 2)
+        elif pooled is None:
+            return False
+        else:
+            between = n * n * (1 - k / n) * mean ** 2 * sum(pooled) / len(pooled) if pooled else float("inf")
+        within = n / k * sum(variance for value, variance in estimates)
+        self.result = (n * mean, between + within)
+        return True
+
+
+def _chao1(frequencies):
+    # Chao1 estimate of the number of distinct values, from how many times each value seen was seen,
+    # with the log-normal confidence interval (Chao 1987): the estimate can't be less than the number seen
+    frequencies = list(frequencies)
+    observed = len(frequencies)
+    f1 = sum(1 for f in frequencies if f == 1)
+    f2 = sum(1 for f in frequencies if f == 2)
+    if f1 == 0:
+        return Estimate(observed, observed, observed)
+    if f2 > 0:
+        ratio = f1 / f2
+        estimate = observed + f1 * f1 / (2 * f2)
+        variance = f2 * (ratio ** 2 / 2 + ratio ** 3 + ratio ** 4 / 4)
+    else:
+        # bias-corrected form, which stays finite without any values seen twice
+        estimate = observed + f1 * (f1 - 1) / 2
+        variance = f1 * (f1 - 1) / 2 + f1 * (2 * f1 - 1) ** 2 / 4 - f1 ** 4 / (4 * estimate)
+    unseen = estimate - observed
+    if unseen <= 0 or variance <= 0:
+        return Estimate(estimate, observed, estimate)
+    spread = math.exp(1.96 * math.sqrt(math.log(1 + variance / unseen ** 2)))
+    return Estimate(estimate, observed + unseen / spread, observed + unseen * spread)
+
+
+def _sortKey(sort):
+    # key function for a `sort` argument
+    # singleton string (entry attr to sort on)
+    if isinstance(sort, basestring):
+        return operator.attrgetter(sort)
+    # function (entry -> orderable type)
+    elif hasattr(sort, "__call__"):
+        return sort
+    # iterable of strings
+    else:
+        try:
+            iter(sort)
+        except TypeError:
+            raise TypeError("Sort key must be a singleton string, iterable of strings, or function; instead got non-iterable type {}".format(type(sort)))
+        if all(isinstance(key, basestring) for key in sort):
+            return lambda e: tuple(getattr(e, key) for key in sort)
+        else:
+            raise TypeError("When an iterable of sort keys are given, all must be strings")
+
+
+def _merge(iterables, key):
+    # heapq.merge of already-sorted iterables, with a key function (which heapq.merge only takes on Python 3.5+).
+    # Ties come out in the order of the iterables, then in order within each one, so merging is stable.
+    def decorate(i, iterable):
+        for j, item in enumerate(iterable):
+            yield (key(item), i, j), item
+
+    for decorated, item in heapq.merge(*[ decorate(i, iterable) for i, iterable in enumerate(iterables) ]):
+        yield item
+
+
+def _outsideWindow(fields, start, end, entry):
+    # whether an Entry holding the leading datetime fields `fields` (i.e. year and month) covers a span of time
+    # entirely outside [start, end): if so, nothing beneath it can be in the window either
+    try:
+        values = [ int(entry[field]) for field in fields ]
+        floor = datetime.datetime(*values + [1, 1][len(values) - 1:])
+    except (KeyError, ValueError, TypeError):
+        # not a valid date, so nothing beneath it has a datetime in the window
+        return True
+    try:
+        if len(values) == 1:
+            ceiling = datetime.datetime(values[0] + 1, 1, 1)
+        elif len(values) == 2:
+            ceiling = datetime.datetime(values[0] + values[1] // 12, values[1] % 12 + 1, 1)
+        else:
+            ceiling = floor + datetime.timedelta(**{ ["days", "hours", "minutes", "seconds"][len(values) - 3]: 1 })
+    except (ValueError, OverflowError):
+        ceiling = datetime.datetime.max
+    return (start is not None and ceiling <= start) or (end is not None and floor >= end)
+
+
+def _applyChunk(func, chunk):
+    # Run func over a chunk of items in a worker, attaching the item to any exception raised
+    results = []
+    for item in chunk:
+        try:
+            results.append(func(item))
+        except Exception as e:
+            e.entry = item
+            if hasattr(e, "add_note"):
+                e.add_note("while processing {}".format(getattr(item, "path", repr(item))))
+            raise
+    return results
+
+
+def _parallelMap(func, iterable, workers, executor, ordered, chunksize):
+    # Generator of func(item) for each item, computed by a pool of `workers` threads or processes,
+    # with at most 2 * workers chunks submitted but not yet yielded
+    if futures is None:
+        raise ValueError("Parallel map requires the concurrent.futures module (on Python 2, install the `futures` package)")
+    if workers < 1:
+        raise ValueError("workers must be at least 1, not {}".format(workers))
+    if chunksize < 1:
+        raise ValueError("chunksize must be at least 1, not {}".format(chunksize))
+    if executor == "thread":
+        pool = futures.ThreadPoolExecutor(max_workers= workers)
+    elif executor == "process":
+        pool = futures.ProcessPoolExecutor(max_workers= workers)
+    else:
+        raise ValueError("executor must be 'thread' or 'process', not {!r}".format(executor))
+
+    chunks = iter(lambda iterator=iter(iterable): list(itertools.islice(iterator, chunksize)), [])
+    maxPending = 2 * workers
+    pending = collections.deque() if ordered else set()
+
+    def submit():
+        # submit the next chunk; False if there are none left
+        for chunk in itertools.islice(chunks, 1):
+            future = pool.submit(_applyChunk, func, chunk)
+            if ordered:
+                pending.append(future)
+            else:
+                pending.add(future)
+            return True
+        return False
+
+    try:
+        while len(pending) < maxPending and submit():
+            pass
+        while pending:
+            if ordered:
+                done = [ pending.popleft() ]
+            else:
+                done, _ = futures.wait(pending, return_when= futures.FIRST_COMPLETED)
+                pending.difference_update(done)
+            for future in done:
+                results = future.result()
+                # refill before yielding, so the pool keeps working while the consumer does
+                while len(pending) < maxPending and submit():
+                    pass
+                for result in results:
+                    yield result
+    finally:
+        for future in pending:
+            future.cancel()
+        pool.shutdown(wait= False)
+
+
+def _readOpened(opened):
+    # read what Entry._openRange opened, and close it
+    f, size = opened
+    with f:
+        return f.read(size)
+
+
+def _prefetchReads(iterable, prefetch, maxBytes, offset, length):
+    # Generator of (entry, contents) for each Entry in iterable, in order, with up to `prefetch` files
+    # (and `maxBytes` bytes of them) being read, or read, ahead of the consumer.
+    # Each file is opened in the background first, which gives its size (by fstat, rather than a stat beforehand
+    # in the consumer's thread); its read is started, in order, once there's room for it in the byte budget.
+    if futures is None:
+        raise ValueError("Prefetching requires the concurrent.futures module (on Python 2, install the `futures` package)")
+    if prefetch < 1:
+        raise ValueError("prefetch must be at least 1, not {}".format(prefetch))
+
+    pool = futures.ThreadPoolExecutor(max_workers= prefetch)
+    entries = iter(iterable)
+    # [entry, future of Entry._openRange, future of its contents (once started), bytes charged] for each file ahead, in order
+    pending = collections.deque()
+    # bytes of the reads started and not yet handed to the consumer
+    held = [0]
+    closed = [False]
+    # (re-entrant, since a callback added to a future that's already done runs straight away)
+    lock = threading.RLock()
+
+    def advance():
+        # start the reads that are ready, in order, while they fit in the budget (or nothing else is held); call with lock held
+        for item in pending:
+            if item[2] is not None:
+                continue
+            if closed[0] or not item[1].done():
+                return
+            if item[1].exception() is not None:
+                # couldn't be opened: the consumer gets the error in its turn
+                item[2] = item[1]
+                continue
+            size = item[1].result()[1]
+            if maxBytes is not None and held[0] and held[0] + size > maxBytes:
+                return
+            item[2] = pool.submit(_readOpened, item[1].result())
+            item[3] = size
+            held[0] += size
+
+    def opened(item, future):
+        with lock:
+            if not closed[0]:
+                advance()
+            elif item[2] is None:
+                closeOpened(item)
+
+    def closeOpened(item):
+        # close a file that was opened, but won't be read
+        if item[1].done() and not item[1].cancelled() and item[1].exception() is None:
+            item[1].result()[0].close()
+
+    def fill():
+        while len(pending) < prefetch:
+            entry = next(entries, None)
+            if entry is None:
+                return
+            item = [entry, pool.submit(entry._openRange, offset, length), None, 0]
+            with lock:
+                pending.append(item)
+            item[1].add_done_callback(functools.partial(opened, item))
+
+    try:
+        fill()
+        while pending:
+            item = pending[0]
+            if item[2] is None:
+                # nothing's held ahead of the consumer's next file, so its read starts as soon as it's open
+                futures.wait([item[1]])
+                with lock:
+                    advance()
+            contents = item[2].result()
+            with lock:
+                pending.popleft()
+                held[0] -= item[3]
+                advance()
+            fill()
+            yield item[0], contents
+            # don't keep a reference to the buffer while waiting on the next read
+            del contents
+    finally:
+        with lock:
+            closed[0] = True
+            for item in pending:
+                item[1].cancel()
+                if item[2] is None or (item[2] is not item[1] and item[2].cancel()):
+                    closeOpened(item)
+        pool.shutdown(wait= False)
+
+
+def _take(iterable, n):
+    # Like itertools.islice(iterable, n), but closes iterable once n items have been taken,
+    # so a walk (and any listings it has running in the background) stops promptly, rather than whenever it's garbage-collected
+    iterator = iter(iterable)
+    try:
+        for i in range(n):
+            try:
+                yield next(iterator)
+            except StopIteration:
+                return
+    finally:
+        if hasattr(iterator, "close"):
+            iterator.close()
+
+
+class AsyncSubset(object):
+    # An asynchronous iterator over the results of a (synchronous) query, which runs in its own thread.
+    # Found items are passed to the event loop through a buffer of bounded size, so the walk can run ahead of the consumer,
+    # but not arbitrarily far.
+    # Written without async/await syntax so this module still imports on Python 2.
+
+    _done = object()
+
+    def __init__(self, query, buffer= 64):
+        # query: function returning an iterable; called in the background thread
+        try:
+            _asyncio()
+        except ImportError:
+            raise ValueError("Asynchronous iteration requires asyncio (Python 3.4+)")
+        self._query = query
+        self._loop = None
+        self._buffer = collections.deque()
+        self._slots = threading.Semaphore(buffer)
+        self._waiter = None
+        self._closed = False
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        if self._loop is None:
+            self._loop = _asyncio().get_event_loop()
+            thread = threading.Thread(target= self._produce)
+            thread.daemon = True
+            thread.start()
+
+        future = self._loop.create_future()
+        if self._buffer:
+            self._deliver(future, self._buffer.popleft())
+        elif self._closed:
+            future.set_exception(StopAsyncIteration())
+        else:
+            self._waiter = future
+        return future
+
+    def aclose(self):
+        """
+        Stop the query running in the background. Awaitable.
+        """
+        if not self._closed:
+            self._closed = True
+            self._buffer.clear()
+            # wake up the producer if it's waiting on a full buffer, so it can see we're closed
+            self._slots.release()
+        future = (self._loop or _asyncio().get_event_loop()).create_future()
+        future.set_result(None)
+        return future
+
+    def __aenter__(self):
+        future = _asyncio().get_event_loop().create_future()
+        future.set_result(self)
+        return future
+
+    def __aexit__(self, exc_type, exc, tb):
+        return self.aclose()
+
+    def _produce(self):
+        # runs in the background thread
+        iterator = None
+        try:
+            iterator = iter(self._query())
+            for item in iterator:
+                self._slots.acquire()
+                if self._closed:
+                    break
+                self._loop.call_soon_threadsafe(self._put, item)
+            else:
+                self._loop.call_soon_threadsafe(self._put, AsyncSubset._done)
+        except Exception as e:
+            self._loop.call_soon_threadsafe(self._put, _Raise(e))
+        finally:
+            if hasattr(iterator, "close"):
+                iterator.close()
+
+    def _put(self, item):
+        # runs in the event loop
+        if self._closed:
+            return
+        if self._waiter is not None and not self._waiter.cancelled():
+            waiter, self._waiter = self._waiter, None
+            self._deliver(waiter, item)
+        else:
+            self._buffer.append(item)
+
+    def _deliver(self, future, item):
+        if item is AsyncSubset._done:
+            self._closed = True
+            future.set_exception(StopAsyncIteration())
+        elif isinstance(item, _Raise):
+            self._closed = True
+            future.set_exception(item.exception)
+        else:
+            self._slots.release()
+            future.set_result(item)
+
+
+class _Raise(object):
+    # wraps an exception raised while producing items, to be re-raised by the consumer
+    def __init__(self, exception):
+        self.exception = exception
+
+
+class Filter(object):
+    # A filter for a field that the walker can see into, rather than only call on each value:
+    # Pattern.fill() can enumerate the exact names it allows, or narrow the field's regex, and Pattern.predicate
+    # compiles it straight to a comparison.
+
+    # literal string every value allowed by the filter starts with, if any
+    prefix = None
+
+    def __call__(self, value):
+        # so a Filter still works anywhere a callable filter does
+        return self.predicate()(value)
+
+    def predicate(self, converter= None):
+        # function of a field's value (converted by converter, if the field is typed) giving whether the filter allows it
+        raise NotImplementedError
+
+    def enumerate(self, groupRegex, typeName= None):
+        # list of all the strings matching the field's regex (groupRegex) that the filter allows, or None if there are too many or it can't tell
+        return None
+
+    def narrow(self, groupRegex):
+        # a regex matching only the strings groupRegex matches that the filter allows, or None
+        return None
+
+
+class Range(Filter):
+    """
+    Filter allowing values between `low` and `high` (either can be None, for no bound), made by `between`, `gt` and `lt`.
+
+    For a field that isn't typed, numeric bounds are compared to the value parsed as a float, like a number filter.
+    A small range of integers on a fixed-width field of digits (like `(?P<year>\\d{4})`) is turned into the exact names
+    it allows, so those can be checked for directly.
+    """
+    def __init__(self, low= None, high= None, includeLow= True, includeHigh= True):
+        self.low = low
+        self.high = high
+        self.includeLow = includeLow
+        self.includeHigh = includeHigh
+
+    def predicate(self, converter= None):
+        low, high = self.low, self.high
+        if converter is not None:
+            low, high = [ converter(bound) if isinstance(bound, basestring) else bound for bound in (low, high) ]
+        lowOk = operator.le if self.includeLow else operator.lt
+        highOk = operator.le if self.includeHigh else operator.lt
+        numeric = converter is None and any(isinstance(bound, numbers.Number) for bound in (low, high))
+
+        def inRange(value):
+            if value is None:
+                return False
+            if numeric:
+                try:
+                    value = float(value)
+                except ValueError:
+                    return False
+            return (low is None or lowOk(low, value)) and (high is None or highOk(value, high))
+        return inRange
+
+    # a regex of just digits, which could have a fixed width
+    digitsRegex = re.compile(r"^(?:(?:\\d|\[0-9\])(?:\{\d+\})?)+$")
+
+    def enumerate(self, groupRegex, typeName= None):
+        if typeName not in (None, "int", "float"):
+            return None
+        if not all(bound is None or isinstance(bound, numbers.Integral) and not isinstance(bound, bool) for bound in (self.low, self.high)):
+            return None
+        if not Range.digitsRegex.match(groupRegex):
+            return None
+        fieldRegex = re.compile("^(?:{})$".format(groupRegex))
+        widths = [ width for width in range(1, 20) if fieldRegex.match("0" * width) ]
+        if len(widths) != 1:
+            # without a fixed width, a value could be written with any number of leading zeros
+            return None
+        # digits can't make negative numbers, or ones longer than the width
+        low = 0 if self.low is None else max(self.low if self.includeLow else self.low + 1, 0)
+        high = 10 ** widths[0] - 1 if self.high is None else min(self.high if self.includeHigh else self.high - 1, 10 ** widths[0] - 1)
+        if high - low + 1 > Pattern.max_candidates:
+            return None
+        return [ "{:0{}d}".format(value, widths[0]) for value in range(low, high + 1) ]
+
+    def __repr__(self):
+        return "{}{}, {}{}".format("[" if self.includeLow else "(", self.low, self.high, "]" if self.includeHigh else ")")
+
+
+class Prefix(Filter):
+    """
+    Filter allowing string values that start with `prefix`, made by `iyore.prefix`.
+
+    The field's regex is narrowed to only match values starting with the prefix, and names that
+    can't start with it are rejected with a string comparison before the regex is even tried.
+    """
+    def __init__(self, prefix):
+        if not isinstance(prefix, basestring):
+            raise TypeError("A prefix must be a string, not {}".format(type(prefix)))
+        self.prefix = prefix
+
+    def predicate(self, converter= None):
+        if converter is not None and converter is not str:
+            raise TypeError("Prefix filters only work on fields that aren't typed, or are typed str")
+        prefix = self.prefix
+        return lambda value: value is not None and value.startswith(prefix)
+
+    def narrow(self, groupRegex):
+        return "(?={})(?:{})".format(Pattern.escape(self.prefix), groupRegex)
+
+    def __repr__(self):
+        return "prefix({!r})".format(self.prefix)
+
+
+def between(low, high):
+    """Filter for values from `low` to `high`, inclusive: `year= iyore.between(2010, 2015)`"""
+    return Range(low, high, True, True)
+
+def gt(value):
+    """Filter for values greater than `value`"""
+    return Range(value, None, False, True)
+
+def lt(value):
+    """Filter for values less than `value`"""
+    return Range(None, value, True, False)
+
+def prefix(value):
+    """Filter for string values starting with `value`"""
+    return Prefix(value)
 
 
 class Pattern(object):
@@ -425,30 +2829,116 @@ class Pattern(object):
     # matches(string, **kwargs) : returns dict of field values matched in string, as restricted by **kwargs, or None if pattern not matched
     # isLiteral: bool
 
+    # a named group declaring its field's type, like (?P<year:int>...)
+    typeAnnotation = re.compile(r"(?<!\\)\(\?P<(\w+):(\w+)>")
+
     # TODO: should pattern be explicitly full-line, ie insert ^ and $ ?
-    def __init__(self, pattern, literals= {}):
+    def __init__(self, pattern, literals= {}, types= None):
+        # field -> name of its type (in iyore.converters), from annotations in the pattern, or given (i.e. by fill())
+        self.types = dict(types) if types is not None else {}
+        def stripType(match):
+            self.types[match.group(1)] = match.group(2)
+            return "(?P<{}>".format(match.group(1))
+        pattern = Pattern.typeAnnotation.sub(stripType, pattern)
+        self.converters = {}
+        for field, typeName in iteritems(self.types):
+            try:
+                self.converters[field] = converters[typeName]
+            except KeyError:
+                raise ValueError("Unknown type '{}' for the field '{}' in pattern '{}' (known types are: {})".format(typeName, field, pattern, ", ".join(sorted(converters))))
+
         self.value = pattern
         try:
-            self.regex = re.compile(pattern)
+            self._regex = re.compile(pattern)
         except re.error as e:
             raise ValueError("Regex syntax error in pattern '{}': {}".format(pattern, e.args[0]))
-        self.literals = literals
-        self.fields = set(self.regex.groupindex.keys())
+        self.literals = { field: self._convert(field, value) for field, value in iteritems(literals) } if self.converters else literals
+        # (field, converter) for the typed fields captured by the regex
+        self._groupConverters = [ (field, converter) for field, converter in iteritems(self.converters) if field in self._regex.groupindex ]
+        self.fields = set(self._regex.groupindex.keys())
         self.fields.update(literals.keys())
         self.isLiteral = Pattern.isLiteral(pattern)
         self.pattern_parts = self.named_group_positions = self.compiled_groups = None
+        # for a filled pattern that can only match a few exact names: list of (name, field values), so the walk can join them directly.
+        # see fill()
+        self.candidates = None
+        # literal string all names matching a filled pattern start with, checked before trying the regex. see fill()
+        self.namePrefix = None
+        # function of an Entry found with this pattern, giving whether to skip it (and everything beneath it). see Endpoint._pruningParts
+        self.prunes = None
+        # LevelStats to count the work done at this level of a walk, if the query is instrumented. see QueryStats
+        self.stats = None
+
+    @property
+    def regex(self):
+        # compiled on first use, for Patterns loaded from a structure cache
+        regex = self._regex
+        if regex is None:
+            regex = self._regex = re.compile(self.value)
+        return regex
+
+    def _state(self):
+        # JSON-able form of an (unfilled) Pattern, for the structure cache. see Dataset._loadStructureFile
+        if self.pattern_parts is None:
+            try:
+                self.pattern_parts, self.named_group_positions = Pattern.split_named_groups(self.value)
+            except ValueError:
+                # leave fill() to raise the error, as it would have without the cache
+                pass
+        return {
+            "value": self.value,
+            "types": self.types,
+            "fields": sorted(self.fields),
+            "isLiteral": self.isLiteral,
+            "parts": self.pattern_parts,
+            "positions": self.named_group_positions
+        }
+
+    @classmethod
+    def _fromState(cls, state):
+        # a Pattern from its _state(), without compiling its regex yet
+        pattern = cls.__new__(cls)
+        pattern.types = dict(state["types"])
+        pattern.converters = { field: converters[typeName] for field, typeName in iteritems(pattern.types) }
+        pattern.value = state["value"]
+        pattern._regex = None
+        pattern.literals = {}
+        pattern.fields = set(state["fields"])
+        pattern._groupConverters = [ (field, converter) for field, converter in iteritems(pattern.converters) if field in pattern.fields ]
+        pattern.isLiteral = state["isLiteral"]
+        pattern.pattern_parts = state["parts"]
+        pattern.named_group_positions = state["positions"]
+        pattern.compiled_groups = None
+        pattern.candidates = None
+        pattern.namePrefix = None
+        pattern.prunes = None
+        pattern.stats = None
+        return pattern
+
+    # most exact names a filled pattern will enumerate as candidates
+    max_candidates = 1024
 
     def fill(self, fields, raise_on_nonexistant_fields= True):
+        # fields: { field: literal string, iterable of literal strings, or Filter }
+        # Singleton strings are filled into the pattern in place of their field's regex.
+        # Filters are turned into the values they allow, like iterables, if they can enumerate them; otherwise they may narrow the field's regex.
+        # If the pattern is left with no other regex, the exact names it can match are set as its `candidates`:
+        # one for each combination of the values given in iterables.
         if self.isLiteral:
             return self
-        if self.pattern_parts is None:
-            self.pattern_parts, self.named_group_positions = Pattern.split_named_groups(self.value)
+        if self.compiled_groups is None:
+            if self.pattern_parts is None:
+                self.pattern_parts, self.named_group_positions = Pattern.split_named_groups(self.value)
             # compile each capturing group on its own to use for validating literal values:            
             # extract matched pattern from each named group, wrap in ^ and $ (to make it a full-string match, as re.fullmatch is not in py2)
             self.compiled_groups = { field: re.compile("^{}$".format( self.pattern_parts[pos][ len("(?P<>")+len(field):-1 ] )) for field, pos in iteritems(self.named_group_positions) }
 
         new_parts = list(self.pattern_parts)
+        singletons = {}
+        alternatives = []   # (field, index in new_parts, possible values) for fields given an iterable
+        prefixes = {}       # index in new_parts -> literal prefix of the values allowed there, for fields narrowed by a Filter
         for field, literal_value in iteritems(fields):
+            isSingleton = Pattern.isLiteral(literal_value)
             # TODO: convert literal_value to str if necessary---any way to intelligently format number to format of regex??
             try:
                 field_regex = self.compiled_groups[ field ]
@@ -458,13 +2948,81 @@ class Pattern(object):
                     raise ValueError('The field "{}" does not exist in the pattern "{}"'.format(field, self.value))
                 else:
                     continue
-            # ensure the given literal value actually matches its field's pattern
-            if not field_regex.match(literal_value):
-                raise ValueError('"{}" does not match the pattern for the field "{}" (must match the regular expression "{}")'.format(literal_value, field, field_regex.pattern))
-            
-            new_parts[field_index] = Pattern.escape(literal_value)
 
-        return Pattern("".join(new_parts), literals= fields)
+            if isinstance(literal_value, Filter):
+                groupRegex = self.pattern_parts[field_index][ len("(?P<>")+len(field):-1 ]
+                values = literal_value.enumerate(groupRegex, self.types.get(field))
+                if values is not None:
+                    # a Filter allowing only a few names is just like an iterable of them
+                    alternatives.append((field, field_index, [ value for value in values if field_regex.match(value) ]))
+                else:
+                    narrowed = literal_value.narrow(groupRegex)
+                    if narrowed is not None:
+                        new_parts[field_index] = "(?P<{}>{})".format(field, narrowed)
+                        if literal_value.prefix is not None:
+                            prefixes[field_index] = literal_value.prefix
+
+            elif isSingleton:
+                # ensure the given literal value actually matches its field's pattern
+                if not field_regex.match(literal_value):
+                    raise ValueError('"{}" does not match the pattern for the field "{}" (must match the regular expression "{}")'.format(literal_value, field, field_regex.pattern))
+                
+                new_parts[field_index] = Pattern.escape(literal_value)
+                singletons[field] = literal_value
+            else:
+                # values that don't match the field's pattern could never be found, so just drop them
+                values = []
+                for value in literal_value:
+                    if value not in values and field_regex.match(value):
+                        values.append(value)
+                alternatives.append((field, field_index, values))
+
+        filled = Pattern("".join(new_parts), literals= singletons, types= self.types)
+
+        # the literal start of the filled pattern (up to and including any Filter's prefix), so names that don't start with it
+        # can be rejected without running the regex. (Not with alternation, where a name could match another branch instead.)
+        if "|" not in filled.value:
+            namePrefix = ""
+            for index, part in enumerate(new_parts):
+                if index in prefixes:
+                    namePrefix += prefixes[index]
+                    break
+                elif Pattern.isLiteralRegex(part) and re.match("(?:{})\\Z".format(part), Pattern.unescape(part)):
+                    namePrefix += Pattern.unescape(part)
+                else:
+                    break
+            if namePrefix and not filled.isLiteral:
+                filled.namePrefix = namePrefix
+
+        nCandidates = functools.reduce(operator.mul, (len(values) for field, index, values in alternatives), 1)
+        if nCandidates <= Pattern.max_candidates:
+            candidates = []
+            for combination in itertools.product(*(values for field, index, values in alternatives)):
+                candidate_parts = list(new_parts)
+                literals = dict(filled.literals)
+                for (field, index, values), value in zip(alternatives, combination):
+                    candidate_parts[index] = Pattern.escape(value)
+                    literals[field] = self._convert(field, value)
+                regex = "".join(candidate_parts)
+                if re.search(r"(?<!\\)(?:\\\\)*\$$", regex):
+                    # an (unescaped) end anchor doesn't change what a candidate name can be
+                    regex = regex[:-1]
+                if not Pattern.isLiteralRegex(regex):
+                    break
+                name = Pattern.unescape(regex)
+                if not filled.regex.match(name):
+                    # escapes like \t don't unescape to what they match: leave this to the regex
+                    break
+                candidates.append((name, literals))
+            else:
+                filled.candidates = candidates
+
+        return filled
+
+    @staticmethod
+    def isLiteralIterable(value):
+        # whether value is a (non-string, non-dict) collection of literal strings, which fill() can enumerate
+        return isinstance(value, (list, tuple, set, frozenset)) and len(value) <= Pattern.max_candidates and all(Pattern.isLiteral(v) for v in value)
 
     @staticmethod
     def isLiteral(pattern):
@@ -543,81 +3101,26 @@ class Pattern(object):
 
 
     def matches(self, string, **params):
+        return self._matches(string, Pattern.predicates(params, converters= self.converters))
+
+    def _matches(self, string, predicates, convert= True):
+        # predicates: { field: predicate } from Pattern.predicates, so walks can compile their params once rather than for every name
+        # convert: whether to convert typed fields' values (if not, predicates must be empty)
         if self.isLiteral:
             return self.literals if self.value == string else None
+        elif self.namePrefix is not None and not string.startswith(self.namePrefix):
+            return None
         else:
             match = self.regex.match(string)
             if match is not None:
                 groups = match.groupdict()
+                if convert and not self._convertGroups(groups):
+                    return None
                 groups.update(self.literals)
-                for field, restriction in iteritems(params):
+                for field, predicate in iteritems(predicates):
                     if field in groups:
-                        value = groups[field]
-
-                        ## TODO:
-                        ## - automatic conversion? (numeric, datetime)
-                        ## - binary arrays?
-                        ## - indexed pandas frames
-
-                        if restriction is None:
-                            continue
-
-                        ## Singletons
-                        if isinstance(restriction, basestring):
-                            if value == restriction:
-                                continue
-                            else:
-                                return None
-
-                        elif isinstance(restriction, numbers.Number) and not isinstance(restriction, bool):
-                            try:
-                                if float(value) == restriction:
-                                    continue
-                                else:
-                                    return None
-                            except ValueError:
-                                return None
-
-                        ## Dict-like exclusion: {value: False}
-                        try:
-                            restrictionValue = restriction[value]
-                            
-                            if not restrictionValue:
-                                return None
-                            else:
-                                raise TypeError("A dict excluding specific values from a field must only contain False; instead, got '{}' for key '{}' in field '{}'".format(restrictionValue, value, field))
-                                
-                        except KeyError:
-                            # Values not explicitly excluded are considered a match
-                            continue
-                        except TypeError:
-                            pass
-
-                        ## Iterable
-                        try:
-                            present = False
-                            for restrictionValue in restriction:
-                                if restrictionValue == value:
-                                    present = True
-                                    continue
-                            if not present:
-                                return None
-                            else:
-                                continue
-                        except TypeError:
-                            pass
-
-                        ## Callable
-                        # TODO: check for __call__ instead, and catch errors from within function nicely
-                        try:
-                            if restriction(value):
-                                continue
-                            else:
-                                return None
-                        except TypeError:
-                            pass
-
-                        raise TypeError("Unsupported type {} from parameter '{}'".format(type(restriction), field))
+                        if not predicate(groups[field]):
+                            return None
 
                     # Skip raising error for invalid fields, since matches is typically called with all params for whole endpoint,
                     # which don't all apply to just this one pattern
@@ -625,10 +3128,242 @@ class Pattern(object):
                     # else:
                     #   raise TypeError("'{}' is an invalid keyword argument. Fields in the pattern '{}' are: {}".format(field, self.value, self.fields))
             
+                if _intern is not None:
+                    # the same values (site names, years...) turn up in many names: have all their Entries share one copy
+                    for field, value in iteritems(groups):
+                        if isinstance(value, str):
+                            groups[field] = _intern(value)
                 return groups
             else:
                 return None
 
+    def _isMatch(self, predicates):
+        # function: name -> whether it matches this pattern and predicates,
+        # without building the dict of fields when none of predicates apply (and nothing needs converting)
+        if self._groupConverters or any(field in self.fields for field in predicates):
+            return lambda string: self._matches(string, predicates) is not None
+        regexMatch = self.regex.match
+        namePrefix = self.namePrefix
+        if namePrefix is not None:
+            return lambda string: string.startswith(namePrefix) and regexMatch(string) is not None
+        return lambda string: regexMatch(string) is not None
+
+    def _convertGroups(self, groups):
+        # converts the values of typed fields in groups (a match's groupdict) in place; False if one can't be converted
+        for field, converter in self._groupConverters:
+            value = groups[field]
+            if value is not None:
+                try:
+                    groups[field] = converter(value)
+                except ValueError:
+                    return False
+        return True
+
+    def _convert(self, field, value):
+        # a literal string value for a field, converted to the field's type
+        converter = self.converters.get(field)
+        if converter is None or not isinstance(value, basestring):
+            return value
+        try:
+            return converter(value)
+        except ValueError:
+            raise ValueError('"{}" is not a valid {} for the field "{}"'.format(value, self.types[field], field))
+
+    @staticmethod
+    def predicates(params, memo= None, converters= None):
+        # { field: restriction } -> { field: predicate }, leaving out fields that aren't restricted (None).
+        # memo: optional dict shared between calls, so a restriction object used for several fields or items is compiled once
+        # converters: { field: converter } for typed fields, whose values the predicates will be given already converted
+        predicates = {}
+        for field, restriction in iteritems(params):
+            if restriction is None:
+                continue
+            converter = converters.get(field) if converters else None
+            if memo is None:
+                predicates[field] = Pattern.predicate(restriction, field, converter)
+            else:
+                key = (id(restriction), field)
+                try:
+                    predicates[field] = memo[key][1]
+                except KeyError:
+                    predicate = Pattern.predicate(restriction, field, converter)
+                    # keep the restriction alive alongside its predicate, so its id can't be reused by another object
+                    memo[key] = (restriction, predicate)
+                    predicates[field] = predicate
+        return predicates
+
+    @staticmethod
+    def predicate(restriction, field, converter= None):
+        # Compiles a restriction (filter) into a function of a field's value, with the same meaning as Pattern.allows,
+        # but with the type of restriction worked out once, rather than for every name tested against it.
+        # For a typed field, give its converter: strings in the restriction are converted once here, and compared to converted values.
+
+        if restriction is None:
+            return lambda value: True
+
+        if isinstance(restriction, Filter):
+            return restriction.predicate(converter)
+
+        if converter is not None:
+            return Pattern._typedPredicate(restriction, field, converter)
+
+        ## Singletons
+        if isinstance(restriction, basestring):
+            return functools.partial(operator.eq, restriction)
+
+        elif isinstance(restriction, numbers.Number) and not isinstance(restriction, bool):
+            try:
+                number = float(restriction)
+            except TypeError:
+                # e.g. complex numbers
+                return functools.partial(Pattern.allows, restriction, field= field)
+
+            def equalsNumber(value):
+                try:
+                    return float(value) == number
+                except ValueError:
+                    return False
+            return equalsNumber
+
+        ## Dict-like exclusion: {value: False}
+        elif isinstance(restriction, Mapping):
+            # values mapped to True are allowed anyway, like any value not in the dict
+            excluded = frozenset(value for value, allowed in iteritems(restriction) if not allowed)
+            return lambda value: value not in excluded
+
+        elif hasattr(restriction, "__getitem__") and not isinstance(restriction, (list, tuple)):
+            # something indexable that isn't a plain dict or sequence: leave it to Pattern.allows to work out what it means
+            return functools.partial(Pattern.allows, restriction, field= field)
+
+        ## Iterable
+        try:
+            allowed = list(restriction)
+        except TypeError:
+            pass
+        else:
+            try:
+                return frozenset(allowed).__contains__
+            except TypeError:
+                # unhashable elements: fall back to checking each one
+                allowed = tuple(allowed)
+                return lambda value: value in allowed
+
+        ## Callable
+        if hasattr(restriction, "__call__"):
+            return restriction
+
+        raise TypeError("Unsupported type {} from parameter '{}'".format(type(restriction), field))
+
+    @staticmethod
+    def _typedPredicate(restriction, field, converter):
+        # Pattern.predicate for a typed field: values are already converted, so restrictions are compared to them as-is,
+        # except for strings, which are converted like the field's values.
+        def convert(value):
+            return converter(value) if isinstance(value, basestring) else value
+
+        ## Singletons
+        if isinstance(restriction, basestring):
+            try:
+                return functools.partial(operator.eq, converter(restriction))
+            except ValueError:
+                raise ValueError('"{}" can\'t be converted to the type of the field "{}"'.format(restriction, field))
+
+        ## Dict-like exclusion: {value: False}
+        elif isinstance(restriction, Mapping):
+            excluded = set()
+            for value, allowed in iteritems(restriction):
+                if not allowed:
+                    try:
+                        excluded.add(convert(value))
+                    except ValueError:
+                        # can't be the value of any Entry, so there's nothing to exclude
+                        pass
+            excluded = frozenset(excluded)
+            return lambda value: value not in excluded
+
+        ## Iterable
+        try:
+            iterator = iter(restriction)
+        except TypeError:
+            pass
+        else:
+            allowed = []
+            for value in iterator:
+                try:
+                    allowed.append(convert(value))
+                except ValueError:
+                    # can't be the value of any Entry, so it can't allow anything
+                    pass
+            try:
+                return frozenset(allowed).__contains__
+            except TypeError:
+                allowed = tuple(allowed)
+                return lambda value: value in allowed
+
+        ## Callable
+        if hasattr(restriction, "__call__"):
+            return restriction
+
+        ## Any other value (a number, date...) of the field's type
+        return functools.partial(operator.eq, restriction)
+
+    @staticmethod
+    def allows(restriction, value, field):
+        # whether a field's value passes the restriction (filter) given for that field
+
+        ## TODO:
+        ## - automatic conversion? (numeric, datetime)
+        ## - binary arrays?
+        ## - indexed pandas frames
+
+        if restriction is None:
+            return True
+
+        ## Singletons
+        if isinstance(restriction, basestring):
+            return value == restriction
+
+        elif isinstance(restriction, numbers.Number) and not isinstance(restriction, bool):
+            try:
+                return float(value) == restriction
+            except ValueError:
+                return False
+
+        ## Dict-like exclusion: {value: False}
+        try:
+            restrictionValue = restriction[value]
+            
+            if not restrictionValue:
+                return False
+            else:
+                raise TypeError("A dict excluding specific values from a field must only contain False; instead, got '{}' for key '{}' in field '{}'".format(restrictionValue, value, field))
+                
+        except KeyError:
+            # Values not explicitly excluded are considered a match
+            return True
+        except TypeError:
+            pass
+
+        ## Iterable
+        try:
+            present = False
+            for restrictionValue in restriction:
+                if restrictionValue == value:
+                    present = True
+                    continue
+            return present
+        except TypeError:
+            pass
+
+        ## Callable
+        # TODO: check for __call__ instead, and catch errors from within function nicely
+        try:
+            return bool(restriction(value))
+        except TypeError:
+            pass
+
+        raise TypeError("Unsupported type {} from parameter '{}'".format(type(restriction), field))
+
     def __repr__(self):
         return 'Pattern("{}")'.format(self.value)
 
@@ -638,51 +3373,155 @@ class Entry(object):
     # path: str
     # fields: {}
     # attrs for each field
-    # ._join(path, dict of fields) -> new Entry with path joined to this and fields extended
+    # ._join(path, dict of fields[, whether it's a directory]) -> new Entry with path joined to this and fields extended
     # ._exists()
+    # ._isdir()
     # ._listdir()
+    # ._scandir()
 
     # TODO: make Entry a fully-compatible Mapping type to allow ** expansion
 
+    # A walk makes a lot of Entries, so they're kept small: no per-instance __dict__, and rather than copying all its parent's
+    # fields and path, an Entry found by a walk just points to its parent, holding only its own name and the fields matched in it.
+    # Fields are looked up through the chain of parents; the path is joined the first time it's asked for.
+    __slots__ = ("_parent", "_name", "_path", "_own", "_flat", "_isDir", "_cache")
+
     def open(self, mode='r', buffering=-1, encoding=None, errors=None, newline=None):
         return open(self.path, mode= mode, buffering= buffering, encoding= encoding, errors= errors, newline= newline)
 
-    def __init__(self, path, fields= {}):
-        self.__dict__["path"] = path
-        self.__dict__["fields"] = fields
+    def mmap(self, offset= 0, length= None):
+        """
+        Memory-map the file (or `length` bytes of it starting at `offset`) read-only, without copying it.
 
-    def _join(self, path, newFields):
-        newPath = os.path.join(self.path, path)
-        newEntry = Entry(newPath, dict(self.fields))
-        newEntry.fields.update(newFields)
+        Returns a read-only memoryview, which can be handed to i.e. `numpy.frombuffer` or `struct.unpack_from`.
+        The map stays open as long as the memoryview, or anything made from it, is around; use it as a
+        context manager (`with entry.mmap() as view:`) to release it promptly. Offsets needn't be aligned to
+        pages. Mapping an empty range (i.e. an empty file) gives an empty memoryview.
+        """
+        with open(self.path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            end = size if length is None else min(size, offset + length)
+            if end <= offset:
+                return memoryview(b"")
+            # mmap offsets must be multiples of the allocation granularity: map from the boundary below, then slice
+            start = offset - offset % mmap.ALLOCATIONGRANULARITY
+            mapped = mmap.mmap(f.fileno(), end - start, access= mmap.ACCESS_READ, offset= start)
+        # the map is closed once this view (and any slices or exports of it) are released or garbage-collected
+        return memoryview(mapped)[offset - start:]
+
+    def __init__(self, path, fields= None, isDir= None, cache= None):
+        object.__setattr__(self, "_parent", None)
+        object.__setattr__(self, "_name", None)
+        object.__setattr__(self, "_path", path)
+        # fields matched in this Entry's own name (not to be modified: may be shared with other Entries)
+        object.__setattr__(self, "_own", fields if fields is not None else {})
+        # whether _own holds all the fields, so parents needn't be consulted
+        object.__setattr__(self, "_flat", True)
+        # whether this Entry is a directory, as told by the parent's listing; None if it wasn't found through one.
+        # (Not the os.DirEntry itself: that holds its own copy of the full path, and would outweigh the rest of the Entry.)
+        object.__setattr__(self, "_isDir", isDir)
+        # ListingCache of the Dataset this Entry belongs to, if any
+        object.__setattr__(self, "_cache", cache)
+
+    def _join(self, path, newFields, isDir= None):
+        newEntry = Entry(None, newFields, isDir, self._cache)
+        object.__setattr__(newEntry, "_parent", self)
+        object.__setattr__(newEntry, "_name", path)
+        object.__setattr__(newEntry, "_flat", False)
         return newEntry
 
+    @property
+    def path(self):
+        path = self._path
+        if path is None:
+            path = os.path.join(self._parent.path, self._name)
+            object.__setattr__(self, "_path", path)
+        return path
+
+    @property
+    def fields(self):
+        if not self._flat:
+            # gather up the fields from the chain into a dict of this Entry's own, which is safe to modify
+            chain = []
+            entry = self
+            while True:
+                chain.append(entry._own)
+                if entry._flat:
+                    break
+                entry = entry._parent
+            fields = {}
+            for own in reversed(chain):
+                fields.update(own)
+            object.__setattr__(self, "_own", fields)
+            object.__setattr__(self, "_flat", True)
+        return self._own
+
+    def _field(self, field):
+        # value of a field, looked up through the chain of parents without gathering them up
+        entry = self
+        while True:
+            try:
+                return entry._own[field]
+            except KeyError:
+                if entry._flat:
+                    raise
+                entry = entry._parent
+
+    def _extend(self, newFields):
+        # add fields to this Entry (without modifying its own fields, which may be shared)
+        own = dict(self._own)
+        own.update(newFields)
+        object.__setattr__(self, "_own", own)
+
+    def __reduce__(self):
+        # DirEntries and caches don't pickle, and the parent chain isn't worth carrying along
+        return (Entry, (self.path, dict(self.fields)))
+
+    def _openRange(self, offset= 0, length= None):
+        # the file, opened and moved to offset, and the number of bytes to read from there: `length`, or to the end of the file
+        # (its size found by fstat on the open file, not a separate stat)
+        f = open(self.path, "rb")
+        try:
+            size = max(os.fstat(f.fileno()).st_size - offset, 0)
+            if offset:
+                f.seek(offset)
+        except BaseException:
+            f.close()
+            raise
+        return f, size if length is None else min(size, length)
+
     def _exists(self):
-        return os.path.exists(self.path)
+        if self._isDir is not None:
+            return True
+        return self._cache.exists(self.path) if self._cache is not None else os.path.exists(self.path)
+    def _isdir(self):
+        return self._isDir if self._isDir is not None else os.path.isdir(self.path)
     def _listdir(self):
-        return os.listdir(self.path)
+        return self._cache.listdir(self.path) if self._cache is not None else os.listdir(self.path)
+    def _scandir(self):
+        return self._cache.scandir(self.path) if self._cache is not None else scandir(self.path)
 
     def iteritems(self):
         return iteritems(self.fields)
 
     def __getattr__(self, attr):
         try:
-            return self.fields[attr]
+            return self._field(attr)
         except KeyError:
-            try:
-                return self.__dict__[attr]
-            except KeyError:
-                raise AttributeError("Entry instance has no field or attribute '{}'".format(attr))
+            raise AttributeError("Entry instance has no field or attribute '{}'".format(attr))
 
     def __setattr__(self, attr, val):
-        if attr in self.__dict__:
-            self.__dict__[attr] = val
+        if attr == "path":
+            object.__setattr__(self, "_path", val)
+        elif attr == "fields":
+            object.__setattr__(self, "_own", val)
+            object.__setattr__(self, "_flat", True)
         else:
             self.fields[attr] = val
 
     def __getitem__(self, item):
         try:
-            return self.fields[item]
+            return self._field(item)
         except KeyError:
             if item == "path":
                 return self.path
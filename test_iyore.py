@@ -7,6 +7,10 @@ import re
 import random
 import math
 import string
+import datetime
+import json
+import itertools
+import threading
 
 import iyore
 
@@ -15,6 +19,17 @@ import pytest
 def touch(path):
     open(path, 'a').close()
 
+@pytest.fixture
+def listed_dirs(monkeypatch):
+    # the paths of the directories iyore lists (with scandir) during the test, in order
+    listed = []
+    realScandir = iyore.scandir
+    def countingScandir(path):
+        listed.append(path)
+        return realScandir(path)
+    monkeypatch.setattr(iyore, "scandir", countingScandir)
+    return listed
+
 base = "TestTree"
 structureFile = ".structure.txt"
 
@@ -180,7 +195,48 @@ class TestMatchingAndQuerying:
 
         assert subset == correct
 
-## TODO: TestItemSelection
+class TestItemSelection:
+    items = [{"char": "A", "num": "1"}, {"char": "A", "name": "MURI"}, {"char": ["B", "C"], "num": "4"}, {"char": "A", "num": "1"}, {"name": lambda n: n.startswith("W"), "num": {"1": False, "2": False, "3": False}}]
+
+    @staticmethod
+    def union(endpoint, items):
+        paths = set()
+        for item in items:
+            paths.update(entry.path for entry in endpoint(**item))
+        return paths
+
+    @pytest.mark.parametrize("engine, workers", [("scandir", None), ("listdir", None), ("scandir", 4)])
+    def test_items_gives_union_of_queries(self, makeTestTree, engine, workers):
+        ep = iyore.Endpoint(datafiles.parts, datafiles.base)
+        ep.engine = engine
+        result = [entry.path for entry in ep(items= self.items, workers= workers)]
+        assert set(result) == self.union(datafiles, self.items)
+        assert len(result) == len(set(result))
+
+    def test_items_no_duplicates(self, makeTestTree):
+        result = [entry.path for entry in datafiles(items= self.items)]
+        assert len(result) == len(set(result))
+
+    def test_items_fields(self, makeTestTree):
+        correct = { entry.path: entry.fields for entry in datafiles() }
+        for entry in datafiles(items= self.items):
+            assert entry.fields == correct[entry.path]
+
+    def test_items_plus_params(self, makeTestTree):
+        result = set(entry.path for entry in datafiles(items= self.items, name= ["MURI", "WOCR"]))
+        assert result == self.union(datafiles, [dict(item, name= ["MURI", "WOCR"]) for item in self.items])
+
+    def test_items_list_each_directory_once(self, makeTestTree, listed_dirs):
+        items = [{"char": char, "num": str(num)} for char in "ABCDE" for num in range(1, 5)] * 10
+        assert len(list(datafiles(items= items))) == 5 * 4 * 5
+        assert len(listed_dirs) == len(set(listed_dirs)) == 5
+
+    def test_items_invalid(self, makeTestTree):
+        with pytest.raises(TypeError):
+            list(datafiles(items= 4))
+        with pytest.raises(TypeError):
+            list(datafiles(items= [["char", "A"]]))
+
 
 class TestSorting:
     @pytest.fixture(scope= "module", params= ["manual", "parsed"])
@@ -231,6 +287,1177 @@ class TestSorting:
 
         assert result == correct
 
+    def test_sort_with_n_gives_first_n_in_order(self, makeTestTree, datafiles_endpoint):
+        correct = sorted(datafiles_endpoint(), key= lambda e: (e.num, e.name))[:7]
+        result = list(datafiles_endpoint(sort= ("num", "name"), n= 7))
+
+        assert result == correct
+
+    def test_sort_with_n_is_stable(self, makeTestTree, datafiles_endpoint):
+        # ties keep walk order, just like a full sort
+        correct = sorted(datafiles_endpoint(), key= lambda e: e.num)[:12]
+        result = list(datafiles_endpoint(sort= "num", n= 12))
+
+        assert result == correct
+
+    def test_subset_nsmallest_nlargest(self, makeTestTree, datafiles_endpoint):
+        entries = list(datafiles_endpoint())
+        assert list(datafiles_endpoint().nsmallest(5, "name")) == sorted(entries, key= lambda e: e.name)[:5]
+        assert list(datafiles_endpoint().nlargest(3, ("char", "num"))) == sorted(entries, key= lambda e: (e.char, e.num), reverse= True)[:3]
+        assert list(datafiles_endpoint().nsmallest(2)) == sorted(entries)[:2]
+        assert list(datafiles_endpoint().path.nlargest(1)) == [max(e.path for e in entries)]
+
+class TestStreamingSort:
+    @pytest.fixture
+    def endpoint(self, tmpdir):
+        root = str(tmpdir)
+        for site in ["WOCR", "MURI", "UPST"]:
+            for year in ["2015", "2013", "2014"]:
+                os.makedirs(os.path.join(root, site, year))
+                for hour in ["12", "00", "06"]:
+                    for kind in ["b", "a"]:
+                        touch(os.path.join(root, site, year, "{}_{}.txt".format(hour, kind)))
+        return iyore.Endpoint([r"(?P<site>[A-Z]{4})$", r"(?P<year>\d{4})$", r"(?P<hour>\d\d)_(?P<kind>\w)\.txt"], root)
+
+    @pytest.mark.parametrize("sort", [["site", "year"], ["site", "year", "hour", "kind"], ["site", "hour"], "year", ["year", "site"], ["kind", "site"]])
+    def test_matches_full_sort(self, endpoint, sort):
+        key = (lambda e: getattr(e, sort)) if isinstance(sort, str) else (lambda e: tuple(getattr(e, field) for field in sort))
+        correct = sorted(TestEngines.with_engine(endpoint, "listdir")(), key= key)
+        result = list(endpoint(sort= sort))
+        assert result == correct
+        assert [e.fields for e in result] == [e.fields for e in correct]
+
+    def test_streams_when_levels_line_up(self, endpoint, listed_dirs):
+        first = next(iter(endpoint(sort= ["site", "year"])))
+        assert (first.site, first.year) == ("MURI", "2013")
+        # the root, one site, and one year: not the whole tree
+        assert len(listed_dirs) == 3
+
+    def test_with_n(self, endpoint, listed_dirs):
+        correct = sorted(endpoint(), key= lambda e: (e.site, e.hour))[:4]
+        del listed_dirs[:]
+        assert list(endpoint(sort= ["site", "hour"], n= 4)) == correct
+        assert len(listed_dirs) == 1 + 1 + 3
+
+    def test_filters_and_key_functions(self, endpoint):
+        params = {"site": ["UPST", "MURI"], "hour": lambda h: h != "06"}
+        assert list(endpoint(sort= ["site", "year"], **params)) == sorted(endpoint(**params), key= lambda e: (e.site, e.year))
+        assert list(endpoint(sort= lambda e: e.path)) == sorted(endpoint(), key= lambda e: e.path)
+
+class TestEngines:
+    @pytest.fixture(params= ["scandir", "listdir"])
+    def engine(self, request):
+        return request.param
+
+    @staticmethod
+    def with_engine(endpoint, engine):
+        ep = iyore.Endpoint(endpoint.parts, endpoint.base)
+        ep.engine = engine
+        ep.datetime = endpoint.datetime
+        return ep
+
+    @pytest.mark.parametrize("params", [{}, {"name": "MURI"}, {"char": ["A", "B"], "num": {"1": False}}, {"name": lambda s: s.startswith("T")}])
+    def test_engines_agree(self, makeTestTree, engine, params):
+        correct = set(entry.path for entry in self.with_engine(datafiles, "listdir")(**params))
+        result = list(self.with_engine(datafiles, engine)(**params))
+        assert set(entry.path for entry in result) == correct
+        assert len(result) == len(correct)
+
+    def test_engines_agree_on_fields(self, makeTestTree, engine):
+        correct = { entry.path: entry.fields for entry in self.with_engine(siteDocs, "listdir")() }
+        result = { entry.path: entry.fields for entry in self.with_engine(siteDocs, engine)() }
+        assert result == correct
+
+    def test_unknown_engine(self, makeTestTree):
+        with pytest.raises(ValueError):
+            list(self.with_engine(basic, "find")())
+
+    def test_scandir_skips_files_at_intermediate_levels(self, tmpdir):
+        os.mkdir(os.path.join(str(tmpdir), "site_A"))
+        touch(os.path.join(str(tmpdir), "site_A", "data.txt"))
+        touch(os.path.join(str(tmpdir), "site_B"))
+        ep = self.with_engine(iyore.Endpoint([r"site_(?P<site>\w)", r"data\.txt"], str(tmpdir)), "scandir")
+        assert [entry.site for entry in ep()] == ["A"]
+
+    def test_scandir_missing_literal_level(self, tmpdir):
+        ep = self.with_engine(iyore.Endpoint([r"nothing here", r"(?P<name>.+)\.txt"], str(tmpdir)), "scandir")
+        assert list(ep()) == []
+
+    def test_scandir_does_not_stat_listed_names(self, makeTestTree, monkeypatch):
+        calls = []
+        exists = os.path.exists
+        def counting_exists(path):
+            calls.append(path)
+            return exists(path)
+        monkeypatch.setattr(os.path, "exists", counting_exists)
+
+        entries = list(self.with_engine(datafiles, "scandir")())
+        assert len(entries) == 100
+        assert calls == []
+        for entry in entries:
+            assert entry._exists()
+            assert not entry._isdir()
+        assert calls == []
+
+class TestParallel:
+    @pytest.mark.parametrize("workers", [1, 3, 16])
+    def test_parallel_ordered_matches_serial_order(self, makeTestTree, workers):
+        correct = [entry.path for entry in datafiles(char= ["A", "C", "D"])]
+        result = [entry.path for entry in datafiles(char= ["A", "C", "D"], workers= workers)]
+        assert result == correct
+
+    def test_parallel_unordered_gives_same_entries(self, makeTestTree):
+        correct = { entry.path: entry.fields for entry in datafiles(num= {"2": False}) }
+        result = list(datafiles(num= {"2": False}, workers= 4, ordered= False))
+        assert len(result) == len(correct)
+        assert { entry.path: entry.fields for entry in result } == correct
+
+    def test_parallel_items(self, makeTestTree):
+        items = [{"char": "A", "num": "1"}, {"char": "E", "name": "MURI"}]
+        correct = [entry.path for entry in datafiles(items= items)]
+        assert [entry.path for entry in datafiles(items= items, workers= 2)] == correct
+
+    def test_parallel_n(self, makeTestTree):
+        assert len(list(datafiles(n= 7, workers= 4, ordered= False))) == 7
+        assert [e.path for e in datafiles(n= 7, workers= 4)] == [e.path for e in datafiles(n= 7)]
+
+    def test_parallel_invalid_workers(self, makeTestTree):
+        with pytest.raises(ValueError):
+            list(datafiles(workers= 0))
+
+    def test_stopping_early_cancels_listings(self, makeTestTree, monkeypatch):
+        submitted = []
+        shutdowns = []
+        Executor = iyore.futures.ThreadPoolExecutor
+        class RecordingExecutor(Executor):
+            def submit(self, *args, **kwargs):
+                future = Executor.submit(self, *args, **kwargs)
+                submitted.append(future)
+                return future
+            def shutdown(self, wait= True):
+                shutdowns.append(wait)
+                Executor.shutdown(self, wait)
+        monkeypatch.setattr(iyore.futures, "ThreadPoolExecutor", RecordingExecutor)
+
+        # the first leaf directory is listed straight away; the rest wait until the test is done
+        gate = threading.Event()
+        leaves = []
+        realScandir = iyore.scandir
+        def gatedScandir(path):
+            if os.path.basename(path).startswith("dir_"):
+                leaves.append(path)
+                if len(leaves) > 1:
+                    gate.wait(10)
+            return realScandir(path)
+        monkeypatch.setattr(iyore, "scandir", gatedScandir)
+
+        try:
+            assert len(list(datafiles(char= ["A", "B", "C", "D", "E"], workers= 2).head(3))) == 3
+            assert shutdowns == [False]
+            # with 2 workers, at most 2 listings had started: the rest queued up were cancelled
+            assert any(future.cancelled() for future in submitted)
+        finally:
+            gate.set()
+
+class TestAsync:
+    @staticmethod
+    def collect(asubset, limit= None):
+        # drive an AsyncSubset from a fresh event loop, without needing async syntax
+        asyncio = pytest.importorskip("asyncio")
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        results = []
+        try:
+            aiterator = asubset.__aiter__()
+            while limit is None or len(results) < limit:
+                try:
+                    results.append(loop.run_until_complete(aiterator.__anext__()))
+                except StopAsyncIteration:
+                    break
+            loop.run_until_complete(aiterator.aclose())
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+        return results
+
+    def test_aiter_matches_sync(self, makeTestTree):
+        correct = [entry.path for entry in datafiles(char= ["B", "D"], num= {"3": False})]
+        result = self.collect(datafiles.aiter(char= ["B", "D"], num= {"3": False}))
+        assert [entry.path for entry in result] == correct
+
+    def test_aiter_sort_and_n(self, makeTestTree):
+        correct = [entry.path for entry in datafiles(sort= "num", n= 10)]
+        result = self.collect(datafiles.aiter(sort= "num", n= 10, buffer= 2))
+        assert [entry.path for entry in result] == correct
+
+    def test_aiter_items_parallel(self, makeTestTree):
+        items = [{"char": "A", "num": "1"}, {"char": "E", "name": "MURI"}]
+        correct = set(entry.path for entry in datafiles(items= items))
+        result = self.collect(datafiles.aiter(items= items, workers= 4, ordered= False))
+        assert set(entry.path for entry in result) == correct
+
+    def test_aiter_stop_early(self, makeTestTree):
+        result = self.collect(datafiles.aiter(buffer= 1), limit= 3)
+        assert len(result) == 3
+
+    def test_aiter_raises_errors(self, makeTestTree):
+        with pytest.raises(TypeError):
+            self.collect(datafiles.aiter(character= "pooh"))
+
+class TestIndex:
+    structure = r"""
+sites
+    (?P<site>[A-Z]{4})
+        (?P<year>\d{4})
+            audio: (?P<site>[A-Z]{4})_(?P<hour>\d\d)\.wav
+    docs: (?P<site>[A-Z]{4}) (?P<title>.+)\.txt
+"""
+
+    @staticmethod
+    def age(path):
+        # make a directory look like it was last modified an hour ago, so the index trusts its modification time
+        then = os.path.getmtime(path) - 3600
+        os.utime(path, (then, then))
+
+    @pytest.fixture
+    def tree(self, tmpdir):
+        root = str(tmpdir)
+        with open(os.path.join(root, structureFile), "w") as f:
+            f.write(self.structure)
+        os.mkdir(os.path.join(root, "sites"))
+        for site in ["MURI", "WOCR", "UPST"]:
+            os.mkdir(os.path.join(root, "sites", site))
+            touch(os.path.join(root, "sites", "{} notes.txt".format(site)))
+            for year in ["2014", "2015"]:
+                os.mkdir(os.path.join(root, "sites", site, year))
+                for hour in ["00", "06", "12"]:
+                    touch(os.path.join(root, "sites", site, year, "{}_{}.wav".format(site, hour)))
+        for dirpath, dirnames, filenames in os.walk(root):
+            self.age(dirpath)
+        return root
+
+    @pytest.mark.parametrize("params", [{}, {"site": "MURI"}, {"year": ["2014"], "hour": {"06": False}}, {"hour": 12}, {"site": lambda s: s.startswith("W")}])
+    def test_index_matches_walk(self, tree, params):
+        ds = iyore.Dataset(tree)
+        indexed = iyore.Dataset(tree, index= True)
+        assert os.path.exists(os.path.join(tree, iyore.indexFileName))
+        correct = { entry.path: entry.fields for entry in ds.audio(**params) }
+        result = list(indexed.audio(**params))
+        assert len(result) == len(correct)
+        assert { entry.path: entry.fields for entry in result } == correct
+
+    def test_index_items_values_and_sort(self, tree):
+        ds = iyore.Dataset(tree)
+        indexed = iyore.Dataset(tree, index= True)
+        items = [{"site": "MURI", "year": "2015"}, {"site": "MURI"}, {"hour": "00"}]
+        assert set(indexed.audio(items= items)) == set(ds.audio(items= items))
+        assert len(list(indexed.audio(items= items))) == len(set(ds.audio(items= items)))
+        assert indexed.docs.values("site") == ds.docs.values("site") == {"MURI", "WOCR", "UPST"}
+        assert [e.path for e in indexed.audio(sort= ("hour", "path"))] == [e.path for e in ds.audio(sort= ("hour", "path"))]
+
+    def test_refresh_relists_only_changed_directories(self, tree, listed_dirs):
+        indexed = iyore.Dataset(tree, index= True)
+        assert len(list(indexed.audio())) == 18
+
+        newYear = os.path.join(tree, "sites", "WOCR", "2016")
+        os.mkdir(newYear)
+        touch(os.path.join(newYear, "WOCR_18.wav"))
+        os.remove(os.path.join(tree, "sites", "MURI", "2014", "MURI_00.wav"))
+        shutil.rmtree(os.path.join(tree, "sites", "UPST", "2015"))
+
+        del listed_dirs[:]
+        assert len(list(indexed.audio())) == 18  # not refreshed yet
+        indexed.refresh()
+        # the base directory is always re-listed, since writing the index itself modifies it
+        assert set(os.path.relpath(path, tree) for path in listed_dirs) == {".", os.path.join("sites", "WOCR"), os.path.join("sites", "WOCR", "2016"), os.path.join("sites", "MURI", "2014"), os.path.join("sites", "UPST")}
+
+        assert set(indexed.audio()) == set(iyore.Dataset(tree).audio())
+        assert len(list(indexed.audio())) == 18 + 1 - 1 - 3
+
+    def test_index_rebuilt_when_structure_changes(self, tree):
+        indexed = iyore.Dataset(tree, index= True)
+        assert len(list(indexed.docs())) == 3
+        with open(os.path.join(tree, structureFile), "a") as f:
+            f.write("    years: (?P<site>[A-Z]{4})$\n")
+        indexed = iyore.Dataset(tree, index= True)
+        assert len(list(indexed.years())) == 3
+
+    def test_refresh_without_index(self, tree):
+        with pytest.raises(ValueError):
+            iyore.Dataset(tree).refresh()
+
+class TestListingCache:
+    def test_repeated_queries_hit_cache(self, makeTestTree, listed_dirs):
+        ds = iyore.Dataset(os.path.join(base, structureFile), cache= True)
+        first = list(ds.datafiles(char= ["A", "B"]))
+        nListed = len(listed_dirs)
+        assert nListed > 0
+        second = list(ds.datafiles(char= ["A", "B"]))
+        assert len(listed_dirs) == nListed
+        assert second == first
+        assert ds.cache.hits >= nListed
+        assert ds.cache.misses == nListed
+
+    def test_cache_gives_same_results(self, makeTestTree):
+        ds = iyore.Dataset(os.path.join(base, structureFile), cache= iyore.ListingCache(ttl= None, maxsize= 3))
+        for i in range(2):
+            assert set(ds.datafiles(name= "MURI")) == set(datafiles(name= "MURI"))
+            assert set(ds.basic()) == set(basic())
+        assert len(ds.cache) <= 3
+
+    def test_exists_answered_from_parent_listing(self, makeTestTree, monkeypatch):
+        cache = iyore.ListingCache()
+        cache.listdir(os.path.join(base, "static three"))
+        monkeypatch.setattr(os.path, "exists", lambda path: pytest.fail("stat'ed {}".format(path)))
+        assert cache.exists(os.path.join(base, "static three", "file_A.txt"))
+        assert not cache.exists(os.path.join(base, "static three", "file_Q.txt"))
+
+    def test_lru_eviction(self, makeTestTree):
+        cache = iyore.ListingCache(maxsize= 2)
+        for name in ["static one", "static two", "static one", "static three"]:
+            cache.listdir(os.path.join(base, name))
+        assert cache.misses == 3
+        cache.listdir(os.path.join(base, "static one"))
+        assert cache.hits == 2
+        cache.listdir(os.path.join(base, "static two"))
+        assert cache.misses == 4
+
+    def test_ttl_expiry(self, makeTestTree, monkeypatch):
+        now = [1000.0]
+        monkeypatch.setattr(iyore, "_clock", lambda: now[0])
+        cache = iyore.ListingCache(ttl= 10)
+        cache.listdir(base)
+        now[0] += 5
+        cache.listdir(base)
+        now[0] += 11
+        cache.listdir(base)
+        assert (cache.hits, cache.misses) == (1, 2)
+
+    def test_invalidate(self, tmpdir):
+        root = str(tmpdir)
+        os.mkdir(os.path.join(root, "sub"))
+        cache = iyore.ListingCache(ttl= None)
+        assert cache.listdir(root) == ["sub"]
+        assert cache.listdir(os.path.join(root, "sub")) == []
+        assert not cache.exists(os.path.join(root, "sub", "new"))
+        touch(os.path.join(root, "sub", "new"))
+        assert cache.listdir(os.path.join(root, "sub")) == []
+        cache.invalidate(root)
+        assert len(cache) == 0
+        assert cache.listdir(os.path.join(root, "sub")) == ["new"]
+        cache.invalidate()
+        assert len(cache) == 0
+
+    def test_invalidate_deleted_path(self, tmpdir):
+        root = str(tmpdir)
+        path = os.path.join(root, "gone.txt")
+        touch(path)
+        cache = iyore.ListingCache(ttl= None)
+        assert cache.listdir(root) == ["gone.txt"]
+        assert cache.exists(path)
+        os.remove(path)
+        assert cache.exists(path)
+        cache.invalidate(path)
+        assert not cache.exists(path)
+        assert cache.listdir(root) == []
+
+class TestMultiEndpointWalk:
+    structure = r"""
+sites
+    (?P<site>[A-Z]{4})$
+        years: (?P<year>\d{4})$
+            audio: (?P<site>[A-Z]{4})_(?P<hour>\d\d)\.wav
+            spectra: (?P<site>[A-Z]{4})_(?P<hour>\d\d)\.png
+        log: log\.txt
+"""
+
+    @pytest.fixture
+    def dataset(self, tmpdir):
+        root = str(tmpdir)
+        with open(os.path.join(root, structureFile), "w") as f:
+            f.write(self.structure)
+        os.mkdir(os.path.join(root, "sites"))
+        for site in ["MURI", "WOCR", "UPST"]:
+            os.mkdir(os.path.join(root, "sites", site))
+            if site != "UPST":
+                touch(os.path.join(root, "sites", site, "log.txt"))
+            for year in ["2014", "2015"]:
+                os.mkdir(os.path.join(root, "sites", site, year))
+                for hour in ["00", "12"]:
+                    touch(os.path.join(root, "sites", site, year, "{}_{}.wav".format(site, hour)))
+                    touch(os.path.join(root, "sites", site, year, "{}_{}.png".format(site, hour)))
+        return iyore.Dataset(root)
+
+    def test_walk_gives_each_endpoints_entries_in_order(self, dataset):
+        pairs = list(dataset.walk())
+        for name in ["years", "audio", "spectra", "log"]:
+            correct = list(dataset[name]())
+            result = [entry for endpoint, entry in pairs if endpoint == name]
+            assert result == correct
+            assert [entry.fields for entry in result] == [entry.fields for entry in correct]
+        assert len(pairs) == 6 + 12 + 12 + 2
+
+    def test_walk_lists_each_directory_once(self, dataset, listed_dirs):
+        list(dataset.walk(["audio", "spectra", "log"]))
+        assert len(listed_dirs) == len(set(listed_dirs)) == 1 + 3 + 6
+
+    def test_walk_with_filters(self, dataset):
+        pairs = list(dataset.walk(["audio", "spectra"], site= "WOCR", hour= ["12"]))
+        assert len(pairs) == 4
+        assert all(entry.site == "WOCR" and entry.hour == "12" for endpoint, entry in pairs)
+
+    def test_walk_invalid(self, dataset):
+        with pytest.raises(TypeError):
+            dataset.walk(["audio", "log"], hour= "00")
+        with pytest.raises(KeyError):
+            dataset.walk(["audio", "pictures"])
+
+class TestCompactEntries:
+    def test_entries_have_no_dict(self, makeTestTree):
+        entry = next(iter(datafiles()))
+        assert not hasattr(entry, "__dict__")
+        with pytest.raises(AttributeError):
+            entry.not_a_field
+
+    def test_joined_fields_and_path(self):
+        root = iyore.Entry("root", {"a": "1"})
+        child = root._join("sub", {"b": "2"})
+        grandchild = child._join("leaf.txt", {"a": "3", "c": "4"})
+        assert grandchild.path == os.path.join("root", "sub", "leaf.txt")
+        assert (grandchild.a, grandchild["b"], grandchild.c) == ("3", "2", "4")
+        assert grandchild.fields == {"a": "3", "b": "2", "c": "4"}
+        assert child.fields == {"a": "1", "b": "2"}
+
+    def test_setting_fields_leaves_shared_values_alone(self):
+        shared = {"b": "2"}
+        parent = iyore.Entry("root", {"a": "1"})
+        one, two = parent._join("one", shared), parent._join("two", shared)
+        one.b = "changed"
+        one["a"] = "changed too"
+        assert (one.a, one.b) == ("changed too", "changed")
+        assert (two.a, two.b) == ("1", "2")
+        assert shared == {"b": "2"} and parent.fields == {"a": "1"}
+
+    def test_field_values_are_shared(self, makeTestTree):
+        entries = list(datafiles(char= "B"))
+        assert all(entry.name is entries[0].name for entry in entries if entry.name == entries[0].name)
+
+    def test_pickle(self, makeTestTree):
+        import pickle
+        entry = next(iter(datafiles()))
+        copied = pickle.loads(pickle.dumps(entry))
+        assert copied == entry and copied.fields == entry.fields
+
+class TestColumns:
+    def test_to_columns(self, makeTestTree):
+        entries = list(siteDocs())
+        columns = siteDocs().to_columns()
+        assert list(columns.keys()) == ["path", "extension", "name", "title"]
+        assert columns["path"] == [entry.path for entry in entries]
+        for field in ["extension", "name", "title"]:
+            column = columns[field]
+            assert column.values() == [entry[field] for entry in entries]
+            assert sorted(column.categories) == sorted(set(entry[field] for entry in entries))
+
+    def test_missing_fields_and_empty(self, makeTestTree):
+        columns = datafiles(char= "A").to_columns(fields= ["name", "nope"], path= False)
+        assert list(columns.keys()) == ["name", "nope"]
+        assert set(columns["nope"].codes) == {-1} and columns["nope"].categories == []
+        assert len(columns["name"].categories) == 5
+
+        empty = datafiles(char= "Z").to_columns(fields= ["name"])
+        assert empty["path"] == [] and list(empty["name"].codes) == []
+
+    def test_to_numpy(self, makeTestTree):
+        np = pytest.importorskip("numpy")
+        entries = list(datafiles())
+        array = datafiles().to_numpy(fields= ["char", "num"])
+        assert array.dtype.names == ("path", "char", "num")
+        assert list(array["path"]) == [entry.path for entry in entries]
+        assert list(array["num"]) == [entry.num for entry in entries]
+
+    def test_to_pandas(self, makeTestTree):
+        pd = pytest.importorskip("pandas")
+        entries = list(datafiles())
+        frame = datafiles().to_pandas()
+        assert list(frame.columns) == ["path", "char", "name", "num"]
+        assert isinstance(frame["name"].dtype, pd.CategoricalDtype)
+        assert list(frame["name"]) == [entry.name for entry in entries]
+        assert list(datafiles().to_pandas(categorical= False)["num"]) == [entry.num for entry in entries]
+
+class TestTypedFields:
+    structure = r"""
+(?P<site>[A-Z]{4})$
+    (?P<year:int>\d{4})$
+        recordings: (?P<hour:int>\d+)_(?P<day:date>\d{8})\.txt
+"""
+
+    @pytest.fixture
+    def dataset(self, tmpdir):
+        root = str(tmpdir)
+        with open(os.path.join(root, structureFile), "w") as f:
+            f.write(self.structure)
+        for site in ["MURI", "WOCR"]:
+            for year in ["2014", "2015"]:
+                os.makedirs(os.path.join(root, site, year))
+                for hour in ["9", "10", "23"]:
+                    touch(os.path.join(root, site, year, "{}_{}0704.txt".format(hour, year)))
+                touch(os.path.join(root, site, year, "1_{}1399.txt".format(year)))
+        return iyore.Dataset(root)
+
+    def test_values_are_converted(self, dataset):
+        entries = list(dataset.recordings())
+        assert len(entries) == 12
+        assert all(isinstance(entry.year, int) and isinstance(entry.hour, int) for entry in entries)
+        assert {entry.day for entry in entries} == {datetime.date(2014, 7, 4), datetime.date(2015, 7, 4)}
+
+    def test_filters_compare_typed_values(self, dataset):
+        def hours(**params):
+            return sorted((entry.year, entry.hour) for entry in dataset.recordings(**params))
+        assert hours(year= 2015, hour= 9) == [(2015, 9)] * 2
+        assert hours(year= "2015", hour= [9, "10", "x"]) == [(2015, 9), (2015, 9), (2015, 10), (2015, 10)]
+        assert hours(hour= lambda h: h > 9, year= {"2014": False}) == [(2015, 10), (2015, 10), (2015, 23), (2015, 23)]
+        assert len(hours(day= datetime.date(2014, 7, 4))) == 6
+        with pytest.raises(ValueError):
+            dataset.recordings(hour= "nine")
+
+    def test_literal_values_are_converted(self, dataset):
+        entries = list(dataset.recordings(year= "2014", site= "MURI"))
+        assert len(entries) == 3
+        assert all(entry.year == 2014 for entry in entries)
+
+    def test_sort_by_typed_value(self, dataset):
+        assert [entry.hour for entry in dataset.recordings(site= "MURI", year= 2014, sort= "hour")] == [9, 10, 23]
+
+    def test_items_compare_typed_values(self, dataset):
+        def hours(items, **kwargs):
+            return sorted((entry.site, entry.year, entry.hour) for entry in dataset.recordings(items= items, **kwargs))
+        expected = [("MURI", 2014, 9), ("MURI", 2014, 10), ("MURI", 2014, 23)]
+        assert hours([{"site": "MURI", "year": [2014]}]) == expected
+        assert hours([{"site": "MURI", "year": 2014}]) == expected
+        assert hours([{"site": "MURI", "year": iyore.between(2014, 2014)}]) == expected
+        assert hours([{"site": "MURI", "year": [2014]}], workers= 2) == expected
+        assert all(isinstance(entry.year, int) for entry in dataset.recordings(items= [{"site": "MURI"}]))
+        assert len(hours([{"year": iyore.between(2014, 2015), "hour": 9}])) == 4
+
+    def test_index_gives_typed_values(self, dataset, tmpdir):
+        indexed = iyore.Dataset(str(tmpdir), index= True)
+        for params in [{}, {"year": "2015"}, {"hour": [9, 23], "site": "WOCR"}]:
+            assert [e.fields for e in indexed.recordings(**params)] == [e.fields for e in dataset.recordings(sort= "path", **params)]
+        assert indexed.recordings.values("year") == {2014, 2015}
+
+    def test_custom_and_unknown_types(self, monkeypatch):
+        monkeypatch.setitem(iyore.converters, "upper", lambda s: s.upper())
+        pattern = iyore.Pattern(r"(?P<name:upper>[a-z]+)_(?P<n:int>\d+)")
+        assert pattern.matches("abc_007") == {"name": "ABC", "n": 7}
+        assert pattern.types == {"name": "upper", "n": "int"}
+        with pytest.raises(ValueError):
+            iyore.Pattern(r"(?P<name:nonsense>\w+)")
+
+class TestFilterObjects:
+    @pytest.fixture
+    def endpoint(self, tmpdir):
+        root = str(tmpdir)
+        for year in range(2008, 2017):
+            os.mkdir(os.path.join(root, str(year)))
+            for site in ["MURI", "MUSE", "WOCR"]:
+                touch(os.path.join(root, str(year), "{}_{}.txt".format(site, year % 10)))
+        return iyore.Endpoint([r"(?P<year>\d{4})$", r"(?P<site>[A-Z]{4})_(?P<digit>\d+)\.txt"], root)
+
+    def test_range_enumerates_fixed_width_digits(self):
+        pattern = iyore.Pattern(r"dir_(?P<year>\d{4})_(?P<month>\d\d)$")
+        filled = pattern.fill({"year": iyore.between(2010, 2011), "month": iyore.lt(3)})
+        assert sorted(name for name, fields in filled.candidates) == ["dir_2010_00", "dir_2010_01", "dir_2010_02", "dir_2011_00", "dir_2011_01", "dir_2011_02"]
+        # variable width, unbounded, or too many: left to the regex
+        assert pattern.fill({"year": iyore.gt(2010)}).candidates is None
+        assert iyore.Pattern(r"(?P<n>\d+)").fill({"n": iyore.between(1, 3)}).candidates is None
+
+    def test_range_semantics(self):
+        for restriction, allowed in [(iyore.between(3, 5), ["3", "4", "5"]), (iyore.gt(4), ["5", "6"]), (iyore.lt(4), ["1", "2", "3"]), (iyore.between("b", "d"), ["b", "c", "d"])]:
+            values = ["1", "2", "3", "4", "5", "6", "a", "b", "c", "d", "e"]
+            assert [value for value in values if restriction(value)] == allowed
+            predicate = iyore.Pattern.predicate(restriction, "field")
+            assert [value for value in values if predicate(value)] == allowed
+        typed = iyore.Pattern.predicate(iyore.between("2", 4.5), "field", int)
+        assert [value for value in range(7) if typed(value)] == [2, 3, 4]
+
+    def test_range_walk_probes_for_names(self, endpoint, listed_dirs):
+        result = list(endpoint(year= iyore.between(2010, 2012)))
+        assert sorted(set(entry.year for entry in result)) == ["2010", "2011", "2012"]
+        assert len(result) == 9
+        # the three year directories are listed, but not the root
+        assert len(listed_dirs) == 3
+        assert set(endpoint(year= iyore.gt(2014), digit= iyore.lt(6))) == set(e for e in endpoint() if e.year > "2014" and int(e.digit) < 6)
+
+    def test_prefix(self, endpoint):
+        filled = endpoint.parts[1].fill({"site": iyore.prefix("MU")})
+        assert filled.namePrefix == "MU"
+        assert filled.matches("WOCR_1.txt") is None and filled.matches("MURI_1.txt") == {"site": "MURI", "digit": "1"}
+        assert set(e.site for e in endpoint(site= iyore.prefix("MU"))) == {"MURI", "MUSE"}
+        with pytest.raises(TypeError):
+            iyore.Pattern.predicate(iyore.prefix("1"), "field", int)
+
+    def test_literal_start_is_checked_first(self):
+        filled = iyore.Pattern(r"(?P<site>[A-Z]{4})_(?P<n>\d)\.txt").fill({"site": "MURI"})
+        assert filled.namePrefix == "MURI_"
+        assert iyore.Pattern(r"(?P<site>[A-Z]{4})_x|y").fill({"site": "MURI"}).namePrefix is None
+
+class TestDatetimeFields:
+    structure = r"""
+@datetime time(year, month, day, hour, minute, second)
+(?P<year>\d{4})$
+    (?P<month>\d\d)$
+        (?P<day>\d\d)$
+            recordings: (?P<hour>\d\d)_(?P<minute>\d\d)_(?P<second>\d\d)\.wav
+"""
+
+    @pytest.fixture
+    def dataset(self, tmpdir):
+        root = str(tmpdir)
+        with open(os.path.join(root, structureFile), "w") as f:
+            f.write(self.structure)
+        for year in ["2014", "2015"]:
+            for month in ["01", "06", "12"]:
+                for day in ["01", "15", "31"]:
+                    # (June 31st isn't a real date)
+                    os.makedirs(os.path.join(root, year, month, day))
+                    for time in ["00_00_00", "12_30_00"]:
+                        touch(os.path.join(root, year, month, day, time + ".wav"))
+        return iyore.Dataset(root)
+
+    def times(self, entries):
+        return sorted((entry.time for entry in entries), key= lambda time: (time is None, time or datetime.datetime.min))
+
+    def test_sort_by_datetime_after_fields(self, dataset):
+        entries = list(dataset.recordings(month= "01", day= "15", sort= ["year", "time"]))
+        assert [entry.time for entry in entries] == [
+            datetime.datetime(2014, 1, 15), datetime.datetime(2014, 1, 15, 12, 30),
+            datetime.datetime(2015, 1, 15), datetime.datetime(2015, 1, 15, 12, 30),
+        ]
+
+    def test_entries_get_datetimes(self, dataset):
+        entries = list(dataset.recordings(year= "2015", month= "06"))
+        assert self.times(entries)[:2] == [datetime.datetime(2015, 6, 1), datetime.datetime(2015, 6, 1, 12, 30)]
+        assert {entry.day: entry.time for entry in entries}["31"] is None
+
+    def test_walk_gives_datetimes(self, dataset):
+        walked = [entry for name, entry in dataset.walk(["recordings"], year= "2015")]
+        called = list(dataset.recordings(year= "2015"))
+        assert [entry.time for entry in walked] == [entry.time for entry in called]
+        assert [entry.fields for entry in walked] == [entry.fields for entry in called]
+        assert datetime.datetime(2015, 6, 1, 12, 30) in set(entry.time for entry in walked)
+
+    @pytest.mark.parametrize("window", [
+        (datetime.datetime(2015, 6, 14, 12), datetime.datetime(2015, 6, 16)),
+        (datetime.date(2014, 12, 31), datetime.date(2015, 1, 2)),
+        (None, datetime.datetime(2014, 1, 15, 12, 30)),
+        (datetime.datetime(2015, 12, 31, 12), None)
+    ])
+    def test_time_range(self, dataset, window):
+        start, end = [ datetime.datetime(w.year, w.month, w.day) if type(w) is datetime.date else w for w in window ]
+        correct = [ t for t in self.times(dataset.recordings()) if t is not None and (start is None or t >= start) and (end is None or t < end) ]
+        assert correct
+        assert self.times(dataset.recordings(time_range= window)) == correct
+        assert self.times(TestEngines.with_engine(dataset.recordings, "listdir")(time_range= window)) == correct
+        assert self.times(dataset.recordings(time_range= window, workers= 3)) == correct
+
+    def test_time_range_prunes_directories(self, dataset, listed_dirs):
+        result = list(dataset.recordings(time_range= (datetime.datetime(2015, 6, 14, 12), datetime.datetime(2015, 6, 16))))
+        assert self.times(result) == [datetime.datetime(2015, 6, 15), datetime.datetime(2015, 6, 15, 12, 30)]
+        assert sorted(os.path.relpath(path, dataset.base.path) for path in listed_dirs) == sorted([".", "2015", os.path.join("2015", "06"), os.path.join("2015", "06", "15")])
+
+    @pytest.mark.parametrize("engine, workers", [("scandir", None), ("listdir", None), ("scandir", 2)])
+    def test_time_range_prunes_items(self, dataset, listed_dirs, engine, workers):
+        endpoint = TestEngines.with_engine(dataset.recordings, engine)
+        window = (datetime.datetime(2015, 6, 14, 12), datetime.datetime(2015, 6, 16))
+        result = list(endpoint(items= [{"year": "2015"}, {"month": "06"}], time_range= window, workers= workers))
+        assert self.times(result) == [datetime.datetime(2015, 6, 15), datetime.datetime(2015, 6, 15, 12, 30)]
+        if engine == "scandir":
+            assert set(os.path.relpath(path, dataset.base.path) for path in listed_dirs) == {".", "2015", os.path.join("2015", "06"), os.path.join("2015", "06", "15")}
+
+    def test_time_range_with_index(self, dataset, tmpdir):
+        indexed = iyore.Dataset(str(tmpdir), index= True)
+        window = (datetime.datetime(2014, 6, 1, 6), datetime.datetime(2014, 12, 15))
+        assert self.times(indexed.recordings(time_range= window)) == self.times(dataset.recordings(time_range= window))
+
+    def test_declaration_errors(self, dataset, tmpdir):
+        with pytest.raises(TypeError):
+            datafiles(time_range= (None, None))
+        with pytest.raises(TypeError):
+            dataset.recordings(time_range= "2015")
+        with pytest.raises(ValueError):
+            dataset.recordings.addDatetime("other", ["year"])
+        with open(os.path.join(str(tmpdir), structureFile), "w") as f:
+            f.write(self.structure.replace("second)", "millisecond)"))
+        with pytest.raises(ValueError):
+            iyore.Dataset(str(tmpdir))
+
+class TestSubsets:
+    def test_tail(self, makeTestTree):
+        entries = list(datafiles())
+        assert list(datafiles().tail(3)) == entries[-3:]
+        assert list(datafiles().tail(1000)) == entries
+        assert list(datafiles().tail(0)) == []
+        assert list(iyore.Subset(range(10)).tail()) == [5, 6, 7, 8, 9]
+
+    def test_uncached_is_one_shot(self, makeTestTree):
+        subset = datafiles()
+        assert len(list(subset)) == 100
+        assert list(subset) == []
+        with pytest.raises(TypeError):
+            len(datafiles())
+
+    def test_truth_doesnt_use_up(self, makeTestTree):
+        subset = datafiles()
+        assert subset
+        assert bool(datafiles(name= "NONE"))
+        assert len(list(subset)) == 100
+
+    def test_stopping_early_closes_walk(self):
+        closed = []
+        def walk():
+            try:
+                for i in range(100):
+                    yield i
+            finally:
+                closed.append(True)
+
+        assert list(iyore.Subset(walk()).head(3)) == [0, 1, 2]
+        assert closed == [True]
+
+    def test_cached_replays_without_walking_again(self, makeTestTree, listed_dirs):
+        subset = datafiles(char= ["A", "B"]).cached()
+        first = list(subset)
+        nListed = len(listed_dirs)
+        assert nListed > 0
+        assert list(subset) == first
+        assert len(subset) == 40
+        assert list(subset.name.head(3)) == [entry.name for entry in first[:3]]
+        assert len(listed_dirs) == nListed
+
+    def test_cached_interleaved_and_partial(self):
+        subset = iyore.Subset(iter(range(6))).cached()
+        one, two = iter(subset), iter(subset)
+        assert [next(one), next(one), next(two)] == [0, 1, 0]
+        assert len(subset) == 6
+        assert list(one) == [2, 3, 4, 5] and list(two) == [1, 2, 3, 4, 5]
+        assert list(subset + iyore.Subset([6])) == list(range(7))
+
+def nameLength(entry):
+    # module-level, so it can be sent to a process pool
+    return len(entry.name)
+
+
+class TestParallelMap:
+    @pytest.mark.parametrize("chunksize", [1, 3])
+    def test_ordered_matches_serial(self, makeTestTree, chunksize):
+        serial = list(datafiles().map(lambda e: e.path))
+        parallel = list(datafiles().map(lambda e: e.path, workers= 4, chunksize= chunksize))
+        assert parallel == serial
+
+    def test_unordered(self, makeTestTree):
+        serial = list(datafiles().map(lambda e: e.path))
+        parallel = list(datafiles().map(lambda e: e.path, workers= 4, ordered= False, chunksize= 2))
+        assert sorted(parallel) == sorted(serial)
+
+    def test_process_executor(self, makeTestTree):
+        serial = list(datafiles().map(nameLength))
+        assert list(datafiles().map(nameLength, workers= 2, executor= "process", chunksize= 10)) == serial
+
+    def test_bounded_in_flight(self):
+        pulled = []
+        def items():
+            for i in range(1000):
+                pulled.append(i)
+                yield i
+        results = iyore.Subset(items()).map(lambda x: x * 2, workers= 2, chunksize= 5)
+        assert list(results.head(3)) == [0, 2, 4]
+        assert len(pulled) <= 2 * 2 * 5 + 5
+
+    def test_exception_has_entry(self, makeTestTree):
+        def failOnB(entry):
+            if entry.char == "B":
+                raise RuntimeError("bad file")
+            return entry
+        with pytest.raises(RuntimeError) as excinfo:
+            list(datafiles().map(failOnB, workers= 3))
+        assert excinfo.value.entry.char == "B"
+        if hasattr(excinfo.value, "add_note"):
+            assert excinfo.value.entry.path in excinfo.value.__notes__[0]
+
+    def test_bad_arguments(self):
+        with pytest.raises(ValueError):
+            list(iyore.Subset([1]).map(str, workers= 0))
+        with pytest.raises(ValueError):
+            list(iyore.Subset([1]).map(str, workers= 2, executor= "fibers"))
+
+class TestPrefetchRead:
+    @pytest.fixture
+    def files(self, tmpdir):
+        entries = []
+        for i in range(20):
+            path = tmpdir.join("file{:02d}.bin".format(i))
+            path.write_binary(bytes(bytearray([i] * (i * 10))))
+            entries.append(iyore.Entry(str(path), {"i": i}))
+        return entries
+
+    def test_contents_in_order(self, files):
+        results = list(iyore.Subset(files).read(prefetch= 3))
+        assert [entry for entry, _ in results] == files
+        for entry, contents in results:
+            assert contents == bytes(bytearray([entry.i] * (entry.i * 10)))
+
+    def test_byte_range(self, files):
+        for entry, contents in iyore.Subset(files).read(offset= 5, length= 10):
+            assert contents == bytes(bytearray([entry.i] * max(0, min(10, entry.i * 10 - 5))))
+
+    def test_byte_budget(self, files, monkeypatch):
+        reading = []
+        maxHeld = [0]
+        realRead = iyore._readOpened
+        def trackingRead(opened):
+            reading.append(opened[1])
+            maxHeld[0] = max(maxHeld[0], sum(reading))
+            return realRead(opened)
+        monkeypatch.setattr(iyore, "_readOpened", trackingRead)
+        # sizes come from the open files, not a stat beforehand
+        monkeypatch.setattr(iyore.os.path, "getsize", None)
+        monkeypatch.setattr(iyore.os, "stat", None)
+
+        for entry, contents in iyore.Subset(files).read(prefetch= 8, max_bytes= 400):
+            reading.remove(len(contents))
+        # the read-ahead stays within budget; on top of it is just the file handed to the consumer
+        assert maxHeld[0] <= 400 + 190
+        assert reading == []
+
+    def test_byte_budget_errors_and_early_stop(self, files, tmpdir):
+        missing = iyore.Entry(str(tmpdir.join("missing.bin")))
+        results = iter(iyore.Subset(files[:3] + [missing] + files[3:]).read(prefetch= 4, max_bytes= 50))
+        assert [entry for entry, _ in itertools.islice(results, 3)] == files[:3]
+        with pytest.raises(IOError):
+            next(results)
+        assert [entry for entry, _ in iyore.Subset(files).read(prefetch= 4, max_bytes= 100).head(5)] == files[:5]
+        results = iter(iyore.Subset(files).read(prefetch= 4, max_bytes= 100, offset= 15, length= 20))
+        assert [len(contents) for _, contents in itertools.islice(results, 4)] == [0, 0, 5, 15]
+
+    def test_empty_and_early_stop(self, files):
+        assert list(iyore.Subset([]).read()) == []
+        assert [entry for entry, _ in iyore.Subset(files).read(prefetch= 4).head(2)] == files[:2]
+
+    def test_endpoint(self, makeTestTree):
+        assert [entry for entry, contents in datafiles().read()] == list(datafiles())
+
+class TestMmap:
+    @pytest.fixture
+    def entry(self, tmpdir):
+        path = tmpdir.join("data.bin")
+        path.write_binary(bytes(bytearray(range(256))) * 1000)
+        return iyore.Entry(str(path), {"name": "data"})
+
+    def test_whole_file(self, entry):
+        with entry.mmap() as view:
+            assert view.readonly
+            assert view.nbytes == 256000
+            assert view[:4].tobytes() == b"\x00\x01\x02\x03"
+
+    def test_unaligned_range(self, entry):
+        view = entry.mmap(offset= 70001, length= 5)
+        assert view.tobytes() == bytes(bytearray([(70001 + i) % 256 for i in range(5)]))
+        assert entry.mmap(offset= 255990).nbytes == 10
+        assert entry.mmap(offset= 255990, length= 100).nbytes == 10
+
+    def test_empty(self, entry, tmpdir):
+        path = tmpdir.join("empty.bin")
+        path.write_binary(b"")
+        assert iyore.Entry(str(path)).mmap().tobytes() == b""
+        assert entry.mmap(offset= 300000).tobytes() == b""
+        assert entry.mmap(length= 0).tobytes() == b""
+
+    def test_numpy_zero_copy(self, entry):
+        np = pytest.importorskip("numpy")
+        array = np.frombuffer(entry.mmap(offset= 256), dtype= "u1")
+        assert not array.flags.writeable
+        assert array[:3].tolist() == [0, 1, 2]
+
+    def test_subset_releases_maps(self, entry):
+        views = []
+        for e, view in iyore.Subset([entry, entry]).mmap(length= 2):
+            assert view.tobytes() == b"\x00\x01"
+            views.append(view)
+        with pytest.raises(ValueError):
+            # released
+            views[0].tobytes()
+
+    def test_subset_keeps_exported_maps(self, entry):
+        np = pytest.importorskip("numpy")
+        arrays = [ np.frombuffer(view, dtype= "u1") for e, view in iyore.Subset([entry, entry]).mmap(length= 3) ]
+        assert [ array.tolist() for array in arrays ] == [[0, 1, 2], [0, 1, 2]]
+
+class TestLevelLimitedQueries:
+    @pytest.fixture
+    def recordings(self, tmpdir):
+        for site in ["ABCD", "EFGH", "IJKL"]:
+            for year in ["2014", "2015"]:
+                tmpdir.ensure("site_{}".format(site), year, dir= True)
+                for n in range(3):
+                    tmpdir.ensure("site_{}".format(site), year, "rec_{}.wav".format(n))
+        # a site with no recordings yet
+        tmpdir.ensure("site_MNOP", dir= True)
+        return iyore.Endpoint([r"site_(?P<site>\w+)", r"(?P<year:int>\d{4})", r"rec_(?P<take>\d+)\.wav"], str(tmpdir))
+
+    @pytest.fixture(params= ["scandir", "listdir"])
+    def listings(self, request, monkeypatch, listed_dirs):
+        if request.param == "listdir":
+            realListdir = os.listdir
+            def countingListdir(path):
+                listed_dirs.append(path)
+                return realListdir(path)
+            monkeypatch.setattr(iyore.os, "listdir", countingListdir)
+        return request.param, listed_dirs
+
+    def test_values_stops_at_field_level(self, recordings, listings):
+        recordings.engine, listed = listings
+        assert recordings.values("site") == {"ABCD", "EFGH", "IJKL", "MNOP"}
+        assert len(listed) == 1
+        del listed[:]
+        assert recordings.values("year") == {2014, 2015}
+        assert len(listed) == 5
+        assert recordings.values("year", site= "ABCD") == {2014, 2015}
+        assert recordings.values("take", site= "ABCD", year= 2015) == {"0", "1", "2"}
+        assert recordings.values("site", take= "2") == {"ABCD", "EFGH", "IJKL"}
+        with pytest.raises(KeyError):
+            recordings.values("nonexistent")
+
+    def test_count(self, recordings, listings):
+        recordings.engine, listed = listings
+        assert recordings.count() == 18 == len(list(recordings()))
+        for params in [dict(site= "ABCD"), dict(year= 2014), dict(take= "1"), dict(take= iyore.between("1", "2")), dict(year= iyore.gt(2014), take= ["0", "2"])]:
+            assert recordings.count(**params) == len(list(recordings(**params)))
+
+    def test_count_static(self, makeTestTree):
+        assert datafiles.count() == 100
+        assert datafiles.count(char= "A", num= "1") == 5
+        assert siteDocs.count() == len(list(siteDocs()))
+        assert basic.count(char= "B") == 1
+
+    def test_info_fields(self, recordings, capsys):
+        recordings.info(fields= ["site"])
+        out = capsys.readouterr()[0]
+        assert "site: 4 values" in out
+        assert "4 directories at level 1" in out
+        recordings.info()
+        out = capsys.readouterr()[0]
+        assert "year: 2 values" in out and "18 Entries" in out
+
+class TestSampling:
+    @pytest.fixture
+    def recordings(self, tmpdir):
+        for s in range(30):
+            for year in range(2010, 2010 + s % 4 + 1):
+                for n in range(s % 7):
+                    tmpdir.ensure("site_S{:02d}".format(s), str(year), "rec_{}.wav".format(n))
+        return iyore.Endpoint([r"site_(?P<site>\w+)", r"(?P<year>\d{4})", r"rec_(?P<take>\d+)\.wav"], str(tmpdir))
+
+    def test_full_sample_is_exact(self, recordings):
+        total = recordings.count()
+        assert recordings.estimate_count(sample= 1) == (total, total, total)
+        assert recordings.estimate_count(sample= 1, site= "S05") == (recordings.count(site= "S05"),) * 3
+
+    def test_uniform_tree_is_exact(self, tmpdir):
+        for site in range(10):
+            for n in range(4):
+                tmpdir.ensure("site_{}".format(site), "rec_{}.wav".format(n))
+        endpoint = iyore.Endpoint([r"site_(?P<site>\d+)", r"rec_(?P<take>\d+)\.wav"], str(tmpdir))
+        assert endpoint.estimate_count(sample= 0.3, seed= 1) == (40, 40, 40)
+
+    def test_estimate_and_interval(self, recordings):
+        total = recordings.count()
+        estimates = [ recordings.estimate_count(sample= 0.3, seed= seed) for seed in range(40) ]
+        assert all(estimate.low <= estimate.value <= estimate.high for estimate in estimates)
+        # unbiased, and the intervals mostly cover the truth
+        assert abs(sum(estimate.value for estimate in estimates) / len(estimates) - total) < 0.15 * total
+        assert sum(estimate.low <= total <= estimate.high for estimate in estimates) >= 30
+        assert recordings.estimate_count(sample= 0.3, seed= 7) == recordings.estimate_count(sample= 0.3, seed= 7)
+
+    def test_listdir_cap(self, recordings, listed_dirs):
+        recordings.estimate_count(sample= 0.5, max_listdirs= 12, seed= 0)
+        assert len(listed_dirs) <= 12
+        with pytest.raises(ValueError):
+            recordings.estimate_count(max_listdirs= 0)
+        with pytest.raises(ValueError):
+            recordings.estimate_count(sample= 0)
+
+    def test_chao1(self):
+        assert iyore._chao1([2, 2, 5]) == (3, 3, 3)
+        estimate = iyore._chao1([1, 1, 1, 1, 2, 2, 3, 3, 3, 3])
+        assert estimate.value == 14
+        assert 10 <= estimate.low < 14 < estimate.high
+
+    def test_sampled_info(self, recordings, capsys):
+        recordings.info(sample= 0.3, seed= 0)
+        out = capsys.readouterr()[0]
+        assert "site: 25 values" in out
+        assert "Entries, from" in out
+
+class TestStructureCache:
+    structure = r"""
+sites
+    site_(?P<site>\w+)
+        (?P<year:int>\d{4})
+            audio: (?P<take>\d+)_(?P<hour>\d\d)\.wav
+            @datetime start(year)
+docs
+    docs: (?P<name>.+)\.txt
+"""
+
+    @pytest.fixture
+    def tree(self, tmpdir):
+        tmpdir.join(".structure.txt").write(self.structure)
+        for site in ["ABCD", "EFGH"]:
+            for year in ["2014", "2015"]:
+                for take in range(3):
+                    tmpdir.ensure("sites", "site_" + site, year, "{}_0{}.wav".format(take, take))
+        tmpdir.ensure("docs", "readme.txt")
+        return tmpdir
+
+    def test_loads_from_cache(self, tree, monkeypatch):
+        plain = iyore.Dataset(str(tree))
+        iyore.Dataset(str(tree), structure_cache= True)
+        assert tree.join(".structure.cache.json").check()
+
+        def noParsing(*args, **kwargs):
+            raise AssertionError("structure file parsed again")
+        monkeypatch.setattr(iyore.Dataset, "_parseStructureFile", noParsing)
+        cached = iyore.Dataset(str(tree), structure_cache= True)
+        assert sorted(cached.endpoints) == ["audio", "docs"]
+        assert cached.audio.datetime == ("start", ("year",))
+        # nothing is compiled until it's used
+        assert all(part._regex is None for part in cached.audio.parts)
+        assert list(cached.audio()) == list(plain.audio())
+        assert list(cached.audio(site= "ABCD", year= 2015, take= ["0", "2"])) == list(plain.audio(site= "ABCD", year= 2015, take= ["0", "2"]))
+        assert cached.audio.values("year") == {2014, 2015}
+        assert [ entry.start for entry in cached.audio(year= 2014) ][0] == datetime.datetime(2014, 1, 1)
+
+    def test_touched_but_unchanged(self, tree, monkeypatch):
+        iyore.Dataset(str(tree), structure_cache= True)
+        structureFile = tree.join(".structure.txt")
+        structureFile.setmtime(structureFile.mtime() + 10)
+        monkeypatch.setattr(iyore.Dataset, "_parseStructureFile", lambda *args, **kwargs: pytest.fail("parsed again"))
+        assert sorted(iyore.Dataset(str(tree), structure_cache= True).endpoints) == ["audio", "docs"]
+
+    def test_changed_structure(self, tree):
+        iyore.Dataset(str(tree), structure_cache= True)
+        structureFile = tree.join(".structure.txt")
+        structureFile.write(self.structure.replace("docs: ", "notes: "))
+        structureFile.setmtime(structureFile.mtime() + 10)
+        assert sorted(iyore.Dataset(str(tree), structure_cache= True).endpoints) == ["audio", "notes"]
+        # and the cache was brought up to date
+        assert "notes" in tree.join(".structure.cache.json").read()
+
+    def test_bad_cache(self, tree):
+        cachePath = tree.join("elsewhere.json")
+        cachePath.write("{ not json")
+        assert sorted(iyore.Dataset(str(tree), structure_cache= str(cachePath)).endpoints) == ["audio", "docs"]
+        cachePath.write(cachePath.read().replace('"version": {}'.format(iyore.structureCacheVersion), '"version": -1'))
+        assert sorted(iyore.Dataset(str(tree), structure_cache= str(cachePath)).endpoints) == ["audio", "docs"]
+        assert '"version": {}'.format(iyore.structureCacheVersion) in cachePath.read()
+
+class TestBenchmarkTree:
+    def test_generated_tree(self, tmpdir):
+        from benchmarks import tree
+        levels = tree.standardLevels(depth= 3, fanout= 4, files= 6)
+        root = str(tmpdir.join("bench"))
+        structurePath = tree.makeTree(root, levels)
+        ds = iyore.Dataset(structurePath)
+        assert ds.data.count() == tree.countFiles(levels) == 96
+        assert len(ds.data.values("site")) == 4
+        # made again with the same arguments: reused
+        assert tree.makeTree(root, levels) == structurePath
+        with pytest.raises(ValueError):
+            tree.makeTree(root, levels, seed= 1)
+
+    def test_jitter_is_reproducible(self, tmpdir):
+        from benchmarks import tree
+        levels = tree.standardLevels(depth= 4, fanout= 5, files= 10)
+        counts = [ iyore.Dataset(tree.makeTree(str(tmpdir.join(name)), levels, jitter= 0.5, seed= 3)).data.count() for name in ["a", "b"] ]
+        assert counts[0] == counts[1] != tree.countFiles(levels)
+
+class TestQueryStats:
+    def test_off_by_default(self, makeTestTree):
+        subset = datafiles()
+        assert subset.stats is None
+        assert all(part.stats is None for part in datafiles.parts)
+
+    def test_counts(self, makeTestTree, listed_dirs):
+        subset = datafiles(stats= True, num= ["1", "2"])
+        stats = subset.stats
+        assert stats.entries == 0 and not stats.done
+        entries = list(subset)
+        assert stats.done
+        assert stats.entries == len(entries) == 50
+        assert stats.seconds > 0
+        assert sum(level.listdirs for level in stats.levels) == len(listed_dirs)
+
+        static, dirs, files = stats.levels
+        assert static.joins == static.entries == 1
+        assert dirs.listdirs == 1
+        # dir_A to dir_E, dir_X and dir_Z (the other non-matching names in "static one" are files or don't match)
+        assert dirs.entries == 7
+        assert files.listdirs == 7
+        assert files.names == 5 * 5 * 5 + 1
+        assert files.entries == 50
+        assert files.rejected == files.names - 50
+        assert stats.filters["num"].calls == 5 * 4 * 5
+        assert stats.filters["num"].rejected == 5 * 2 * 5
+        json.dumps(stats.as_dict())
+        assert "50 Entries" in repr(stats)
+
+    @pytest.mark.parametrize("engine", ["scandir", "listdir"])
+    def test_items(self, makeTestTree, engine):
+        endpoint = TestEngines.with_engine(datafiles, engine)
+        subset = endpoint(stats= True, items= [{"char": "A", "num": "1"}, {"char": ["A", "B"], "num": "2"}])
+        assert len(list(subset)) == 15
+        static, dirs, files = subset.stats.levels
+        assert static.entries >= 1
+        assert dirs.entries >= 2
+        assert files.entries == 15
+        assert subset.stats.entries == 15
+
+    def test_timed_by_timer(self, makeTestTree, monkeypatch):
+        ticks = []
+        def timer():
+            ticks.append(None)
+            return float(len(ticks))
+        monkeypatch.setattr(iyore, "_timer", timer)
+        subset = datafiles(stats= True, char= "A")
+        list(subset)
+        assert ticks and subset.stats.seconds >= 1
+        assert subset.stats.seconds == int(subset.stats.seconds)
+
+    def test_listdir_engine_probes(self, makeTestTree):
+        endpoint = TestEngines.with_engine(datafiles, "listdir")
+        subset = endpoint(stats= True, char= "B", name= ["MURI", "WOCR"], num= "3")
+        assert len(list(subset)) == 2
+        static, dirs, files = subset.stats.levels
+        assert static.probes == 1 and dirs.probes == 1
+        assert files.listdirs == 0 and files.probes == 2 and files.missing == 0
+        assert sum(level.listdirs for level in subset.stats.levels) == 0
+
+    def test_hooks(self, makeTestTree, monkeypatch):
+        reported = []
+        subset = datafiles(stats= reported.append, char= "A")
+        assert subset.stats is not None
+        # stopping early still reports
+        assert len(list(subset.head(3))) == 3
+        assert reported == [subset.stats] and reported[0].done and reported[0].entries == 3
+
+        monkeypatch.setattr(iyore.Endpoint, "stats_hook", reported.append)
+        entries = list(basic())
+        assert len(reported) == 2 and reported[1].entries == len(entries)
+        # sorting does the walk up front: that counts too
+        list(datafiles(sort= "num"))
+        assert reported[2].entries == 100 and reported[2].levels[-1].entries == 100
+
 class TestLiteralEscapingAndUnescaping:
     def test_isLiteralRegex_no_specials(self):
         regex = "a sdf_456"
@@ -397,6 +1624,78 @@ class TestFillingWithLiterals:
             filled = filled_results[path]
             assert filled.fields == actual.fields
 
+class TestProbingIterables:
+    def test_fill_iterable_gives_candidates(self):
+        filled = iyore.Pattern(r"dir_(?P<char>[A-Z])").fill({"char": ["A", "B", "1", "A"]})
+        assert filled.candidates == [("dir_A", {"char": "A"}), ("dir_B", {"char": "B"})]
+
+    def test_fill_iterables_and_singletons_combine(self):
+        pattern = iyore.Pattern(r"(?P<name>[A-Z]{4})_(?P<num>\d)_(?P<char>[A-Z])\.txt")
+        filled = pattern.fill({"name": "MURI", "num": ["1", "2"], "char": ("A", "B")})
+        assert sorted(name for name, fields in filled.candidates) == ["MURI_1_A.txt", "MURI_1_B.txt", "MURI_2_A.txt", "MURI_2_B.txt"]
+        for name, fields in filled.candidates:
+            assert pattern.matches(name) == fields
+
+    def test_fill_partial_gives_no_candidates(self):
+        pattern = iyore.Pattern(r"(?P<name>[A-Z]{4})_(?P<num>\d)_(?P<char>[A-Z])\.txt")
+        assert pattern.fill({"num": ["1", "2"]}).candidates is None
+        assert pattern.fill({"num": "1", "name": "MURI", "char": "C"}).candidates == [("MURI_1_C.txt", {"num": "1", "name": "MURI", "char": "C"})]
+
+    def test_iterable_filter_skips_listing(self, makeTestTree, listed_dirs):
+        result = list(datafiles(char= ["A", "C"]))
+        assert set(os.path.relpath(path, base) for path in listed_dirs) == {os.path.join("static one", "dir_A"), os.path.join("static one", "dir_C")}
+        assert set(entry.path for entry in result) == set(entry.path for entry in datafiles() if entry.char in "AC")
+
+    def test_fully_specified_leaf_is_probed(self, makeTestTree, listed_dirs):
+        params = {"char": "D", "name": ["MURI", "WOCR", "ABCD"], "num": ["1", "2"]}
+        result = list(datafiles(**params))
+        assert listed_dirs == []
+        correct = [entry for entry in TestEngines.with_engine(datafiles, "listdir")() if entry.char == "D" and entry.name in params["name"] and entry.num in params["num"]]
+        assert set(result) == set(correct)
+        assert { e.path: e.fields for e in result } == { e.path: e.fields for e in correct }
+
+    @pytest.mark.parametrize("engine", ["scandir", "listdir"])
+    def test_probe_limit_falls_back_to_listing(self, makeTestTree, engine):
+        ep = TestEngines.with_engine(datafiles, engine)
+        probed = set(ep(char= ["A", "B", "C"]))
+        ep.probe_limit = 2
+        assert set(ep(char= ["A", "B", "C"])) == probed
+        assert len(probed) == 60
+
+class TestRestrictionPredicates:
+    values = ["A", "B", "C", "10", "10.0", "2", "", "xyz"]
+    restrictions = ["A", 10, 2.0, ["A", "C"], ("B",), {"A", "B"}, frozenset(), {"A": False, "C": False}, {"B": False, "C": True}, lambda v: v.isdigit(), None]
+
+    @pytest.mark.parametrize("restriction", restrictions)
+    def test_predicate_agrees_with_allows(self, restriction):
+        predicate = iyore.Pattern.predicate(restriction, "field")
+        for value in self.values:
+            assert bool(predicate(value)) == iyore.Pattern.allows(restriction, value, "field")
+
+    def test_predicates_skip_unrestricted_fields(self):
+        predicates = iyore.Pattern.predicates({"a": None, "b": ["1"]})
+        assert list(predicates.keys()) == ["b"]
+        assert predicates["b"]("1") and not predicates["b"]("2")
+
+    def test_predicates_memo_compiles_shared_restrictions_once(self):
+        allowed = ["A", "B"]
+        memo = {}
+        first = iyore.Pattern.predicates({"char": allowed}, memo)
+        second = iyore.Pattern.predicates({"char": allowed, "name": "MURI"}, memo)
+        assert first["char"] is second["char"]
+        assert len(memo) == 2
+
+    def test_one_shot_iterables_work_for_whole_query(self, makeTestTree):
+        # a generator can only be iterated once, but is used to test every name in the walk
+        result = list(datafiles(num= (str(i) for i in range(3))))
+        assert set(result) == set(entry for entry in datafiles() if entry.num in ["0", "1", "2"])
+
+    def test_unsupported_restriction(self, makeTestTree):
+        with pytest.raises(TypeError):
+            iyore.Pattern.predicate(object(), "field")
+        with pytest.raises(TypeError):
+            datafiles(num= object())
+
 class TestStructureFileParsing:
     @staticmethod
     def assert_simple_structure(ds):